@@ -0,0 +1,58 @@
+"""Compare ORM and bulk Core loading of synthetic release data into SQLite
+
+Usage: python benchmarks/bench_bulk.py [--packages N] [--db URL]
+"""
+import argparse
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+
+def count_rows(db):
+    return sum(db.execute("select count(*) from {}".format(t.name)).scalar()
+               for t in wensleydale2.bulk.TABLES)
+
+def fresh_db(url):
+    if url.startswith('sqlite:///') and os.path.exists(url[10:]):
+        os.remove(url[10:])
+    db = create_engine(url)
+    wensleydale2.init(db)
+    return db
+
+def run_orm(db, fetched):
+    session = wensleydale2.Session(bind=db)
+    for i, (name, releases) in enumerate(fetched, 1):
+        wensleydale2.pkg_add_fetched(session, name, releases)
+        if i % 100 == 0:
+            session.commit()
+    session.commit()
+
+def run_bulk(db, fetched):
+    with db.connect() as conn:
+        wensleydale2.bulk_load(conn, fetched, batch=100)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=2000)
+    parser.add_argument("--db", default="sqlite://")
+    args = parser.parse_args()
+
+    src = FakeSource(generate(args.packages))
+    fetched = [wensleydale2.fetch_package(src, name) for name in src.packages()]
+
+    results = {}
+    for label, fn in [('orm', run_orm), ('bulk', run_bulk)]:
+        db = fresh_db(args.db)
+        start = time.perf_counter()
+        fn(db, fetched)
+        elapsed = time.perf_counter() - start
+        rows = count_rows(db)
+        results[label] = rows / elapsed
+        print("{:5s} {:8d} rows {:8.2f}s {:10.0f} rows/s".format(label, rows, elapsed, rows / elapsed))
+    print("speedup: x{:.1f}".format(results['bulk'] / results['orm']))
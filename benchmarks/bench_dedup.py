@@ -0,0 +1,102 @@
+"""Database size with shared texts, against storing every value in place
+
+The fake data is reshaped to repeat itself the way PyPI does: most
+releases of a package carry the same description as the one before, and
+some packages paste their whole licence into the license field. The "in
+place" database is the same data with each text copied back into the
+rows that use it, as before texts were shared.
+
+Usage: python benchmarks/bench_dedup.py [--packages N] [--dir DIR]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import iter_generate
+
+LICENCE = ' '.join(['Permission is hereby granted, free of charge, to any person obtaining a copy'] * 15)
+
+def pypi_shaped(n):
+    rnd = random.Random(0)
+    for name, rels in iter_generate(n):
+        description = None
+        licence = LICENCE if rnd.random() < 0.1 else None
+        releases = []
+        for ver, (data, urls) in rels.items():
+            if description is not None and rnd.random() < 0.7:
+                data['description'] = description
+            description = data['description']
+            if licence:
+                data['license'] = licence
+            releases.append((ver, data, urls))
+        yield name, releases
+
+# Tables holding texts, the texts they hold, and their indexes in the old layout
+TABLES = [
+    ('releases', ['description', 'license'], ["create unique index {0}_uq on {0} (package_id, version)"]),
+    ('classifiers', ['classifier'], ["create index {0}_release on {0} (release_id)"]),
+    ('dependencies', ['req'], ["create unique index {0}_uq on {0} (release_id, dep_type, req)"]),
+]
+
+def in_place(path):
+    """Copy every text back into the rows that use it"""
+    conn = sqlite3.connect(path)
+    for table, names, indexes in TABLES:
+        joins = ''.join(" left join texts {0}_t on {0}_t.id = t.{0}_id".format(n) for n in names)
+        values = ''.join(", {0}_t.value as {0}".format(n) for n in names)
+        conn.execute("create table {0}_inline as select t.*{1} from {0} t{2}".format(table, values, joins))
+        for n in names:
+            conn.execute("alter table {}_inline drop column {}_id".format(table, n))
+        conn.execute("drop table {}".format(table))
+        conn.execute("alter table {0}_inline rename to {0}".format(table))
+        for ix in indexes:
+            conn.execute(ix.format(table))
+    conn.execute("drop table texts")
+    conn.commit()
+    conn.execute("vacuum")
+    conn.close()
+
+def scan(path, sql):
+    conn = sqlite3.connect(path)
+    start = time.perf_counter()
+    conn.execute(sql).fetchall()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=10000)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        shared = os.path.join(tmp, 'shared.db')
+        db = create_engine('sqlite:///' + shared)
+        wensleydale2.init(db)
+        with db.connect() as conn:
+            wensleydale2.bulk_load(conn, pypi_shaped(args.packages))
+        db.dispose()
+        sqlite3.connect(shared).execute("vacuum")
+        inline = os.path.join(tmp, 'inline.db')
+        shutil.copy(shared, inline)
+        in_place(inline)
+
+        sizes = {p: os.path.getsize(p) for p in (shared, inline)}
+        print("in place {:8.1f}MB".format(sizes[inline] / 2**20))
+        print("shared   {:8.1f}MB  ({:.0%} smaller)".format(
+            sizes[shared] / 2**20, 1 - sizes[shared] / sizes[inline]))
+        # A full scan of releases, as an analytical query would do
+        for label, path in [('in place', inline), ('shared', shared)]:
+            t = scan(path, "select count(*), sum(length(summary)) from releases")
+            print("{:8s} releases scan {:7.1f}ms".format(label, 1000 * t))
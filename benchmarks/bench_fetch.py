@@ -0,0 +1,52 @@
+"""Compare serial and concurrent fetching against a fake XML-RPC server
+
+Usage: python benchmarks/bench_fetch.py [--packages N] [--latency SECS] [--threads N...]
+           [--error-rate F] [--throttle-rate F]
+"""
+import argparse
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+import wensleydale2
+from wensleydale2.fake import FakePyPIServer, FakeSource, generate
+
+def run_serial(src, names):
+    for name in names:
+        wensleydale2.fetch_package(src, name)
+
+def run_threaded(src, names, threads):
+    for _ in wensleydale2.fetch_packages(src, names, workers=threads):
+        pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--threads", type=int, nargs="+", default=[4, 16, 32])
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    fake = FakeSource(generate(args.packages, max_releases=5))
+    with FakePyPIServer(fake, latency=args.latency, error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate) as server:
+        names = wensleydale2.PYPISource(server.url).packages()
+
+        server.calls = server.errors = 0
+        start = time.perf_counter()
+        run_serial(wensleydale2.PYPISource(server.url), names)
+        serial = time.perf_counter() - start
+        print("serial:     {:8.2f}s  {:6d} calls  {:8.1f} pkg/s  {:5d} errors".format(
+            serial, server.calls, len(names) / serial, server.errors))
+
+        for threads in args.threads:
+            server.calls = server.errors = 0
+            start = time.perf_counter()
+            run_threaded(wensleydale2.PYPISource(server.url), names, threads)
+            elapsed = time.perf_counter() - start
+            print("threads={:<3d} {:8.2f}s  {:6d} calls  {:8.1f} pkg/s  {:5d} errors  x{:.1f}".format(
+                threads, elapsed, server.calls, len(names) / elapsed, server.errors, serial / elapsed))
@@ -0,0 +1,47 @@
+"""Lag between publishing and local availability while following a busy changelog
+
+A ChangelogGenerator publishes changes to a fake PyPI server at --rate
+changes a second while a Follower tails it over XML-RPC.
+
+Usage: python benchmarks/bench_follow.py [--rate N] [--seconds N] [--packages N]
+"""
+import argparse
+import os
+import sys
+import threading
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+import wensleydale2
+from wensleydale2.fake import ChangelogGenerator, FakePyPIServer, FakeSource, generate
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=20)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--packages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    fake = FakeSource(generate(args.packages))
+    db = wensleydale2.make_engine('sqlite://')
+    wensleydale2.create(db, fake)
+    session = wensleydale2.Session(bind=db)
+
+    stop = threading.Event()
+    gen = ChangelogGenerator(fake)
+    with FakePyPIServer(fake, latency=args.latency) as server:
+        src = wensleydale2.PYPISource(server.url)
+        follower = wensleydale2.Follower(src, session, min_interval=0.1, max_interval=5)
+        producer = threading.Thread(target=gen.run, args=(args.rate, stop), daemon=True)
+        producer.start()
+        threading.Timer(args.seconds, stop.set).start()
+        follower.run(stop=stop)
+        producer.join()
+        follower.poll()
+
+    lags = sorted(follower.lags)
+    print("{} changes in {} polls over {:.0f}s".format(follower.applied, follower.polls, args.seconds))
+    print("lag: median {:.2f}s  p90 {:.2f}s  max {:.2f}s".format(
+        follower.median_lag(), lags[int(len(lags) * 0.9)], lags[-1]))
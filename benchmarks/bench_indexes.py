@@ -0,0 +1,80 @@
+"""Per-change latency as the mirror grows, with and without the new indexes
+
+For each size, a mirror of roughly that many releases is built, then a
+sample of releases is refreshed one change (and one commit) at a time.
+The same changes are then replayed after dropping the indexes added by
+the schema upgrade, as on a database built before it.
+
+Usage: python benchmarks/bench_indexes.py [--releases N...] [--changes N] [--dir DIR]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import FakeSource, iter_generate
+
+# Average releases per package from iter_generate(max_releases=10)
+RELEASES_PER_PACKAGE = 5.5
+NEW_INDEXES = ['ix_classifiers_release_id', 'ix_downloads_release_id', 'ix_packages_normalized_name']
+
+def build(path, releases, changes):
+    n = max(1, int(releases / RELEASES_PER_PACKAGE))
+    sample = set(random.Random(0).sample(range(n), min(n, changes)))
+    kept = {}
+    def packages():
+        for i, (name, rels) in enumerate(iter_generate(n)):
+            if i in sample:
+                kept[name] = rels
+            yield name, [(ver, data, urls) for ver, (data, urls) in rels.items()]
+    db = create_engine('sqlite:///' + path)
+    wensleydale2.init(db)
+    with db.connect() as conn:
+        wensleydale2.bulk_load(conn, packages())
+    return db, FakeSource(kept)
+
+def replay(db, src):
+    session = wensleydale2.Session(bind=db)
+    times = []
+    serial = wensleydale2.get_latest(session)
+    for name, releases in src.data.items():
+        serial += 1
+        change = (name, next(iter(releases)), 0, 'add source file x.tar.gz', serial)
+        start = time.perf_counter()
+        wensleydale2.process_change(src, session, change)
+        session.commit()
+        times.append(time.perf_counter() - start)
+    session.close()
+    return times
+
+def report(label, releases, times):
+    times = sorted(times)
+    print("{:9s} {:9d} releases  median {:7.2f}ms  p90 {:7.2f}ms".format(
+        label, releases, 1000 * statistics.median(times), 1000 * times[int(len(times) * 0.9)]),
+        flush=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--releases", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--changes", type=int, default=100)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for releases in args.releases:
+            path = os.path.join(tmp, 'mirror{}.db'.format(releases))
+            db, src = build(path, releases, args.changes)
+            actual = db.execute("select count(*) from releases").scalar()
+            report('indexed', actual, replay(db, src))
+            for name in NEW_INDEXES:
+                db.execute("drop index {}".format(name))
+            report('unindexed', actual, replay(db, src))
+            db.dispose()
@@ -0,0 +1,61 @@
+"""Decoder throughput on release blobs, and the cost of loading descriptions
+
+Usage: python benchmarks/bench_json.py [--packages N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import undefer
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+from wensleydale2.model import Release
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=2000)
+    args = parser.parse_args()
+
+    packages = generate(args.packages)
+    blobs = [json.dumps({'info': data, 'urls': urls})
+             for releases in packages.values() for data, urls in releases.values()]
+    size = sum(len(b) for b in blobs)
+    described = sum(len(json.loads(b)['info']['description']) for b in blobs)
+    print("{} release blobs, {:.1f} MB, {:.0f}% of it descriptions".format(
+        len(blobs), size / 2**20, 100 * described / size))
+
+    decoders = [('json', json.loads)]
+    if wensleydale2.orjson is not None:
+        decoders.append(('orjson', wensleydale2.orjson.loads))
+    for label, loads in decoders:
+        start = time.perf_counter()
+        for b in blobs:
+            loads(b)
+        elapsed = time.perf_counter() - start
+        print("decode {:7s} {:8.3f}s {:8.1f} MB/s".format(label, elapsed, size / 2**20 / elapsed))
+
+    db = create_engine('sqlite://')
+    wensleydale2.init(db)
+    src = FakeSource(packages)
+    with db.connect() as conn:
+        wensleydale2.bulk_load(conn, (wensleydale2.fetch_package(src, n) for n in src.packages()))
+    # The first query pays for compiling the mapper, so run each twice
+    runs = [('deferred', []), ('undeferred', [undefer('description')])] * 2
+    for label, options in runs:
+        session = wensleydale2.Session(bind=db)
+        tracemalloc.start()
+        start = time.perf_counter()
+        rels = session.query(Release).options(*options).all()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("query {:10s} {:6d} releases {:8.3f}s  peak {:6.1f} MB".format(
+            label, len(rels), elapsed, peak / 2**20))
+        session.close()
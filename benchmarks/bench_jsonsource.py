@@ -0,0 +1,50 @@
+"""Peak memory of copying a JSONSource snapshot, at increasing snapshot sizes
+
+Each copy runs in a fresh process so that its peak RSS can be measured.
+
+Usage: python benchmarks/bench_jsonsource.py [--sizes N...] [--dir DIR]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import iter_generate, make_snapshot
+
+def copy(snapshot, target):
+    src = wensleydale2.JSONSource('sqlite:///' + snapshot)
+    db = create_engine('sqlite:///' + target)
+    wensleydale2.init(db)
+    start = time.perf_counter()
+    with db.connect() as conn:
+        n = wensleydale2.bulk_load(conn, src.iter_packages())
+    elapsed = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("{:8d} packages {:8.2f}s {:8.0f} pkg/s  peak RSS {:8.1f} MB".format(
+        n, elapsed, n / elapsed, rss / 1024))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000])
+    parser.add_argument("--dir", default=None)
+    parser.add_argument("--copy", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.copy:
+        copy(*args.copy)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for size in args.sizes:
+            snapshot = os.path.join(tmp, 'pypi{}.db'.format(size))
+            target = os.path.join(tmp, 'mirror{}.db'.format(size))
+            make_snapshot('sqlite:///' + snapshot, iter_generate(size))
+            subprocess.check_call([sys.executable, __file__, '--copy', snapshot, target])
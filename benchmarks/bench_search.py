@@ -0,0 +1,70 @@
+"""Keyword search latency with the full-text index, against LIKE scans
+
+The fake data only uses a handful of words, so each package is also given
+one of TOPICS rare keywords and the searches are for those, matching about
+one package in TOPICS.
+
+Usage: python benchmarks/bench_search.py [--packages N] [--dir DIR]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import iter_generate
+
+TOPICS = 1000
+QUERIES = ['topic{}'.format(i) for i in range(0, TOPICS, 97)]
+
+def packages(n):
+    for i, (name, rels) in enumerate(iter_generate(n)):
+        releases = []
+        for ver, (data, urls) in rels.items():
+            data['keywords'] += ' topic{}'.format(i % TOPICS)
+            releases.append((ver, data, urls))
+        yield name, releases
+
+def timed(fn, query):
+    start = time.perf_counter()
+    fn(query)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=20000)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        db = create_engine('sqlite:///' + os.path.join(tmp, 'mirror.db'))
+        wensleydale2.init(db)
+        with db.connect() as conn:
+            wensleydale2.bulk_load(conn, packages(args.packages))
+        start = time.perf_counter()
+        wensleydale2.create_search_index(db)
+        print("Indexed {} releases in {:.1f}s".format(
+            db.execute("select count(*) from releases").scalar(), time.perf_counter() - start))
+
+        session = wensleydale2.Session(bind=db)
+        def like(q):
+            pattern = '%{}%'.format(q)
+            return session.execute(
+                "select p.name, r.version from releases r join packages p on p.id = r.package_id "
+                "left join texts d on d.id = r.description_id "
+                "where r.summary like :q or d.value like :q or r.keywords like :q limit 20",
+                {'q': pattern}).fetchall()
+        def fts(q):
+            return wensleydale2.search(session, q)
+        for label, fn in [('fts', fts), ('like', like)]:
+            fn(QUERIES[0])
+            times = [timed(fn, q) for q in QUERIES]
+            print("{:5s} median {:8.2f}ms  max {:8.2f}ms".format(
+                label, 1000 * statistics.median(times), 1000 * max(times)))
+        db.dispose()
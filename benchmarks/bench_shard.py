@@ -0,0 +1,51 @@
+"""Time loading a generated JSON snapshot with increasing numbers of workers
+
+The snapshot is generated once (this takes a while for large sizes) and
+kept in --dir, so repeated runs can reuse it.
+
+Usage: python benchmarks/bench_shard.py [--packages N] [--workers N...] [--dir DIR]
+"""
+import argparse
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import iter_generate, make_snapshot
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=100000)
+    parser.add_argument("--workers", type=int, nargs="+",
+            default=sorted(set([1, 2, 4, os.cpu_count() or 1])))
+    parser.add_argument("--dir", default=".")
+    args = parser.parse_args()
+
+    snapshot = os.path.join(args.dir, 'bench_snapshot_{}.db'.format(args.packages))
+    target = os.path.join(args.dir, 'bench_mirror.db')
+    if not os.path.exists(snapshot):
+        print("Generating {} packages into {}...".format(args.packages, snapshot), flush=True)
+        make_snapshot('sqlite:///' + snapshot, iter_generate(args.packages, max_releases=5))
+
+    base = None
+    for workers in args.workers:
+        if os.path.exists(target):
+            os.remove(target)
+        db = create_engine('sqlite:///' + target)
+        wensleydale2.init(db)
+        start = time.perf_counter()
+        with db.connect() as conn:
+            if workers == 1:
+                src = wensleydale2.JSONSource('sqlite:///' + snapshot)
+                n = wensleydale2.bulk_load(conn, src.iter_packages())
+            else:
+                n = wensleydale2.shard_load('sqlite:///' + snapshot, conn, workers)
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        print("workers={:<3d} {:8d} packages {:8.2f}s {:8.0f} pkg/s  x{:.2f}".format(
+            workers, n, elapsed, n / elapsed, base / elapsed), flush=True)
+    os.remove(target)
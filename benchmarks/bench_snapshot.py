@@ -0,0 +1,46 @@
+"""Snapshot and restore times and sizes, against the mirror database
+
+Usage: python benchmarks/bench_snapshot.py [--packages N] [--profile NAME] [--dir DIR]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+import wensleydale2
+from wensleydale2.fake import iter_generate_pypi
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=5000)
+    parser.add_argument("--profile", default="bulk",
+            help="SQLite profile to restore with")
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        source = os.path.join(tmp, 'mirror.db')
+        db = wensleydale2.make_engine('sqlite:///' + source)
+        wensleydale2.init(db)
+        with db.connect() as conn:
+            wensleydale2.bulk_load(conn, ((name, [(v, d, u) for v, (d, u) in rels.items()])
+                                          for name, rels in iter_generate_pypi(args.packages)))
+        releases = db.execute("select count(*) from releases").scalar()
+
+        start = time.perf_counter()
+        path, serial = wensleydale2.write_snapshot(db, tmp)
+        written = time.perf_counter() - start
+
+        target = wensleydale2.make_engine('sqlite:///' + os.path.join(tmp, 'restored.db'), args.profile)
+        start = time.perf_counter()
+        wensleydale2.restore_snapshot(target, path)
+        restored = time.perf_counter() - start
+
+        print("{} releases, database {:.1f}MB, snapshot {:.1f}MB".format(
+            releases, os.path.getsize(source) / 2**20, os.path.getsize(path) / 2**20))
+        print("snapshot {:6.2f}s  {:8.0f} releases/s".format(written, releases / written))
+        print("restore  {:6.2f}s  {:8.0f} releases/s".format(restored, releases / restored))
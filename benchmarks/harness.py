@@ -0,0 +1,256 @@
+"""Repeatable benchmarks of loading, updating and querying a mirror
+
+Every workload runs against the same PyPI-shaped synthetic data (see
+iter_generate_pypi in wensleydale2/fake.py), generated from --seed, and
+each result is appended to a JSON lines file along with the commit it was
+measured at. Run it before and after a change, then use --compare to see
+how each workload moved between the last two commits measured.
+
+Workloads:
+
+  create_json     create from a JSONSource snapshot of the whole dataset
+  create_xmlrpc   create from a fake XML-RPC server, for --xmlrpc-packages
+                  packages, using --threads threads
+  update          apply --changes changes from the fake changelog generator
+  rename_storm    apply --storm package renames
+  remove_storm    apply --storm package removals
+  release_storm   apply --storm release removals
+  queries         dependency lookups, package loads and full-text searches
+
+create_json runs first whatever is selected, as the other workloads start
+from a copy of the mirror it builds. The changelog workloads apply changes
+straight from an in-memory source, so they measure the database side of an
+update rather than the network.
+
+Usage: python benchmarks/harness.py [--packages N] [--seed N] [--workloads NAME...]
+                                    [--results FILE] [--compare]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+import sqlalchemy
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import (ChangelogGenerator, FakePyPIServer, FakeSource, WORDS,
+        iter_generate_pypi, make_snapshot)
+from wensleydale2.model import Package
+
+RESULTS = os.path.join(here, 'benchmarks', 'results.jsonl')
+
+WORKLOADS = OrderedDict()
+
+def workload(fn):
+    WORKLOADS[fn.__name__] = fn
+    return fn
+
+def timed(fn, *args, **kw):
+    start = time.perf_counter()
+    result = fn(*args, **kw)
+    return time.perf_counter() - start, result
+
+class Context:
+    def __init__(self, args, tmp):
+        self.args = args
+        self.tmp = tmp
+        self.data = dict(iter_generate_pypi(args.packages, args.seed))
+        self.base = os.path.join(tmp, 'base.db')
+        self.copies = 0
+
+    def dataset(self):
+        releases = [r for rels in self.data.values() for r in rels.values()]
+        return {
+            'generator': 'pypi',
+            'packages': len(self.data),
+            'seed': self.args.seed,
+            'releases': len(releases),
+            'urls': sum(len(urls) for data, urls in releases),
+        }
+
+    def fresh(self):
+        """A copy of the base mirror, and a session on it"""
+        self.copies += 1
+        path = os.path.join(self.tmp, 'copy{}.db'.format(self.copies))
+        shutil.copy(self.base, path)
+        db = create_engine('sqlite:///' + path)
+        return db, wensleydale2.Session(bind=db)
+
+    def source(self, session):
+        """An in-memory source matching the base mirror, and a changelog generator for it"""
+        data = {name: dict(rels) for name, rels in self.data.items()}
+        src = FakeSource(data, serial=wensleydale2.get_latest(session))
+        return src, ChangelogGenerator(src, self.args.seed)
+
+def apply_all(src, session):
+    changes = src.changes(wensleydale2.get_latest(session))
+    seconds, ops = timed(wensleydale2.apply_changes, src, session, changes)
+    return {'seconds': seconds, 'changes': len(changes), 'ops': ops,
+            'changes_per_s': len(changes) / seconds}
+
+@workload
+def create_json(ctx):
+    snapshot = os.path.join(ctx.tmp, 'snapshot.db')
+    make_snapshot('sqlite:///' + snapshot, ctx.data, serial=1000).dispose()
+    db = create_engine('sqlite:///' + ctx.base)
+    seconds, n = timed(wensleydale2.create, db, wensleydale2.JSONSource('sqlite:///' + snapshot))
+    releases = db.execute("select count(*) from releases").scalar()
+    db.dispose()
+    return {'seconds': seconds, 'packages_per_s': n / seconds, 'releases_per_s': releases / seconds,
+            'db_mb': os.path.getsize(ctx.base) / 2**20}
+
+@workload
+def create_xmlrpc(ctx):
+    names = list(ctx.data)[:ctx.args.xmlrpc_packages]
+    fake = FakeSource({name: ctx.data[name] for name in names})
+    db = create_engine('sqlite:///' + os.path.join(ctx.tmp, 'xmlrpc.db'))
+    with FakePyPIServer(fake, latency=ctx.args.latency) as server:
+        seconds, n = timed(wensleydale2.create, db, wensleydale2.PYPISource(server.url),
+                threads=ctx.args.threads)
+        calls = server.calls
+    db.dispose()
+    return {'seconds': seconds, 'packages_per_s': n / seconds, 'calls_per_s': calls / seconds}
+
+@workload
+def update(ctx):
+    db, session = ctx.fresh()
+    src, gen = ctx.source(session)
+    for _ in range(ctx.args.changes):
+        gen.step()
+    return apply_all(src, session)
+
+@workload
+def rename_storm(ctx):
+    db, session = ctx.fresh()
+    src, gen = ctx.source(session)
+    gen.rename_storm(ctx.args.storm)
+    return apply_all(src, session)
+
+@workload
+def remove_storm(ctx):
+    db, session = ctx.fresh()
+    src, gen = ctx.source(session)
+    gen.remove_storm(ctx.args.storm)
+    return apply_all(src, session)
+
+@workload
+def release_storm(ctx):
+    db, session = ctx.fresh()
+    src, gen = ctx.source(session)
+    gen.remove_storm(ctx.args.storm, releases=True)
+    return apply_all(src, session)
+
+@workload
+def queries(ctx):
+    db, session = ctx.fresh()
+    wensleydale2.create_search_index(db)
+    rnd = random.Random(ctx.args.seed)
+    names = rnd.sample(list(ctx.data), min(ctx.args.queries, len(ctx.data)))
+    # Popular projects are the ones with many reverse dependencies
+    popular = list(ctx.data)[:ctx.args.queries]
+    words = [rnd.choice(WORDS) + ' ' + rnd.choice(WORDS) for _ in names]
+    def load(session, name):
+        pkg = session.query(Package).filter_by(name=name).one()
+        return [(r.version, r.license, [c.classifier for c in r.classifiers]) for r in pkg.releases]
+    runs = [
+        ('dependencies', wensleydale2.dependencies, names),
+        ('closure', wensleydale2.dependency_closure, names),
+        ('reverse', wensleydale2.reverse_dependencies, popular),
+        ('load_package', load, names),
+        ('search', wensleydale2.search, words),
+    ]
+    result = {}
+    for label, fn, inputs in runs:
+        times = [timed(fn, session, x)[0] for x in inputs]
+        result[label + '_median_ms'] = 1000 * statistics.median(times)
+    return result
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                stderr=subprocess.DEVNULL).decode().strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                cwd=here).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+def environment():
+    commit, dirty = git_commit()
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+    }
+
+def compare(path):
+    """Show how each workload moved between the last two commits measured"""
+    runs = OrderedDict()
+    with open(path) as f:
+        for line in f:
+            r = json.loads(line)
+            key = (r['workload'], json.dumps(r['dataset'], sort_keys=True))
+            # The latest run at each commit counts
+            runs.setdefault(key, OrderedDict())[r['commit']] = r
+            runs[key].move_to_end(r['commit'])
+    for (name, dataset), by_commit in runs.items():
+        if len(by_commit) < 2:
+            continue
+        (c1, old), (c2, new) = list(by_commit.items())[-2:]
+        print("{} ({} packages): {} -> {}".format(name, json.loads(dataset)['packages'], c1, c2))
+        for metric, value in new['results'].items():
+            before = old['results'].get(metric)
+            if before:
+                print("  {:22s} {:12.2f} {:12.2f}  {:+6.1%}".format(metric, before, value, value / before - 1))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--xmlrpc-packages", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.002)
+    parser.add_argument("--changes", type=int, default=1000)
+    parser.add_argument("--storm", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--results", default=RESULTS)
+    parser.add_argument("--dir", default=None)
+    parser.add_argument("--compare", action="store_true",
+            help="Compare the last two commits in the results file instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.results)
+        sys.exit()
+
+    env = environment()
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        ctx = Context(args, tmp)
+        dataset = ctx.dataset()
+        print("{packages} packages, {releases} releases, {urls} files".format(**dataset), flush=True)
+        selected = ['create_json'] + [w for w in args.workloads if w != 'create_json']
+        with open(args.results, 'a') as out:
+            for name in selected:
+                results = WORKLOADS[name](ctx)
+                print("{:14s} {}".format(name, "  ".join(
+                    "{} {:.2f}".format(k, v) for k, v in results.items())), flush=True)
+                record = dict(env, workload=name, dataset=dataset, results=results)
+                out.write(json.dumps(record, sort_keys=True) + '\n')
@@ -1,8 +1,11 @@
 from xmlrpc.client import ServerProxy, ProtocolError
-import json
+from sqlalchemy import create_engine
 import sys
 import os
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from wensleydale2.changelog import init_archive, archive_latest, append_changes, import_changes_json
+
 PYPI_URL = 'http://pypi.python.org/pypi'
 pypi = ServerProxy(PYPI_URL)
 
@@ -27,33 +30,32 @@ def initial_load():
 
     # next_serial is the oldest serial we can get
     # changes is the list of all changes since then
-    return [next_serial, changes]
+    return changes
 
-def update(last_serial, changes):
+def update(db):
+    # Only the entries since the newest archived one are fetched and written
+    last_serial = archive_latest(db)
+    if last_serial is None:
+        print("The archive is empty; run with init first")
+        return 0
     new_serial = pypi.changelog_last_serial()
     print("Loading from {} to {}... ".format(last_serial, new_serial), end="", flush=True)
     try:
         more_changes = pypi.changelog_since_serial(last_serial)
     except ProtocolError:
         print("Not OK")
-        return False
+        return 0
     print("OK")
-    changes.extend(more_changes)
-    return [new_serial, changes]
+    return append_changes(db, more_changes)
 
 if __name__ == '__main__':
-    filename = 'changes.json'
-    backup = 'changes.json.bak'
+    db = create_engine('sqlite:///changes.db')
+    init_archive(db)
     if len(sys.argv) > 1 and sys.argv[1] == 'init':
-        data = initial_load()
-        with open(filename, 'w') as f:
-            json.dump(data, f)
+        n = append_changes(db, initial_load())
+    elif len(sys.argv) > 2 and sys.argv[1] == 'import':
+        # Bring across a changes.json from before the archive
+        n = import_changes_json(db, sys.argv[2])
     else:
-        with open(filename) as f:
-            last_serial, changes = json.load(f)
-        data = update(last_serial, changes)
-        if data:
-            os.replace(filename, backup)
-            with open(filename, 'w') as f:
-                json.dump(data, f)
-
+        n = update(db)
+    print("Archived {} new entries".format(n))
@@ -1,7 +1,74 @@
 import sys, os
+import pytest
 
 # Make sure that the application source directory (this directory's parent) is
 # on sys.path.
 
 here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, here)
+
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+
+# Shared test setup
+# =================
+#
+# Fixtures that make small mirrors to test against, and dump one for
+# comparing with another.
+
+TEXT = "(select value from texts where id = {})"
+
+def _dump(db):
+    rel = ("select p.name, r.version, r.serial, r.author, r.summary, {}, {}, "
+           "r._pypi_hidden, r._pypi_ordering from releases r join packages p on p.id = r.package_id").format(
+           TEXT.format('r.description_id'), TEXT.format('r.license_id'))
+    child = "select p.name, r.version, {} from {} c join releases r on r.id = c.release_id join packages p on p.id = r.package_id"
+    return {
+        'packages': sorted(tuple(r) for r in db.execute("select name, serial from packages")),
+        'releases': sorted(tuple(r) for r in db.execute(rel)),
+        'dependencies': sorted(tuple(r) for r in db.execute(child.format("c.dep_type, " + TEXT.format("c.req_id"), "dependencies"))),
+        'classifiers': sorted(tuple(r) for r in db.execute(child.format(TEXT.format("c.classifier_id"), "classifiers"))),
+        'project_urls': sorted(tuple(r) for r in db.execute(child.format("c.url", "project_urls"))),
+        'urls': sorted(tuple(r) for r in db.execute(child.format(
+            "c.url, c.filename, c.has_sig, c.md5_digest, c.packagetype, c.size, c.upload_time", "urls"))),
+    }
+
+@pytest.fixture
+def dump():
+    """All mirror data of a database, keyed by package/version rather than row ids"""
+    return _dump
+
+@pytest.fixture
+def orm_db():
+    """Makes an in-memory mirror of a source, added package by package through the ORM
+
+    With search_index set, the search index is created before anything is added.
+    """
+    def make(src, search_index=False):
+        db = wensleydale2.make_engine('sqlite://')
+        wensleydale2.init(db)
+        if search_index:
+            wensleydale2.create_search_index(db)
+        session = wensleydale2.Session(bind=db)
+        for name in src.packages():
+            wensleydale2.pkg_add(session, src, name)
+        session.commit()
+        session.close()
+        return db
+    return make
+
+@pytest.fixture
+def mirror(tmp_path):
+    """Makes a mirror of n generated packages with create, returning (src, db)
+
+    With on_disk set the mirror is tmp_path/mirror.db, in WAL mode.
+    """
+    def make(n=5, serial=0, on_disk=False):
+        src = FakeSource(generate(n), serial=serial)
+        if on_disk:
+            db = wensleydale2.make_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'), 'wal')
+        else:
+            db = wensleydale2.make_engine('sqlite://')
+        wensleydale2.create(db, src)
+        return src, db
+    return make
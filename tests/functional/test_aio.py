@@ -0,0 +1,42 @@
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2 import aio
+from wensleydale2.fake import ChangelogGenerator, FakePyPIServer, FakeSource, generate
+
+def test_fetch_over_xmlrpc_with_faults():
+    """The async client retries errors and throttling, like the sync one"""
+    fake = FakeSource(generate(10))
+    with FakePyPIServer(fake, error_rate=0.2, throttle_rate=0.2, seed=1) as server:
+        src = aio.AsyncPYPISource(server.url, connections=4, retries=20, backoff=0.001)
+        fetched = dict(aio.fetch_packages(src, concurrency=50))
+        assert server.errors > 0
+    assert fetched == dict(wensleydale2.fetch_package(fake, n) for n in fake.packages())
+    assert src.limiter.throttled > 0
+    # Connections are pooled, not opened per request
+    assert src.proxy.opened < server.calls / 4
+
+def test_create_matches_sync(dump):
+    fake = FakeSource(generate(10), serial=7)
+    expected = create_engine('sqlite://')
+    wensleydale2.create(expected, fake)
+    db = create_engine('sqlite://')
+    with FakePyPIServer(fake) as server:
+        assert aio.create(db, aio.AsyncPYPISource(server.url), concurrency=20, batch=3) == 10
+    assert dump(db) == dump(expected)
+    assert db.execute("select serial from latest").scalar() == 7
+
+def test_apply_changes_matches_sync(dump):
+    """Changes applied with prefetched data give the same mirror"""
+    fake = FakeSource(generate(10))
+    db, adb = create_engine('sqlite://'), create_engine('sqlite://')
+    wensleydale2.create(db, fake)
+    wensleydale2.create(adb, fake)
+    gen = ChangelogGenerator(fake, 3)
+    for _ in range(100):
+        gen.step()
+    gen.rename_storm(2)
+    session, asession = wensleydale2.Session(bind=db), wensleydale2.Session(bind=adb)
+    n = wensleydale2.apply_changes(fake, session, fake.changes(0), window=20)
+    assert aio.apply_changes(aio.AsyncSource(fake), asession, fake.changes(0), window=20) == n
+    assert dump(adb) == dump(db)
+    assert wensleydale2.get_latest(asession) == wensleydale2.get_latest(session)
@@ -0,0 +1,103 @@
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+
+def bulk_db(src, batch=7):
+    db = create_engine('sqlite://')
+    wensleydale2.init(db)
+    with db.connect() as conn:
+        fetched = (wensleydale2.fetch_package(src, name) for name in src.packages())
+        wensleydale2.bulk_load(conn, fetched, batch=batch)
+    return db
+
+def test_bulk_matches_orm(dump, orm_db):
+    """The bulk loader writes exactly what the ORM path writes"""
+    src = FakeSource(generate(30))
+    expected = dump(orm_db(src))
+    assert expected['dependencies'] and expected['project_urls']
+    assert dump(bulk_db(src)) == expected
+
+def test_bulk_appends_to_existing_data(orm_db):
+    """Ids continue from rows already in the database"""
+    src = FakeSource(generate(10))
+    db = orm_db(FakeSource(generate(5, seed=1)))
+    with db.connect() as conn:
+        n = wensleydale2.bulk_load(conn, [wensleydale2.fetch_package(src, 'pkg000007')])
+    assert n == 1
+    assert db.execute("select count(*) from packages").scalar() == 6
+    assert db.execute("select count(*) from releases r join packages p on p.id = r.package_id "
+                      "where p.name = 'pkg000007'").scalar() == len(src.data['pkg000007'])
+
+def test_bulk_load_resets_sequences(monkeypatch):
+    """Each batch moves the id sequences on, so the ORM can insert after a bulk load"""
+    import wensleydale2.bulk
+    calls = []
+    monkeypatch.setattr(wensleydale2.bulk, 'reset_sequences',
+                        lambda conn, tables: calls.append((conn.in_transaction(), tables)))
+    bulk_db(FakeSource(generate(10)), batch=4)
+    assert len(calls) == 3
+    assert all(in_transaction and wensleydale2.bulk.TABLES == tables for in_transaction, tables in calls)
+
+def test_texts_are_shared():
+    """Repeated values are stored once, and unused ones can be pruned"""
+    src = FakeSource(generate(5))
+    for name, releases in src.data.items():
+        for data, urls in releases.values():
+            data['description'] = 'The same for every release of ' + name
+    db = bulk_db(src)
+    descriptions = db.execute("select count(distinct description_id) from releases").scalar()
+    assert descriptions == 5
+    assert db.execute("select count(*) from texts").scalar() < \
+        db.execute("select count(*) from releases").scalar() + db.execute("select count(*) from classifiers").scalar()
+    assert wensleydale2.prune_texts(db) == 0
+    session = wensleydale2.Session(bind=db)
+    wensleydale2.pkg_remove(session, 'pkg000001')
+    session.commit()
+    assert wensleydale2.prune_texts(db) >= 1
+    assert db.execute("select count(distinct description_id) from releases").scalar() == 4
+
+def test_insert_missing(monkeypatch):
+    """Rows already stored are skipped, with or without a dialect-specific insert"""
+    from wensleydale2.model import Text, insert_missing
+    db = create_engine('sqlite://')
+    wensleydale2.init(db)
+    texts = Text.__table__
+    insert_missing(db, texts, [{'id': 1, 'value': 'a'}])
+    insert_missing(db, texts, [{'id': 1, 'value': 'a'}, {'id': 2, 'value': 'b'}])
+    monkeypatch.setattr(db.dialect, 'name', 'other')
+    insert_missing(db, texts, [{'id': 2, 'value': 'b'}, {'id': 3, 'value': 'c'}])
+    assert db.execute("select id, value from texts order by id").fetchall() == [(1, 'a'), (2, 'b'), (3, 'c')]
+
+def test_plain_sessions_store_texts():
+    """Texts set through any session are written, not just mirror sessions"""
+    from sqlalchemy.orm import Session
+    from wensleydale2.model import Classifier, Dependency, Release
+    db = create_engine('sqlite://')
+    wensleydale2.init(db)
+    session = Session(bind=db)
+    rel = Release('1.0')
+    rel.package = wensleydale2.Package('plain')
+    rel.license = 'MIT'
+    rel.description = 'Long text'
+    rel.classifiers = [Classifier(classifier='Topic :: Utilities')]
+    rel.dependencies = [Dependency(dep_type='requires_dist', req='other (>=1)')]
+    session.add(rel)
+    session.commit()
+    session.expire_all()
+    assert (rel.license, rel.description) == ('MIT', 'Long text')
+    assert [c.classifier for c in rel.classifiers] == ['Topic :: Utilities']
+    assert [d.req for d in rel.dependencies] == ['other (>=1)']
+    rel.license = 'BSD'
+    session.commit()
+    session.expire_all()
+    assert rel.license == 'BSD'
+    assert db.execute("select count(*) from texts").scalar() == 5
+
+def test_hooks_only_on_mirror_sessions():
+    """Other sessions in the same process are left alone"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    from wensleydale2.model import store_texts
+    from wensleydale2.summary import refresh_flushed
+    assert not event.contains(Session, 'before_flush', store_texts)
+    assert not event.contains(Session, 'after_flush', refresh_flushed)
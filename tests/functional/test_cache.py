@@ -0,0 +1,50 @@
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+
+class Counting(FakeSource):
+    calls = 0
+    def release_data_and_urls(self, package, version):
+        self.calls += 1
+        return super().release_data_and_urls(package, version)
+
+def test_cache_hits_survive_restart(tmp_path):
+    """A second cache over the same file answers from disk"""
+    src = Counting(generate(3))
+    path = str(tmp_path / 'cache.db')
+    cache = wensleydale2.CachedSource(src, path)
+    first = cache.release_data_and_urls('pkg000001', '1.0')
+    cache.close()
+    cache = wensleydale2.CachedSource(src, path)
+    assert cache.release_data_and_urls('pkg000001', '1.0') == first
+    assert src.calls == 1
+    assert cache.stats()['hits'] == 1
+
+def test_changelog_invalidates_package(tmp_path):
+    """A newer changelog serial for a package drops its cached entries"""
+    src = Counting(generate(3))
+    cache = wensleydale2.CachedSource(src, str(tmp_path / 'cache.db'))
+    cache.release_data_and_urls('pkg000001', '1.0')
+    cache.release_data_and_urls('pkg000002', '1.0')
+    src.changelog.append(('pkg000001', '1.0', 0, 'add source file', 10))
+    cache.changes(0)
+    cache.release_data_and_urls('pkg000001', '1.0')
+    cache.release_data_and_urls('pkg000002', '1.0')
+    assert src.calls == 3
+    assert cache.stats()['invalidations'] == 1
+    # Data fetched after the change is current
+    cache.release_data_and_urls('pkg000001', '1.0')
+    assert src.calls == 3
+
+def test_lru_eviction(tmp_path):
+    """The least recently used entries are evicted first"""
+    src = Counting(generate(5))
+    cache = wensleydale2.CachedSource(src, str(tmp_path / 'cache.db'), max_entries=2)
+    cache.release_data_and_urls('pkg000000', '1.0')
+    cache.release_data_and_urls('pkg000001', '1.0')
+    cache.release_data_and_urls('pkg000000', '1.0')
+    cache.release_data_and_urls('pkg000002', '1.0')
+    assert cache.stats()['evictions'] == 1
+    cache.release_data_and_urls('pkg000000', '1.0')
+    assert src.calls == 3
+    cache.release_data_and_urls('pkg000001', '1.0')
+    assert src.calls == 4
@@ -0,0 +1,68 @@
+import json
+from sqlalchemy import create_engine, inspect
+import wensleydale2
+from wensleydale2.changelog import archive_latest
+from wensleydale2.fake import FakeSource, generate, make_snapshot
+
+def logged_source(n=5):
+    src = FakeSource(generate(3))
+    for i in range(n):
+        src.log('pkg{:06}'.format(i % 2), '1.0', 'new release', timestamp=1000 + i)
+    return src
+
+def test_archive_ranges():
+    """Entries come back as they went in, selected by serial, package and time"""
+    db = create_engine('sqlite://')
+    src = logged_source()
+    assert wensleydale2.update_archive(db, src, serial=0) == 5
+    assert wensleydale2.archived_changes(db) == src.changelog
+    assert wensleydale2.archived_changes(db, 2) == src.changelog[2:]
+    assert wensleydale2.archived_changes(db, 1, 3) == src.changelog[1:3]
+    assert wensleydale2.archived_changes(db, name='pkg000001') == src.changelog[1::2]
+    assert wensleydale2.archived_changes(db, since=1001, until=1003) == src.changelog[1:3]
+
+def test_archive_appends_new_entries_only():
+    db = create_engine('sqlite://')
+    src = logged_source()
+    wensleydale2.update_archive(db, src, serial=0)
+    src.log('pkg000002', '2.0', 'new release', timestamp=2000)
+    assert wensleydale2.update_archive(db, src) == 1
+    # Overlapping entries are skipped
+    assert wensleydale2.append_changes(db, src.changelog) == 0
+    assert archive_latest(db) == 6
+
+def test_old_archives_get_indexes():
+    """Archives made before the name and timestamp indexes have them added"""
+    def drop_indexes(db):
+        for index in ['ix_changes_name', 'ix_changes_timestamp']:
+            db.execute("drop index " + index)
+    def indexes(db):
+        return set(ix['name'] for ix in inspect(db).get_indexes('changes'))
+    db = create_engine('sqlite://')
+    wensleydale2.init_archive(db)
+    drop_indexes(db)
+    wensleydale2.init_archive(db)
+    assert indexes(db) == {'ix_changes_name', 'ix_changes_timestamp'}
+
+    db = create_engine('sqlite://')
+    wensleydale2.init(db)
+    drop_indexes(db)
+    steps = wensleydale2.upgrade(db)
+    assert "created index ix_changes_name" in steps and "created index ix_changes_timestamp" in steps
+    assert indexes(db) == {'ix_changes_name', 'ix_changes_timestamp'}
+
+def test_jsonsource_answers_from_archive(tmp_path):
+    url = 'sqlite:///{}'.format(tmp_path / 'pypi.db')
+    engine = make_snapshot(url, generate(3), serial=3)
+    assert wensleydale2.JSONSource(url).changes(0) == []
+    src = logged_source()
+    wensleydale2.update_archive(engine, src, serial=0)
+    assert wensleydale2.JSONSource(url).changes(3) == src.changelog[3:]
+
+def test_import_changes_json(tmp_path):
+    src = logged_source()
+    path = tmp_path / 'changes.json'
+    path.write_text(json.dumps([5, src.changelog]))
+    db = create_engine('sqlite://')
+    assert wensleydale2.import_changes_json(db, str(path)) == 5
+    assert wensleydale2.archived_changes(db) == src.changelog
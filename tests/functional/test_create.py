@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate, make_snapshot
+
+class Crash(Exception):
+    pass
+
+class Flaky(FakeSource):
+    """Fails after a given number of release fetches"""
+    def __init__(self, packages, fail_after=None, serial=0):
+        super().__init__(packages, serial=serial)
+        self.fail_after = fail_after
+        self.fetched = []
+    def releases(self, package):
+        if self.fail_after is not None and len(self.fetched) >= self.fail_after:
+            raise Crash()
+        self.fetched.append(package)
+        return super().releases(package)
+
+def test_interrupted_create_resumes(tmp_path, dump):
+    """A rerun after a crash loads only the remaining packages"""
+    packages = generate(25)
+    db = create_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    src = Flaky(packages, fail_after=12, serial=100)
+    with pytest.raises(Crash):
+        wensleydale2.create(db, src, batch=5)
+    assert db.execute("select count(*) from packages").scalar() == 10
+
+    src = Flaky(packages, serial=200)
+    assert wensleydale2.create(db, src, batch=5) == 15
+    assert len(src.fetched) == 15
+    # The serial from the start of the first run is kept
+    session = wensleydale2.Session(bind=db)
+    assert wensleydale2.get_latest(session) == 100
+
+    fresh = create_engine('sqlite://')
+    wensleydale2.create(fresh, FakeSource(packages))
+    assert dump(db) == dump(fresh)
+
+def test_resume_from_snapshot(tmp_path):
+    """Streamed snapshot loads resume after the last journalled package"""
+    url = 'sqlite:///{}'.format(tmp_path / 'pypi.db')
+    make_snapshot(url, generate(20), serial=7)
+    src = wensleydale2.JSONSource(url)
+    db = create_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+
+    def stop_after(n):
+        def progress(it):
+            for i, pkg in enumerate(it):
+                if i == n:
+                    raise Crash()
+                yield pkg
+        return progress
+    with pytest.raises(Crash):
+        wensleydale2.create(db, src, batch=4, progress=stop_after(9))
+    assert db.execute("select count(*) from create_journal").scalar() == 8
+    assert wensleydale2.create(db, src, batch=4) == 12
+    assert db.execute("select count(*) from packages").scalar() == 20
+    assert db.execute("select serial from latest").scalar() == 7
+
+def test_resume_with_gaps(tmp_path):
+    """A journal holding a later range than it is missing, as a multi-process load can leave"""
+    packages = generate(10)
+    names = sorted(packages)
+    url = 'sqlite:///{}'.format(tmp_path / 'pypi.db')
+    make_snapshot(url, packages, serial=7)
+    later = 'sqlite:///{}'.format(tmp_path / 'later.db')
+    make_snapshot(later, {name: packages[name] for name in names[5:]}, serial=7)
+    db = create_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    wensleydale2.create(db, wensleydale2.JSONSource(later))
+
+    assert wensleydale2.create(db, wensleydale2.JSONSource(url)) == 5
+    assert db.execute("select count(*) from packages").scalar() == 10
+    assert wensleydale2.create(db, wensleydale2.JSONSource(url)) == 0
+
+def test_workers_behind_cache(tmp_path, monkeypatch):
+    """A cached snapshot source is still loaded by worker processes"""
+    calls = []
+    shard_load = wensleydale2.shard_load
+    def recording(*args, **kw):
+        calls.append(args[2])
+        return shard_load(*args, **kw)
+    monkeypatch.setattr(wensleydale2, 'shard_load', recording)
+    url = 'sqlite:///{}'.format(tmp_path / 'pypi.db')
+    make_snapshot(url, generate(10), serial=7)
+    src = wensleydale2.CachedSource(wensleydale2.JSONSource(url), str(tmp_path / 'cache.db'))
+    db = create_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    assert wensleydale2.create(db, src, workers=2) == 10
+    assert calls == [2]
+    src.close()
@@ -0,0 +1,54 @@
+import wensleydale2
+from wensleydale2.fake import FakeSource
+from wensleydale2.requirements import parse_requirement
+
+def release(name, version, requires=()):
+    return {'name': name, 'version': version, 'requires_dist': list(requires)}, []
+
+def test_parse_requirement():
+    """Requirement strings are reduced to normalised names and markers"""
+    assert parse_requirement('Foo.Bar (>=1.0)') == ('foo-bar', None)
+    assert parse_requirement('foo_bar[x]>=2; python_version < "3"') == ('foo-bar', 'python_version < "3"')
+
+def test_forward_and_reverse(orm_db):
+    """Direct and transitive dependencies can be followed both ways"""
+    src = FakeSource({
+        'App': {'1.0': release('App', '1.0', ['Lib_A (>=1)'])},
+        'lib-a': {'1.0': release('lib-a', '1.0', ['lib.b'])},
+        'lib.b': {'1.0': release('lib.b', '1.0')},
+    })
+    session = wensleydale2.Session(bind=orm_db(src))
+    assert wensleydale2.dependencies(session, 'app') == {'lib-a'}
+    assert wensleydale2.reverse_dependencies(session, 'lib_b') == {'lib-a'}
+    assert wensleydale2.dependency_closure(session, 'App') == {'lib-a', 'lib-b'}
+    assert wensleydale2.dependency_closure(session, 'lib-b', reverse=True) == {'lib-a', 'app'}
+
+def test_index_follows_changes(orm_db):
+    """Edges are updated as releases are added, removed and renamed"""
+    src = FakeSource({
+        'app': {'1.0': release('app', '1.0', ['old'])},
+        'old': {'1.0': release('old', '1.0')},
+    })
+    session = wensleydale2.Session(bind=orm_db(src))
+    src.data['app']['2.0'] = release('app', '2.0', ['new'])
+    del src.data['app']['1.0']
+    src.data['application'] = src.data.pop('app')
+    wensleydale2.apply_changes(src, session, [
+        ('app', '2.0', 0, 'new release', 1),
+        ('app', '1.0', 0, 'remove', 2),
+        ('application', None, 0, 'rename from app', 3),
+    ])
+    assert wensleydale2.reverse_dependencies(session, 'old') == set()
+    assert wensleydale2.reverse_dependencies(session, 'new') == {'application'}
+
+def test_rebuild(orm_db):
+    """The index can be rebuilt from stored requirement strings"""
+    src = FakeSource({
+        'app': {'1.0': release('app', '1.0', ['a', 'b']), '2.0': release('app', '2.0', ['c'])},
+    })
+    session = wensleydale2.Session(bind=orm_db(src))
+    before = wensleydale2.dependencies(session, 'app')
+    session.execute(wensleydale2.depgraph.edges_t.delete())
+    assert wensleydale2.dependencies(session, 'app') == set()
+    wensleydale2.rebuild_dependency_index(session)
+    assert wensleydale2.dependencies(session, 'app') == before == {'a', 'b', 'c'}
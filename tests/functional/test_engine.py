@@ -0,0 +1,41 @@
+from sqlalchemy import event
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+
+def test_wal_profile(tmp_path):
+    """The wal profile switches SQLite to WAL mode"""
+    db = wensleydale2.make_engine('sqlite:///{}'.format(tmp_path / 'm.db'), 'wal')
+    assert db.execute("pragma journal_mode").scalar() == 'wal'
+    assert db.execute("pragma synchronous").scalar() == 1
+
+def test_readers_do_not_block_writer(tmp_path):
+    """A writer can commit while a reader is part way through a query"""
+    db = wensleydale2.make_engine('sqlite:///{}'.format(tmp_path / 'm.db'), 'wal',
+            connect_args={'timeout': 0.1})
+    wensleydale2.create(db, FakeSource(generate(5)))
+    reader = db.connect()
+    rows = reader.execute("select name from packages")
+    first = rows.fetchone()
+    writer = wensleydale2.Session(bind=db)
+    wensleydale2.pkg_add(writer, FakeSource(generate(6)), 'pkg000005')
+    writer.commit()
+    # The reader still sees the data as it was when its query started
+    assert [first] + rows.fetchall() == [('pkg00000{}'.format(i),) for i in range(5)]
+    assert reader.execute("select count(*) from packages").scalar() == 6
+    reader.close()
+
+def test_commit_interval_groups_windows():
+    """With an interval, several windows share one commit"""
+    src = FakeSource(generate(5))
+    db = wensleydale2.make_engine('sqlite://')
+    wensleydale2.create(db, src)
+    session = wensleydale2.Session(bind=db)
+    commits = []
+    event.listen(session, 'after_commit', lambda s: commits.append(1))
+    changes = [('pkg00000{}'.format(i % 5), '1.0', 0, 'new release', 10 + i) for i in range(20)]
+    wensleydale2.apply_changes(src, session, changes, window=2, interval=3600)
+    assert len(commits) == 1
+    assert wensleydale2.get_latest(session) == 29
+    commits.clear()
+    wensleydale2.apply_changes(src, session, changes, window=2)
+    assert len(commits) == 11
@@ -0,0 +1,58 @@
+import pytest
+import wensleydale2
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+
+def test_full_export(tmp_path, mirror):
+    """Every table is exported, with dictionary encoded classifiers"""
+    src, db = mirror(5, serial=100)
+    part, counts = wensleydale2.export_columnar(db, str(tmp_path), chunk=7)
+    assert part.endswith('serial=100')
+    assert counts['releases'] == db.execute("select count(*) from releases").scalar()
+    assert counts['urls'] == db.execute("select count(*) from urls").scalar()
+    classifiers = pq.read_table(part + '/classifiers.parquet')
+    assert pa.types.is_dictionary(classifiers.schema.field('classifier').type)
+    assert classifiers.num_rows == counts['classifiers']
+    releases = pq.read_table(part + '/releases.parquet')
+    assert 'description' not in releases.schema.names
+    assert set(releases.column('package').to_pylist()) == set(src.packages())
+
+def test_incremental_export(tmp_path, mirror):
+    """Later exports only hold releases changed since the last one"""
+    src, db = mirror(5, serial=100)
+    wensleydale2.export_columnar(db, str(tmp_path))
+    assert wensleydale2.export_columnar(db, str(tmp_path)) is None
+
+    session = wensleydale2.Session(bind=db)
+    name = 'pkg000002'
+    ver = next(iter(src.data[name]))
+    wensleydale2.apply_changes(src, session, [(name, ver, 0, 'new release', 101)])
+    part, counts = wensleydale2.export_columnar(db, str(tmp_path))
+    assert part.endswith('serial=101')
+    releases = pq.read_table(part + '/releases.parquet').to_pydict()
+    assert list(zip(releases['package'], releases['version'], releases['serial'])) == [(name, ver, 101)]
+    assert counts['current'] == db.execute("select count(*) from releases").scalar()
+
+    wensleydale2.export_columnar(db, str(tmp_path), full=True)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['export_state.json', 'serial=101']
+
+def test_export_after_create(tmp_path, mirror):
+    """A package created since the last export is in the next one"""
+    src, db = mirror(3, serial=100)
+    wensleydale2.export_columnar(db, str(tmp_path))
+    src.data['newpkg'] = {'1.0': ({'summary': 'New'}, [])}
+    changes = [('newpkg', None, 0, 'create', 101), ('newpkg', '1.0', 0, 'new release', 102)]
+    wensleydale2.apply_changes(src, wensleydale2.Session(bind=db), changes)
+    part, counts = wensleydale2.export_columnar(db, str(tmp_path))
+    releases = pq.read_table(part + '/releases.parquet').to_pydict()
+    assert list(zip(releases['package'], releases['version'])) == [('newpkg', '1.0')]
+
+def test_arrow_format(tmp_path, mirror):
+    """The arrow format writes IPC streams"""
+    src, db = mirror(3, serial=100)
+    part, counts = wensleydale2.export_columnar(db, str(tmp_path), fmt='arrow', chunk=2)
+    with pa.ipc.open_stream(part + '/urls.arrow') as reader:
+        assert reader.read_all().num_rows == counts['urls']
+    with pytest.raises(ValueError):
+        wensleydale2.export_columnar(db, str(tmp_path), fmt='parquet')
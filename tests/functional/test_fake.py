@@ -0,0 +1,28 @@
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import ChangelogGenerator, FakeSource, generate_pypi
+from wensleydale2.model import Package
+
+def test_pypi_shape():
+    """The PyPI-shaped generator is repeatable and heavy tailed"""
+    data = generate_pypi(300, seed=3)
+    assert data == generate_pypi(300, seed=3)
+    counts = sorted(len(rels) for rels in data.values())
+    assert counts[len(counts) // 2] <= 3 and counts[-1] >= 30
+    files = [len(urls) for rels in data.values() for _, urls in rels.values()]
+    assert min(files) == 1 and max(files) > 10
+
+def test_storms_apply():
+    """Rename and remove storms leave the mirror matching the source"""
+    src = FakeSource(generate_pypi(50))
+    db = create_engine('sqlite://')
+    wensleydale2.create(db, src)
+    session = wensleydale2.Session(bind=db)
+    gen = ChangelogGenerator(src)
+    gen.rename_storm(10)
+    gen.remove_storm(10)
+    gen.remove_storm(10, releases=True)
+    wensleydale2.apply_changes(src, session, src.changes(0))
+    assert sorted(p.name for p in session.query(Package)) == sorted(src.data)
+    for pkg in session.query(Package):
+        assert sorted(r.version for r in pkg.releases) == sorted(src.data[pkg.name])
@@ -0,0 +1,52 @@
+import wensleydale2
+from wensleydale2.fake import ChangelogGenerator, FakeSource, generate
+from wensleydale2.model import Release
+
+def test_follower_applies_new_changes():
+    """Each poll brings the mirror up to date with the changelog"""
+    src = FakeSource(generate(10))
+    db = wensleydale2.make_engine('sqlite://')
+    wensleydale2.create(db, src)
+    session = wensleydale2.Session(bind=db)
+    follower = wensleydale2.Follower(src, session, min_interval=0, max_interval=0)
+    gen = ChangelogGenerator(src, seed=3)
+    for _ in range(30):
+        gen.step()
+    assert follower.poll() == len(src.changelog)
+    assert wensleydale2.get_latest(session) == src.serial
+    assert session.query(Release).count() == sum(len(r) for r in src.data.values())
+    assert follower.median_lag() is not None
+
+def test_interval_adapts():
+    """Polling speeds up when there are changes and backs off when there are none"""
+    src = FakeSource(generate(3))
+    db = wensleydale2.make_engine('sqlite://')
+    wensleydale2.create(db, src)
+    follower = wensleydale2.Follower(src, wensleydale2.Session(bind=db), min_interval=1, max_interval=8)
+    follower.interval = 4
+    follower.poll()
+    assert follower.interval == 6
+    follower.poll()
+    assert follower.interval == 8
+    ChangelogGenerator(src).step()
+    follower.poll()
+    assert follower.interval == 4
+
+def test_run_survives_errors():
+    """A failed poll is rolled back and retried after max_interval"""
+    class Flaky(FakeSource):
+        failures = 1
+        def changes(self, serial):
+            if self.failures:
+                self.failures -= 1
+                raise OSError("Connection reset")
+            return super().changes(serial)
+    src = Flaky(generate(5))
+    db = wensleydale2.make_engine('sqlite://')
+    wensleydale2.create(db, src)
+    session = wensleydale2.Session(bind=db)
+    ChangelogGenerator(src, seed=1).step()
+    follower = wensleydale2.Follower(src, session, min_interval=0, max_interval=0)
+    follower.run(polls=2)
+    assert follower.errors == 1 and isinstance(follower.last_error, OSError)
+    assert wensleydale2.get_latest(session) == src.serial
@@ -0,0 +1,51 @@
+import types
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate, make_snapshot
+
+def snapshot(tmp_path, packages, serial=42):
+    url = 'sqlite:///{}'.format(tmp_path / 'pypi.db')
+    make_snapshot(url, packages, serial=serial)
+    return wensleydale2.JSONSource(url)
+
+def test_listing_is_streamed(tmp_path):
+    """packages returns an iterator, not a list"""
+    src = snapshot(tmp_path, generate(5))
+    assert isinstance(src.packages(), types.GeneratorType)
+    assert sorted(src.packages()) == sorted(generate(5))
+    assert sorted(src.releases('pkg000001')) == sorted(generate(5)['pkg000001'])
+    assert src.latest() == 42
+
+def test_iter_packages_matches_fetch_package(tmp_path):
+    """The single-pass iterator returns what per-release lookups return"""
+    packages = generate(10)
+    packages['empty'] = {}
+    src = snapshot(tmp_path, packages)
+    expected = [wensleydale2.fetch_package(src, name) for name in sorted(packages)]
+    assert list(src.iter_packages()) == expected
+    assert dict(src.iter_packages())['empty'] == []
+
+def test_iter_packages_decodes_each_release_once(tmp_path, monkeypatch):
+    """Each release's JSON is decoded exactly once"""
+    packages = generate(10)
+    src = snapshot(tmp_path, packages)
+    calls = []
+    decode = src._decode
+    monkeypatch.setattr(src, '_decode', lambda j: calls.append(j) or decode(j))
+    for name, releases in src.iter_packages():
+        pass
+    assert len(calls) == sum(len(r) for r in packages.values())
+
+def test_decoders_agree(tmp_path):
+    """The stdlib decoder and the default (possibly faster) one give the same data"""
+    import json
+    src = snapshot(tmp_path, generate(5))
+    std = wensleydale2.JSONSource(src.url, loads=json.loads)
+    assert list(std.iter_packages()) == list(src.iter_packages())
+
+def test_cached(tmp_path):
+    """Everything CachedSource stores can be pickled"""
+    src = snapshot(tmp_path, generate(5))
+    cached = wensleydale2.CachedSource(src, str(tmp_path / 'cache.db'))
+    assert wensleydale2.fetch_package(cached, 'pkg000001') == wensleydale2.fetch_package(src, 'pkg000001')
+    assert cached.releases('pkg000001') == src.releases('pkg000001')
+    assert cached.stats()['hits'] > 0
@@ -0,0 +1,45 @@
+import json
+import urllib.request
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2 import metrics
+from wensleydale2.fake import FakePyPIServer, FakeSource, generate
+
+def test_disabled_records_nothing():
+    """With metrics off, timers are shared no-ops"""
+    assert metrics.current() is None
+    assert metrics.timer('a') is metrics.timer('b')
+    metrics.count('a')
+
+def test_update_phases(tmp_path):
+    """An update records source, decode, build, flush, commit and per-action timings"""
+    fake = FakeSource(generate(5))
+    db = create_engine('sqlite://')
+    wensleydale2.create(db, fake)
+    session = wensleydale2.Session(bind=db)
+    changes = [('pkg000001', '1.0', 0, 'new release', 10),
+               ('pkg000002', None, 0, 'remove', 11)]
+    reg = metrics.enable()
+    try:
+        with FakePyPIServer(fake) as server:
+            src = wensleydale2.PYPISource(server.url)
+            wensleydale2.apply_changes(src, session, changes)
+        server = metrics.serve(0)
+        text = urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(server.server_port)).read()
+        server.shutdown()
+    finally:
+        metrics.disable()
+
+    timers = reg.to_dict()['timers']
+    for phase in ['source.release_data', 'source.release_urls', 'decode', 'build',
+                  'flush', 'commit', 'op.refresh', 'op.remove_package']:
+        assert timers[phase]['calls'] >= 1, phase
+    assert timers['decode']['seconds'] <= timers['source.release_data']['seconds'] + \
+        timers['source.release_urls']['seconds']
+    # The refreshed release was unchanged, so nothing was rewritten
+    assert reg.to_dict()['counters'] == {'changes': 2, 'ops': 2, 'rows_written': 0}
+    assert b'wensleydale_phase_calls_total{phase="op.refresh"} 1' in text
+    assert 'op.refresh' in reg.summary()
+    reg.write_json(str(tmp_path / 'm.json'))
+    with open(str(tmp_path / 'm.json')) as f:
+        assert json.load(f)['counters']['ops'] == 2
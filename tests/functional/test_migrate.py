@@ -0,0 +1,79 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+from wensleydale2.model import Classifier, Release
+
+def old_schema(db):
+    """Turn a current database into one laid out like the original schema"""
+    db.execute("drop table dependency_edges")
+    db.execute("drop table create_journal")
+    db.execute("drop index ix_classifiers_release_id")
+    db.execute("drop index ix_packages_normalized_name")
+    db.execute("alter table packages drop column normalized_name")
+    db.execute("drop index release_version_key")
+    db.execute("alter table releases drop column version_key")
+    db.execute("drop table dependencies")
+    db.execute("create table dependencies (id integer not null, release_id integer not null, "
+               "dep_type varchar not null, req varchar not null, primary key (id, dep_type))")
+    # Interned values were stored in place, in columns with no foreign key
+    for table, names in [('releases', ['description', 'license']), ('classifiers', ['classifier'])]:
+        columns, values = [], []
+        for c in inspect(db).get_columns(table):
+            if c['name'][:-3] in names:
+                columns.append("{} varchar".format(c['name'][:-3]))
+                values.append("(select value from texts where id = {})".format(c['name']))
+            else:
+                columns.append("{} {}".format(c['name'], c['type']))
+                values.append(c['name'])
+        db.execute("create table old ({}, primary key (id))".format(', '.join(columns)))
+        db.execute("insert into old select {} from {}".format(', '.join(values), table))
+        db.execute("drop table {}".format(table))
+        db.execute("alter table old rename to {}".format(table))
+    db.execute("drop table texts")
+
+@pytest.mark.parametrize('dialect', ['sqlite', 'other'])
+def test_upgrade_old_database(tmp_path, monkeypatch, dialect):
+    """upgrade adds missing tables, columns and indexes, keeping the data
+
+    Run as another dialect, it uses no SQLite-only SQL or functions and
+    drops columns rather than rebuilding tables other tables refer to.
+    """
+    db = create_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    wensleydale2.create(db, FakeSource(generate(5)))
+    releases = db.execute("select count(*) from releases").scalar()
+    deps = db.execute("select release_id, dep_type, value from dependencies "
+                      "join texts on texts.id = req_id").fetchall()
+    session = wensleydale2.Session(bind=db)
+    expected = [(c.release_id, c.classifier) for c in session.query(Classifier).order_by(Classifier.id)]
+    description = session.query(Release).get(3).description
+    session.close()
+    old_schema(db)
+    db.execute("insert into dependencies values (1, ?, ?, ?)", deps[0])
+
+    with monkeypatch.context() as m:
+        m.setattr(db.dialect, 'name', dialect)
+        steps = wensleydale2.upgrade(db)
+    assert "added packages.normalized_name" in steps
+    if dialect == 'sqlite':
+        assert "rebuilt releases" in steps and "rebuilt classifiers" in steps
+    else:
+        assert "moved releases.description to texts" in steps
+        assert "moved classifiers.classifier to texts" in steps
+    assert "rebuilt dependencies" in steps
+    assert "added releases.version_key" in steps
+    insp = inspect(db)
+    assert 'ix_classifiers_release_id' in [ix['name'] for ix in insp.get_indexes('classifiers')]
+    assert 'dependency_edges' in insp.get_table_names()
+    assert insp.get_pk_constraint('dependencies')['constrained_columns'] == ['id']
+    assert db.execute("select count(*) from releases").scalar() == releases
+    assert db.execute("select count(*) from packages where normalized_name is null").scalar() == 0
+    assert db.execute("select count(*) from releases where version_key is null").scalar() == 0
+    session = wensleydale2.Session(bind=db)
+    assert [(c.release_id, c.classifier) for c in session.query(Classifier).order_by(Classifier.id)] == expected
+    assert session.query(Release).get(3).description == description
+    assert wensleydale2.dependencies(session, 'pkg{:06d}'.format(0)) is not None
+    assert db.execute("select count(*) from dependency_edges").scalar() == 1
+
+    # Running it again finds nothing to do
+    assert wensleydale2.upgrade(db) == []
@@ -0,0 +1,59 @@
+import threading
+import time
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import FakePyPIServer, FakeSource, generate
+from wensleydale2.model import Package, Release, URL
+
+def test_fetch_packages_returns_everything():
+    """Concurrent fetching returns the same data as fetching serially"""
+    src = FakeSource(generate(20))
+    serial = dict(wensleydale2.fetch_package(src, name) for name in src.packages())
+    fetched = dict(wensleydale2.fetch_packages(src, src.packages(), workers=4))
+    assert fetched == serial
+
+def test_fetch_packages_respects_host_limit():
+    """No more than per_host calls are made to one host at once"""
+    active = [0]
+    peak = [0]
+    lock = threading.Lock()
+    class Counting(FakeSource):
+        def releases(self, package):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            return super().releases(package)
+    src = Counting(generate(20))
+    list(wensleydale2.fetch_packages(src, src.packages(), workers=8, per_host=2))
+    assert peak[0] <= 2
+
+def test_fetch_packages_applies_back_pressure():
+    """Fetching stalls if the consumer does not keep up"""
+    src = FakeSource(generate(50))
+    calls = []
+    orig = src.releases
+    src.releases = lambda name: calls.append(name) or orig(name)
+    it = wensleydale2.fetch_packages(src, src.packages(), workers=2, queue_size=3)
+    next(it)
+    time.sleep(0.05)
+    assert len(calls) <= 2 + 3 + 1
+    it.close()
+
+def test_create_over_xmlrpc():
+    """Packages fetched from an XML-RPC server can be written to the database"""
+    fake = FakeSource(generate(10))
+    db = create_engine('sqlite://')
+    wensleydale2.init(db)
+    session = wensleydale2.Session(bind=db)
+    with FakePyPIServer(fake) as server:
+        src = wensleydale2.PYPISource(server.url)
+        for name, releases in wensleydale2.fetch_packages(src, src.packages(), workers=4):
+            wensleydale2.pkg_add_fetched(session, name, releases)
+    session.commit()
+    assert session.query(Package).count() == 10
+    assert session.query(Release).count() == sum(len(r) for r in fake.data.values())
+    assert session.query(URL).count() == sum(
+        len(urls) for r in fake.data.values() for _, urls in r.values())
@@ -0,0 +1,72 @@
+import wensleydale2
+from wensleydale2 import Op, plan_changes
+from wensleydale2.fake import FakeSource, generate
+from wensleydale2.model import Package, Release
+
+def test_repeated_file_events_coalesce():
+    """Many file events for one release become a single refresh"""
+    changes = [('foo', '1.0', 0, 'add source file foo-1.0.tar.gz', 1)] + [
+        ('foo', '1.0', 0, 'add py3 file foo-1.0-{}.whl'.format(i), i) for i in range(2, 12)]
+    assert plan_changes(changes) == [Op('refresh', 'foo', '1.0', 11, None)]
+
+def test_noop_actions_dropped():
+    """Actions that do not change release data produce no operations"""
+    changes = [
+        ('foo', None, 0, 'add Owner bob', 1),
+        ('foo', None, 0, 'docupdate', 2),
+        ('foo', None, 0, 'update hosting_mode', 3),
+    ]
+    assert plan_changes(changes) == []
+
+def test_latest_wins():
+    """A release removed after being updated is just removed"""
+    changes = [
+        ('foo', '1.0', 0, 'new release', 1),
+        ('foo', '1.0', 0, 'remove', 2),
+    ]
+    assert plan_changes(changes) == [Op('remove_release', 'foo', '1.0', 2, None)]
+
+def test_create_covers_earlier_and_later_release_events():
+    """Recreating a package makes its release events redundant"""
+    changes = [
+        ('foo', '1.0', 0, 'new release', 1),
+        ('foo', None, 0, 'create', 2),
+        ('foo', '1.1', 0, 'new release', 3),
+    ]
+    assert plan_changes(changes) == [Op('reload', 'foo', None, 3, None)]
+
+def test_rename_carries_pending_events():
+    """Events for a package before a rename are applied under the new name"""
+    changes = [
+        ('foo', '1.0', 0, 'new release', 1),
+        ('bar', None, 0, 'rename from foo', 2),
+        ('baz', None, 0, 'rename from bar', 3),
+    ]
+    assert plan_changes(changes) == [
+        Op('rename', 'baz', None, 3, 'foo'),
+        Op('refresh', 'baz', '1.0', 1, None),
+    ]
+
+class Counting(FakeSource):
+    calls = 0
+    def release_data_and_urls(self, package, version):
+        self.calls += 1
+        return super().release_data_and_urls(package, version)
+
+def test_apply_changes_fetches_each_release_once(orm_db):
+    """Catching up costs one fetch per touched release"""
+    src = Counting(generate(5))
+    session = wensleydale2.Session(bind=orm_db(src))
+    src.calls = 0
+    changes = []
+    serial = 100
+    for i in range(10):
+        for name in ['pkg000001', 'pkg000002']:
+            serial += 1
+            changes.append((name, '1.0', 0, 'add source file x{}.tar.gz'.format(i), serial))
+    changes.append(('renamed', None, 0, 'rename from pkg000003', serial + 1))
+    assert wensleydale2.apply_changes(src, session, changes, window=100) == 3
+    assert src.calls == 2
+    assert wensleydale2.get_latest(session) == serial + 1
+    assert session.query(Package).filter_by(name='renamed').count() == 1
+    assert session.query(Release).count() == sum(len(r) for r in src.data.values())
@@ -0,0 +1,67 @@
+import threading
+import wensleydale2
+from wensleydale2.fake import FakeSource
+
+def test_results_are_cached_until_serial_changes(tmp_path, mirror):
+    src, db = mirror(serial=10, on_disk=True)
+    reader = wensleydale2.Reader('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    names = reader.packages()
+    assert names == tuple(sorted(src.data))
+    assert reader.packages() is names
+    assert reader.stats()['hits'] == 1
+
+    # An update elsewhere advances the serial, and the cache is emptied
+    session = wensleydale2.Session(bind=db)
+    src.data['newpkg'] = {'1.0': ({'summary': 'New'}, [])}
+    src.log('newpkg', None, 'create')
+    wensleydale2.apply_changes(src, session, src.changes(wensleydale2.get_latest(session)))
+    assert 'newpkg' in reader.packages()
+    assert reader.latest_releases()['newpkg'] == '1.0'
+    assert reader.stats()['serial'] == 11
+    reader.close()
+
+def test_release_files(mirror):
+    src, db = mirror(on_disk=True)
+    reader = wensleydale2.Reader(db)
+    name = sorted(src.data)[0]
+    version = reader.releases(name)[0]
+    data, urls = src.data[name][version]
+    assert [f['filename'] for f in reader.release_files(name, version)] == sorted(
+        u['filename'] for u in urls)
+
+def test_concurrent_readers_share_one_query(tmp_path, mirror):
+    """Threads asking for the same thing at once run the query once"""
+    src, db = mirror(on_disk=True)
+    reader = wensleydale2.Reader('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    results = []
+    def read():
+        results.append(reader.latest_releases())
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 8 and all(r == results[0] for r in results)
+    assert reader.stats()['misses'] == 1
+    reader.close()
+
+def test_keyword_arguments(tmp_path):
+    """Keyword arguments are passed on, and are part of the cache key"""
+    src = FakeSource({
+        'app': {'1.0': ({'summary': 'A web app', 'requires_dist': ['lib']}, [])},
+        'lib': {'1.0': ({'summary': 'A web library'}, [])},
+        'other': {'1.0': ({'summary': 'A web page'}, [])},
+    })
+    db = wensleydale2.make_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    wensleydale2.init(db)
+    wensleydale2.create_search_index(db)
+    wensleydale2.create(db, src)
+    reader = wensleydale2.Reader(db)
+    assert reader.dependency_closure('lib', reverse=True) == {'app'}
+    assert reader.dependency_closure('lib') == frozenset()
+    assert len(reader.search('web', limit=2)) == 2
+    assert len(reader.search('web')) == 3
+    assert reader.stats()['hits'] == 0
+    assert len(reader.search('web', limit=2)) == 2
+    assert reader.stats()['hits'] == 1
+    reader.close()
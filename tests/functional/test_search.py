@@ -0,0 +1,45 @@
+import wensleydale2
+from wensleydale2.fake import FakeSource
+
+def release(summary, keywords='', description=''):
+    return {'summary': summary, 'keywords': keywords, 'description': description}, []
+
+PACKAGES = {
+    'webby': {'1.0': release('A web framework', 'http wsgi'),
+              '2.0': release('A web framework', 'http wsgi')},
+    'crunch': {'1.0': release('Number crunching', description='Fast arrays for the web')},
+    'quiet': {'1.0': release('Nothing to see')},
+}
+
+def test_search_ranks_matches(orm_db):
+    """Summary matches beat description matches, one result per package"""
+    session = wensleydale2.Session(bind=orm_db(FakeSource(PACKAGES), search_index=True))
+    results = wensleydale2.search(session, 'web')
+    assert [r[0] for r in results] == ['webby', 'crunch']
+    assert [r[0] for r in wensleydale2.search(session, 'wsgi', per_package=False)] == ['webby', 'webby']
+
+def test_index_follows_changes(orm_db):
+    """Adds, removals and renames are reflected in results"""
+    src = FakeSource(PACKAGES)
+    session = wensleydale2.Session(bind=orm_db(src, search_index=True))
+    wensleydale2.rel_remove(session, 'webby', '1.0')
+    wensleydale2.pkg_rename(session, 'crunch', 'cruncher')
+    src.data['quiet']['1.0'] = release('Now a web thing')
+    wensleydale2.rel_remove(session, 'quiet', '1.0')
+    wensleydale2.rel_add(session, src, 'quiet', '1.0')
+    session.commit()
+    results = wensleydale2.search(session, 'web', per_package=False)
+    assert sorted((r[0], r[1]) for r in results) == [('cruncher', '1.0'), ('quiet', '1.0'), ('webby', '2.0')]
+    wensleydale2.pkg_remove(session, 'webby')
+    session.commit()
+    assert 'webby' not in [r[0] for r in wensleydale2.search(session, 'web')]
+
+def test_index_existing_database(orm_db):
+    """Creating the index on a loaded database indexes what is there"""
+    db = orm_db(FakeSource(PACKAGES))
+    session = wensleydale2.Session(bind=db)
+    assert wensleydale2.create_search_index(db)
+    assert not wensleydale2.create_search_index(db)
+    assert [r[0] for r in wensleydale2.search(session, 'crunch*')] == ['crunch']
+    wensleydale2.rebuild_search_index(db)
+    assert [r[0] for r in wensleydale2.search(session, 'crunch*')] == ['crunch']
@@ -0,0 +1,49 @@
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import generate, make_snapshot
+
+def test_shard_bounds_cover_all_packages(tmp_path):
+    """Shard ranges partition the package names"""
+    url = 'sqlite:///{}'.format(tmp_path / 'pypi.db')
+    make_snapshot(url, generate(25))
+    src = wensleydale2.JSONSource(url)
+    bounds = wensleydale2.shard_bounds(src, 4)
+    assert len(bounds) == 4
+    assert bounds[0][0] is None and bounds[-1][1] is None
+    names = []
+    for start, stop in bounds:
+        names.extend(name for name, _ in src.iter_packages(start, stop))
+    assert names == sorted(generate(25))
+
+def test_shard_load_matches_bulk_load(tmp_path, dump):
+    """Loading with worker processes gives the same data as a single process"""
+    url = 'sqlite:///{}'.format(tmp_path / 'pypi.db')
+    make_snapshot(url, generate(30))
+    src = wensleydale2.JSONSource(url)
+
+    single = create_engine('sqlite://')
+    wensleydale2.init(single)
+    with single.connect() as conn:
+        wensleydale2.bulk_load(conn, src.iter_packages())
+
+    sharded = create_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    wensleydale2.init(sharded)
+    with sharded.connect() as conn:
+        assert wensleydale2.shard_load(url, conn, workers=2, shards=5) == 30
+    assert dump(sharded) == dump(single)
+
+def test_shard_load_skips_journalled(tmp_path):
+    """Packages already loaded are skipped when resuming"""
+    url = 'sqlite:///{}'.format(tmp_path / 'pypi.db')
+    make_snapshot(url, generate(30))
+    db = create_engine('sqlite:///{}'.format(tmp_path / 'mirror.db'))
+    wensleydale2.init(db)
+    src = wensleydale2.JSONSource(url)
+    first = [pkg for pkg in src.iter_packages() if pkg[0] < 'pkg000012']
+    with db.connect() as conn:
+        wensleydale2.bulk_load(conn, first, journal=True)
+        done = [name for name, _ in first]
+        assert wensleydale2.shard_load(url, conn, workers=2, shards=3,
+                journal=True, skip=done) == 18
+    assert db.execute("select count(*) from create_journal").scalar() == 30
+    assert db.execute("select count(distinct name) from packages").scalar() == 30
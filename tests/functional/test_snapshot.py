@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.snapshot import TABLES
+
+def contents(db):
+    return {t.name: sorted(tuple(r) for r in db.execute(t.select())) for t in TABLES}
+
+def test_round_trip(tmp_path, mirror):
+    """A restored mirror is identical to the original, and can be updated"""
+    src, db = mirror(20, serial=50)
+    path, serial = wensleydale2.write_snapshot(db, str(tmp_path), chunk=7)
+    assert serial == 50 and path.endswith('mirror-50.w2snap')
+
+    target = create_engine('sqlite:///{}'.format(tmp_path / 'restored.db'))
+    assert wensleydale2.restore_snapshot(target, path) == 50
+    assert contents(target) == contents(db)
+
+    session = wensleydale2.Session(bind=target)
+    src.log('pkg000003', None, 'remove')
+    wensleydale2.apply_changes(src, session, src.changes(wensleydale2.get_latest(session)))
+    assert wensleydale2.get_latest(session) == 51
+    with pytest.raises(ValueError):
+        wensleydale2.restore_snapshot(target, path)
+
+def test_damaged_snapshot(tmp_path, mirror):
+    """Truncated files are detected"""
+    src, db = mirror(20, serial=50)
+    path, serial = wensleydale2.write_snapshot(db, str(tmp_path / 'm.w2snap'))
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-10])
+    target = create_engine('sqlite://')
+    with pytest.raises(ValueError):
+        wensleydale2.restore_snapshot(target, path)
+
+def test_only_data_is_read(tmp_path):
+    """Frames are decoded as JSON, so a crafted file cannot run code when restored"""
+    import pickle, zlib
+    from wensleydale2.snapshot import MAGIC, _length
+    ran = tmp_path / 'ran'
+    class Payload:
+        def __reduce__(self):
+            return (open, (str(ran), 'w'))
+    data = zlib.compress(pickle.dumps(('header', Payload())))
+    path = tmp_path / 'old.w2snap'
+    path.write_bytes(MAGIC + _length.pack(len(data)) + data)
+    with pytest.raises(ValueError):
+        wensleydale2.restore_snapshot(create_engine('sqlite://'), str(path))
+    assert not ran.exists()
+
+def test_reset_sequences():
+    """On PostgreSQL each id sequence is set to the largest restored id"""
+    from wensleydale2.model import reset_sequences
+    statements = []
+    def executor(sql, *multiparams, **params):
+        statements.append((str(sql), params))
+    engine = create_engine('postgresql://', strategy='mock', executor=executor)
+    reset_sequences(engine, TABLES)
+    assert ("select setval(pg_get_serial_sequence(:table, :column), max(id)) from releases",
+            {'table': 'releases', 'column': 'id'}) in statements
+    assert 'texts' not in [params['table'] for sql, params in statements]
@@ -0,0 +1,49 @@
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+from wensleydale2.summary import summaries_t, summary_select
+
+def stored(db):
+    return sorted(tuple(r) for r in db.execute(summaries_t.select()))
+
+def computed(db):
+    return sorted(tuple(r) for r in db.execute(summary_select()))
+
+def test_summaries_follow_changes(orm_db):
+    """After every kind of change the table matches a full recomputation"""
+    src = FakeSource(generate(4))
+    db = orm_db(src)
+    session = wensleydale2.Session(bind=db)
+    assert len(stored(db)) == 4 and stored(db) == computed(db)
+
+    a, b, c, d = sorted(src.data)
+    newest = max(src.data[a])
+    wensleydale2.rel_remove(session, a, newest)
+    hidden = wensleydale2.package_summary(session, b)['version']
+    src.data[b][hidden][0]['_pypi_hidden'] = True
+    wensleydale2.rel_update(session, src, b, hidden)
+    data, urls = src.data[c][max(src.data[c])]
+    urls.append(dict(urls[0], filename='extra.zip', url='extra.zip', size=1000))
+    wensleydale2.rel_update(session, src, c, max(src.data[c]))
+    wensleydale2.pkg_remove(session, d)
+    wensleydale2.pkg_rename(session, a, 'renamed')
+    session.commit()
+    assert stored(db) == computed(db)
+    assert len(stored(db)) == 3
+
+    summary = wensleydale2.package_summary(session, 'renamed')
+    assert summary['version'] != newest
+    assert summary['release_count'] == len(src.data[a]) - 1
+    assert wensleydale2.package_summary(session, b)['version'] != hidden
+    assert wensleydale2.package_summary(session, c)['file_count'] == len(urls)
+    assert wensleydale2.package_summary(session, d) is None
+
+def test_bulk_load_and_rebuild():
+    src = FakeSource(generate(5))
+    db = create_engine('sqlite://')
+    wensleydale2.create(db, src, batch=2)
+    assert len(stored(db)) == 5 and stored(db) == computed(db)
+    before = stored(db)
+    db.execute(summaries_t.delete())
+    assert wensleydale2.rebuild_summaries(db) == 5
+    assert stored(db) == before
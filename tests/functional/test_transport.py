@@ -0,0 +1,46 @@
+from xmlrpc.client import ProtocolError
+import pytest
+import wensleydale2
+from wensleydale2.fake import FakePyPIServer, FakeSource, generate
+from wensleydale2.transport import AdaptiveLimiter, call_with_retry
+
+def test_limiter_aimd():
+    """The limit grows slowly on success and halves on throttling"""
+    limiter = AdaptiveLimiter(initial=8, maximum=10)
+    for _ in range(8):
+        limiter.acquire()
+        limiter.release()
+    assert 8.9 < limiter.limit < 9.1
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert 4.4 < limiter.limit < 4.6
+
+def test_non_retryable_errors_raise():
+    """Errors that retrying cannot fix are raised at once"""
+    calls = []
+    def fail():
+        calls.append(1)
+        raise ProtocolError('x', 404, 'Not Found', {})
+    with pytest.raises(ProtocolError):
+        call_with_retry(fail, sleep=lambda d: None)
+    assert len(calls) == 1
+
+def test_retries_through_injected_errors():
+    """Transient server errors and throttling are retried until they succeed"""
+    fake = FakeSource(generate(10))
+    with FakePyPIServer(fake, error_rate=0.2, throttle_rate=0.2, seed=1) as server:
+        src = wensleydale2.PYPISource(server.url, retries=20, backoff=0.001)
+        fetched = dict(wensleydale2.fetch_packages(src, src.packages(), workers=4))
+        assert server.errors > 0
+    assert fetched == dict(wensleydale2.fetch_package(fake, n) for n in fake.packages())
+    assert src.limiter.throttled > 0
+
+def test_connections_are_reused():
+    """Sequential calls from one thread share one HTTP connection"""
+    fake = FakeSource(generate(5))
+    with FakePyPIServer(fake) as server:
+        src = wensleydale2.PYPISource(server.url)
+        for name in src.packages():
+            wensleydale2.fetch_package(src, name)
+        assert server.calls > 10
+        assert server.connections == 1
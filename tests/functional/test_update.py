@@ -0,0 +1,63 @@
+import wensleydale2
+from wensleydale2.fake import FakeSource, generate
+from wensleydale2.model import Release
+
+def stored(session, name, ver):
+    return session.query(Release).filter_by(version=ver).join(Release.package).filter_by(name=name).one()
+
+def test_description_is_deferred(orm_db):
+    """Querying releases does not load descriptions until they are used"""
+    src = FakeSource(generate(3))
+    session = wensleydale2.Session(bind=orm_db(src))
+    rel = session.query(Release).first()
+    assert 'description' not in rel.__dict__
+    assert rel.description == src.data[rel.package.name][rel.version][0]['description']
+
+def test_refresh_keeps_ids(dump, orm_db):
+    """Refreshing a release only writes what changed"""
+    src = FakeSource(generate(3))
+    db = orm_db(src)
+    session = wensleydale2.Session(bind=db)
+    name, ver = 'pkg000001', '1.0'
+    rel = stored(session, name, ver)
+    ids = (rel.id, sorted(u.id for u in rel.urls), sorted(c.id for c in rel.classifiers))
+    assert wensleydale2.rel_update(session, src, name, ver, 5) == 0
+
+    data, urls = src.data[name][ver]
+    urls.append(dict(urls[0], filename='extra.zip', url='https://files.example.com/extra.zip'))
+    data['summary'] = 'Changed'
+    data['classifiers'] = data['classifiers'] + ['Topic :: Utilities']
+    assert wensleydale2.rel_update(session, src, name, ver, 6) == 3
+    session.commit()
+    session.expire_all()
+    assert (rel.id, sorted(u.id for u in rel.urls)[:-1], sorted(c.id for c in rel.classifiers)[:-1]) == ids
+    assert rel.summary == 'Changed' and rel.serial == 6
+    # Apart from the serial, the result is the same as loading afresh
+    updated, fresh = dump(db), dump(orm_db(src))
+    del updated['releases'], fresh['releases']
+    assert updated == fresh
+
+def test_refresh_removes_rows(dump, orm_db):
+    """Files, classifiers and dependencies gone from the source are deleted"""
+    src = FakeSource(generate(3))
+    db = orm_db(src)
+    session = wensleydale2.Session(bind=db)
+    name, ver = 'pkg000001', '1.0'
+    data, urls = src.data[name][ver]
+    assert urls and data['classifiers'] and data['requires_dist']
+    counts = {t: db.execute("select count(*) from " + t).scalar()
+              for t in ['urls', 'classifiers', 'dependencies', 'dependency_edges']}
+
+    del urls[0]
+    data['classifiers'] = data['classifiers'][1:]
+    data['requires_dist'] = data['requires_dist'][1:]
+    # A dependency is a row in dependencies and one in dependency_edges
+    assert wensleydale2.rel_update(session, src, name, ver, 6) == 4
+    session.commit()
+    assert {t: db.execute("select count(*) from " + t).scalar() for t in counts} == {
+        t: n - 1 for t, n in counts.items()}
+    rel = stored(session, name, ver)
+    assert not rel.urls and not rel.classifiers and not rel.dependencies
+    updated, fresh = dump(db), dump(orm_db(src))
+    del updated['releases'], fresh['releases']
+    assert updated == fresh
@@ -0,0 +1,43 @@
+import random
+from sqlalchemy import create_engine
+import wensleydale2
+from wensleydale2.fake import FakeSource
+from wensleydale2.versions import version_key
+
+# In PEP 440 order
+ORDERED = ['not-a-version', '0.9', '1.0.dev1', '1.0a1.dev1', '1.0a1', '1.0a2', '1.0b1', '1.0rc1',
+           '1.0', '1.0+abc', '1.0+abc.5', '1.0+5', '1.0.post1.dev1', '1.0.post1', '1.0.1',
+           '1.1', '10.0', '1!0.1']
+
+def test_keys_sort_in_pep440_order():
+    shuffled = ORDERED[:]
+    random.Random(0).shuffle(shuffled)
+    assert sorted(shuffled, key=version_key) == ORDERED
+
+def test_equivalent_spellings_share_a_key():
+    assert version_key('1.0') == version_key('1.0.0') == version_key('v1.0')
+    assert version_key('1.0-1') == version_key('1.0.post1') == version_key('1.0.r1')
+    assert version_key('1.0c1') == version_key('1.0RC1')
+
+def test_range_queries():
+    """Keys are stored by both the ORM and the bulk loader, and queried in SQL"""
+    releases = {v: ({'summary': v}, []) for v in ORDERED}
+    src = FakeSource({'bulk': releases, 'orm': dict(releases)})
+    db = create_engine('sqlite://')
+    wensleydale2.create(db, FakeSource({'bulk': releases}))
+    session = wensleydale2.Session(bind=db)
+    wensleydale2.pkg_add(session, src, 'orm')
+    session.commit()
+    for name in ('bulk', 'orm'):
+        assert wensleydale2.version_range(session, name) == ORDERED
+        assert wensleydale2.version_range(session, name, '1.0', '1.1') == ORDERED[8:15]
+        assert wensleydale2.latest_version(session, name) == '1!0.1'
+        assert wensleydale2.package_summary(session, name)['version'] == '1!0.1'
+
+def test_key_column_collation():
+    """PostgreSQL compares version keys byte by byte, as SQLite does"""
+    from sqlalchemy.dialects import postgresql, sqlite
+    from wensleydale2.model import Release
+    column = Release.__table__.c.version_key
+    assert column.type.compile(postgresql.dialect()) == 'VARCHAR COLLATE "C"'
+    assert column.type.compile(sqlite.dialect()) == 'VARCHAR'
@@ -2,8 +2,6 @@
 
 import argparse
 import wensleydale2
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from tqdm import tqdm
 
 def batch_process(lst, batch=100, callback=lambda: None):
@@ -18,31 +16,132 @@ def batch_process(lst, batch=100, callback=lambda: None):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("command", default="update")
+    parser.add_argument("terms", nargs="*",
+            help="Query for search, in SQLite FTS5 syntax, or the file for snapshot and restore")
     parser.add_argument("--source", default="pypi:")
     parser.add_argument("--db", default="sqlite:///pypi_w.db")
+    parser.add_argument("--threads", type=int, default=1,
+            help="Number of concurrent fetches for create")
+    parser.add_argument("--async-connections", type=int, default=None,
+            help="Fetch from PyPI with asyncio over this many connections, for create and update")
+    parser.add_argument("--workers", type=int, default=1,
+            help="Number of processes to load a JSON snapshot with for create")
+    parser.add_argument("--cache", default=None,
+            help="File to cache source responses in")
+    parser.add_argument("--window", type=int, default=1000,
+            help="Number of changes to coalesce at a time for update")
+    parser.add_argument("--commit-interval", type=float, default=None,
+            help="Group update commits until this many seconds have passed")
+    parser.add_argument("--min-interval", type=float, default=1,
+            help="Shortest time between changelog polls for follow")
+    parser.add_argument("--max-interval", type=float, default=60,
+            help="Longest time between changelog polls for follow")
+    parser.add_argument("--out", default="export",
+            help="Directory to write columnar exports to")
+    parser.add_argument("--format", default="parquet", choices=["parquet", "arrow"],
+            help="File format for export")
+    parser.add_argument("--full", action="store_true",
+            help="Export every release, not just those changed since the last export")
+    parser.add_argument("--limit", type=int, default=20,
+            help="Number of search results to show")
+    parser.add_argument("--metrics-interval", type=float, default=None,
+            help="Print a summary of where time went every this many seconds")
+    parser.add_argument("--metrics-json", default=None,
+            help="File to write timings and counts to on exit")
+    parser.add_argument("--metrics-port", type=int, default=None,
+            help="Serve timings and counts for Prometheus on this local port")
+    parser.add_argument("--sqlite-profile", default="default",
+            choices=sorted(wensleydale2.engine.PROFILES),
+            help="PRAGMA settings for SQLite databases")
     args = parser.parse_args()
 
-    db = create_engine(args.db)
-    Session = sessionmaker(db)
-    session = Session()
+    db = wensleydale2.make_engine(args.db, args.sqlite_profile)
+    session = wensleydale2.Session(bind=db)
 
-    if args.source == 'pypi:':
-        src = wensleydale2.PYPISource()
+    if args.source.startswith('pypi:'):
+        src = wensleydale2.PYPISource(args.source[5:] or None)
     elif args.source is None:
         src = wensleydale2.JSONSource()
     else:
         src = wensleydale2.JSONSource(args.source)
+    if args.cache:
+        src = wensleydale2.CachedSource(src, args.cache)
+    asrc = None
+    if args.async_connections and args.source.startswith('pypi:'):
+        asrc = wensleydale2.aio.AsyncPYPISource(args.source[5:] or None,
+                connections=args.async_connections)
 
-    if args.command == 'create':
-        wensleydale2.init(db)
-        for name in batch_process(src.packages(), callback=session.commit):
-            wensleydale2.pkg_add(session, src, name)
-        session.commit()
+    registry = None
+    if args.metrics_interval or args.metrics_json or args.metrics_port:
+        registry = wensleydale2.metrics.enable()
+        if args.metrics_interval:
+            wensleydale2.metrics.report_every(args.metrics_interval,
+                    lambda reg: print(reg.summary(), flush=True))
+        if args.metrics_port:
+            wensleydale2.metrics.serve(args.metrics_port)
+
+    if args.command == 'upgrade':
+        for step in wensleydale2.upgrade(db):
+            print(step)
+    elif args.command == 'summarise':
+        print("Summarised {} packages".format(wensleydale2.rebuild_summaries(db)))
+    elif args.command == 'prune':
+        print("Removed {} unused texts".format(wensleydale2.prune_texts(db)))
+    elif args.command == 'create':
+        if asrc:
+            n = wensleydale2.aio.create(db, asrc, progress=batch_process)
+        else:
+            n = wensleydale2.create(db, src, threads=args.threads, workers=args.workers,
+                    progress=batch_process)
+        print("Loaded {} packages".format(n))
     elif args.command == 'update':
         serial = wensleydale2.get_latest(session)
         changes = src.changes(serial)
         if changes:
             print("Getting changes from {} to {}".format(serial, max(c[4] for c in changes)))
-            for change in batch_process(changes, callback=session.commit, batch=1):
-                wensleydale2.process_change(src, session, change)
-            session.commit()
+            if asrc:
+                n = wensleydale2.aio.apply_changes(asrc, session, changes, window=args.window)
+            else:
+                n = wensleydale2.apply_changes(src, session, changes, window=args.window,
+                        interval=args.commit_interval)
+            print("Applied {} operations for {} changes".format(n, len(changes)))
+    elif args.command == 'export':
+        result = wensleydale2.export_columnar(db, args.out, args.format, full=args.full)
+        if result is None:
+            print("Nothing has changed since the last export")
+        else:
+            part, counts = result
+            print("Exported to {}: {}".format(part,
+                ", ".join("{} {}".format(n, t) for t, n in counts.items())))
+    elif args.command == 'snapshot':
+        path, serial = wensleydale2.write_snapshot(db, args.terms[0] if args.terms else '.')
+        print("Wrote snapshot at serial {} to {}".format(serial, path))
+    elif args.command == 'restore':
+        serial = wensleydale2.restore_snapshot(db, args.terms[0])
+        print("Restored serial {}, run update to catch up from there".format(serial))
+    elif args.command == 'changelog':
+        # Archive the source's changelog in --db, which can be a JSON snapshot
+        n = wensleydale2.update_archive(db, src)
+        print("Archived {} changelog entries".format(n))
+    elif args.command == 'index':
+        if not wensleydale2.create_search_index(db):
+            wensleydale2.rebuild_search_index(db)
+        print("Search index is up to date")
+    elif args.command == 'search':
+        for name, version, summary, score in wensleydale2.search(session, ' '.join(args.terms), args.limit):
+            print("{} {}: {}".format(name, version, summary))
+    elif args.command == 'follow':
+        def report(follower):
+            print("Serial {}: {} changes in {} polls, median lag {:.1f}s, next poll in {:.1f}s".format(
+                wensleydale2.get_latest(session), follower.applied, follower.polls,
+                follower.median_lag(), follower.interval), flush=True)
+        follower = wensleydale2.Follower(src, session, args.min_interval, args.max_interval)
+        try:
+            follower.run(report=report)
+        except KeyboardInterrupt:
+            pass
+
+    if registry:
+        print(registry.summary())
+        if args.metrics_json:
+            registry.write_json(args.metrics_json)
@@ -1,97 +1,245 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, func
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import select, and_
 from sqlalchemy.schema import Table
+from urllib.parse import urlparse
 from xmlrpc.client import ServerProxy
 import json
 import datetime
-from .model import Base, LatestChange, Package, Release, URL, new_package, set_release_data
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from .model import (Base, CreateJournal, LatestChange, MirrorSession, Package, Release, URL,
+        new_package, set_release_data, update_release_data)
+from .pipeline import fetch_package, fetch_packages
+from .transport import AdaptiveLimiter, call_with_retry, TimedTransport, TimedSafeTransport
+from . import metrics
+from . import aio
+from .bulk import BulkLoader, bulk_load
+from .cache import CachedSource
+from .shard import shard_bounds, shard_load
+from .planner import Op, classify, plan_changes
+from .requirements import normalize_name, parse_requirement
+from .migrate import upgrade, prune_texts
+from .engine import make_engine
+from .follow import Follower
+from .depgraph import dependencies, reverse_dependencies, dependency_closure, rebuild_dependency_index
+from .export import export_columnar
+from .search import create_search_index, rebuild_search_index, drop_search_index, search
+from .snapshot import write_snapshot, restore_snapshot
+from .versions import version_key, version_range, latest_version
+from .summary import rebuild_summaries, package_summary
+from .reader import Reader, reader_engine
+from .changelog import (changes_t, init_archive, append_changes, update_archive, archived_changes,
+        import_changes_json)
 
 class PYPISource:
-    PYPI_URL = 'http://pypi.python.org/pypi'
-    def __init__(self):
-        self.pypi = ServerProxy(self.PYPI_URL)
+    PYPI_URL = 'https://pypi.org/pypi'
+    def __init__(self, url=None, retries=5, backoff=0.5, limiter=None):
+        self.url = url or self.PYPI_URL
+        self.host = urlparse(self.url).netloc
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter or AdaptiveLimiter()
+        self._local = threading.local()
+    @property
+    def pypi(self):
+        # ServerProxy is not thread safe, so give each thread its own. Each
+        # keeps its HTTP connection open between calls.
+        proxy = getattr(self._local, 'proxy', None)
+        if proxy is None:
+            transport = TimedSafeTransport() if self.url.startswith('https:') else TimedTransport()
+            proxy = self._local.proxy = ServerProxy(self.url, transport=transport)
+        return proxy
+    def _call(self, method, *args):
+        with metrics.timer('source.' + method):
+            return call_with_retry(lambda: getattr(self.pypi, method)(*args),
+                    retries=self.retries, base=self.backoff, limiter=self.limiter)
     def packages(self):
-        return self.pypi.list_packages()
+        return self._call('list_packages')
     def releases(self, package):
-        return self.pypi.package_releases(package, True)
+        return self._call('package_releases', package, True)
     def urls(self, package, version):
-        return self.pypi.release_urls(package, version)
+        return self._call('release_urls', package, version)
     def release_data(self, package, version):
-        return self.pypi.release_data(package, version)
+        return self._call('release_data', package, version)
     def release_data_and_urls(self, package, version):
         return [self.release_data(package, version), self.urls(package, version)]
     def latest(self):
-        return self.pypi.changelog_last_serial()
+        return self._call('changelog_last_serial')
     def changes(self, serial):
-        return self.pypi.changelog_since_serial(serial)
+        return self._call('changelog_since_serial', serial)
+
+def fast_loads():
+    # orjson is several times faster on release blobs, but is optional
+    if orjson is not None:
+        return orjson.loads
+    return json.loads
 
 class JSONSource:
-    def __init__(self, url='sqlite:///pypi.db'):
+    # Rows are fetched from the database this many at a time
+    CHUNK = 1000
+    def __init__(self, url='sqlite:///pypi.db', loads=None):
+        self.url = url
+        self.loads = loads or fast_loads()
         engine = create_engine(url)
         meta = MetaData(engine)
         self.serial_t = Table('last_serial', meta, autoload=True)
         self.packages_t = Table('packages', meta, autoload=True)
         self.releases_t = Table('releases', meta, autoload=True)
+        # Snapshots with a changelog archive can answer changes() locally
+        self.archive = engine if changes_t.exists(engine) else None
+    def _stream(self, sel):
+        rs = sel.execution_options(stream_results=True).execute()
+        try:
+            while True:
+                rows = rs.fetchmany(self.CHUNK)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            rs.close()
+    def _decode(self, j):
+        try:
+            with metrics.timer('decode'):
+                data = self.loads(j)
+        except (TypeError, ValueError):
+            return {}, []
+        return data['info'], data['urls']
     def packages(self):
-        sel = select([self.packages_t.c.package])
-        rs = sel.execute()
-        return [r[0] for r in rs]
+        sel = select([self.packages_t.c.package]).order_by(self.packages_t.c.package)
+        return (r[0] for r in self._stream(sel))
     def releases(self, package):
+        # A list, as CachedSource pickles it, and one package's releases are few
         sel = select([self.releases_t.c.version]).where(self.releases_t.c.package == package)
-        rs = sel.execute()
-        return [r[0] for r in rs]
+        return [r[0] for r in sel.execute()]
     def urls(self, package, version):
-        sel = select([self.releases_t.c.json]).where(and_(
-            (self.releases_t.c.package == package),
-            (self.releases_t.c.version == version)
-        ))
-        j = sel.scalar()
-        try:
-            data = json.loads(j)
-        except ValueError:
-            return []
-        return data['urls']
+        return self.release_data_and_urls(package, version)[1]
     def release_data(self, package, version):
-        sel = select([self.releases_t.c.json]).where(and_(
-            (self.releases_t.c.package == package),
-            (self.releases_t.c.version == version)
-        ))
-        j = sel.scalar()
-        try:
-            data = json.loads(j)
-        except ValueError:
-            return {}
-        return data['info']
+        return self.release_data_and_urls(package, version)[0]
     def release_data_and_urls(self, package, version):
         sel = select([self.releases_t.c.json]).where(and_(
             (self.releases_t.c.package == package),
             (self.releases_t.c.version == version)
         ))
-        j = sel.scalar()
-        try:
-            data = json.loads(j)
-        except ValueError:
-            return ({}, [])
-        return data['info'], data['urls']
+        with metrics.timer('source.release_data_and_urls'):
+            return self._decode(sel.scalar())
+    def _range(self, sel, col, start, stop):
+        if start is not None:
+            sel = sel.where(col >= start)
+        if stop is not None:
+            sel = sel.where(col < stop)
+        return sel.order_by(col)
+    def iter_releases(self, start=None, stop=None):
+        """Yield (package, version, info, urls) for every release, in package order
+
+        Each release is read and decoded exactly once. start and stop limit
+        the packages returned to the range start <= name < stop.
+        """
+        r = self.releases_t.c
+        sel = self._range(select([r.package, r.version, r.json]), r.package, start, stop)
+        for package, version, j in self._stream(sel):
+            info, urls = self._decode(j)
+            yield package, version, info, urls
+    def iter_packages(self, start=None, stop=None):
+        """Yield (name, releases) for every package, as fetch_package would
+
+        Only one package's releases are held in memory at a time.
+        """
+        p = self.packages_t.c
+        sel = self._range(select([p.package]), p.package, start, stop)
+        releases = groupby(self.iter_releases(start, stop), itemgetter(0))
+        current, group = next(releases, (None, None))
+        for (name,) in self._stream(sel):
+            # Skip releases for packages missing from the packages table
+            while current is not None and current < name:
+                current, group = next(releases, (None, None))
+            if current == name:
+                yield name, [(ver, info, urls) for _, ver, info, urls in group]
+                current, group = next(releases, (None, None))
+            else:
+                yield name, []
+    def package_count(self):
+        return select([func.count()]).select_from(self.packages_t).scalar()
     def latest(self):
-        sel = select([self.serial_t.c.latest])
-        rs = sel.execute()
-        return rs[0][0]
+        return select([self.serial_t.c.latest]).scalar()
     def changes(self, serial):
-        return []
+        if self.archive is None:
+            return []
+        return archived_changes(self.archive, serial)
 
 # Actions
 # =======
 
+# Sessions for the actions below: Session(bind=engine)
+Session = sessionmaker(class_=MirrorSession)
+
 def init(db):
     Base.metadata.create_all(db)
 
+def create(db, src, threads=1, workers=1, batch=100, progress=None):
+    """Load every package from src, resuming an interrupted load if there is one
+
+    The source's serial is recorded in LatestChange before anything is
+    loaded, so a following update closes the gap. Each package is journalled
+    in the same transaction as its data, and a rerun only loads packages
+    not yet in the journal. progress, if given, wraps the iterator of
+    fetched packages (for a progress bar). Returns the number of packages
+    loaded.
+    """
+    init(db)
+    with db.connect() as conn:
+        done = start_create(conn, src.latest)
+        # A JSONSource, possibly behind a CachedSource, which passes
+        # iter_packages and url through
+        if workers > 1 and hasattr(src, 'iter_packages'):
+            return shard_load(src.url, conn, workers, journal=True, skip=done)
+        if hasattr(src, 'iter_packages'):
+            # Resume at the first package not yet loaded. A multi-process
+            # load journals whole shards in any order, so the journal need
+            # not be a prefix of the names; later ones already loaded are
+            # skipped below.
+            start = next((name for name in src.packages() if name not in done), None)
+            if start is None and done:
+                return 0
+            fetched = src.iter_packages(start)
+        else:
+            names = (name for name in src.packages() if name not in done)
+            if threads > 1:
+                fetched = fetch_packages(src, names, workers=threads)
+            else:
+                fetched = (fetch_package(src, name) for name in names)
+        fetched = (pkg for pkg in fetched if pkg[0] not in done)
+        if progress:
+            fetched = progress(fetched)
+        return bulk_load(conn, fetched, batch=batch, journal=True)
+
+def start_create(conn, latest):
+    """Record the serial a create starts from, returning the packages already loaded
+
+    latest is only called, to get the source's serial, on the first run.
+    """
+    latest_t = LatestChange.__table__
+    journal_t = CreateJournal.__table__
+    serial = conn.execute(select([func.max(latest_t.c.serial)])).scalar()
+    if serial is None:
+        conn.execute(latest_t.insert(), serial=latest() or 0)
+    return set(r[0] for r in conn.execute(select([journal_t.c.name])))
+
 def pkg_rename(session, old, new, serial=0):
     pkg = session.query(Package).filter_by(name=old).first()
+    if not pkg:
+        return
     pkg.name = new
+    pkg.normalized_name = normalize_name(new)
     pkg.serial = serial
 
 def pkg_remove(session, name):
@@ -104,71 +252,109 @@ def pkg_remove(session, name):
 def rel_remove(session, name, ver):
     rel = session.query(Release).join(Package).filter(Package.name == name).filter(Release.version == ver).first()
     if rel:
-        session.delete(rel)
+        # Removing it from the package's releases deletes it as an orphan.
+        # A plain session.delete would leave it in the collection, where a
+        # later rel_add in the same transaction would delete it again.
+        rel.package.releases.remove(rel)
     else:
         pass # print("Failed to remove {}/{}".format(name, ver))
 
 def pkg_add(session, src, name, serial=0):
+    pkg_add_fetched(session, *fetch_package(src, name), serial=serial)
+
+def pkg_add_fetched(session, name, releases, serial=0):
+    # releases: [(version, data, urls)], as returned by fetch_package
     # Error checking - handle a package that exists already
     pkg = Package(name)
     session.add(pkg)
     pkg.serial = serial
-    pkg.releases = [Release(ver) for ver in src.releases(name)]
-
-    for rel in pkg.releases:
-        data, urls = src.release_data_and_urls(name, rel.version)
-        set_release_data(rel, data, urls)
+    for ver, data, urls in releases:
+        rel = Release(ver)
+        with metrics.timer('build'):
+            set_release_data(rel, data, urls)
+        pkg.releases.append(rel)
 
 def rel_add(session, src, name, ver, serial=0):
+    rel_update(session, src, name, ver, serial)
+
+def rel_update(session, src, name, ver, serial=0):
+    """Add a release, or bring a stored one up to date with the source
+
+    A stored release is compared with the source's data and only the
+    columns and child rows that differ are written, so the release and
+    its unchanged files, classifiers and dependencies keep their ids.
+    Returns the number of columns and rows written.
+    """
     # Package must exist! Error checking...
     pkg = session.query(Package).filter(Package.name == name).first()
     if not pkg:
-        return
-    for r in pkg.releases:
-        if r.version == ver:
-            session.delete(r)
-            break
-    release = Release(ver)
+        return 0
     data, urls = src.release_data_and_urls(name, ver)
-    set_release_data(release, data, urls)
-    release.package = pkg
-    release.serial = serial
+    rel = session.query(Release).filter_by(package=pkg, version=ver).first()
+    with metrics.timer('build'):
+        if rel is None:
+            rel = Release(ver)
+            set_release_data(rel, data, urls)
+            rel.package = pkg
+            changed = 1
+        else:
+            changed = update_release_data(rel, data, urls)
+    rel.serial = serial
+    metrics.count('rows_written', changed)
+    return changed
 
-def process_change(src, session, change):
-    name, ver, timestamp, action, serial = change
-    ts = datetime.datetime(1070,1,1) + datetime.timedelta(seconds=timestamp)
-    act = action.split()
+def apply_op(src, session, op):
+    metrics.count('ops')
+    with metrics.timer('op.' + op.action):
+        _apply_op(src, session, op)
 
-    if len(act) == 1 and act[0] == 'create':
-        pkg_remove(session, name)
+def _apply_op(src, session, op):
+    if op.action == 'rename':
+        pkg_rename(session, op.old_name, op.name, op.serial)
+    elif op.action == 'remove_package':
+        pkg_remove(session, op.name)
+    elif op.action == 'reload':
+        pkg_remove(session, op.name)
         session.flush()
-        pkg_add(session, src, name)
-    elif len(act) == 1 and act[0] == 'remove':
-        rel_remove(session, name, ver)
-    elif len(act) == 2 and act[0] == 'new' and act[1] == 'release':
-        rel_remove(session, name, ver) # defensive...
-        rel_add(session, src, name, ver, serial)
-    elif len(act) == 3 and act[0] == 'rename' and act[1] == 'from':
-        pkg_rename(session, act[2], name, serial)
-    elif len(act) > 2 and act[0] == 'add' and (act[1] == 'url' or act[2] == 'file'):
-        rel_remove(session, name, ver)
-        rel_add(session, src, name, ver, serial)
-    elif len(act) > 0 and act[0] == 'update' and ver:
-        rel_remove(session, name, ver)
-        rel_add(session, src, name, ver, serial)
-    elif len(act) > 0 and act[0] == 'docupdate':
-        pass # Possibly wrong...
-    elif len(act) > 1 and act[0] == 'update' and act[1] == 'hosting_mode':
-        pass
-    elif len(act) > 1 and act[0] == 'remove' and act[1] == 'file':
-        rel_remove(session, name, ver)
-        rel_add(session, src, name, ver, serial)
-    elif len(act) > 1 and (act[0] == 'remove' or act[0] == 'add') and (act[1] == 'Owner' or act[1] == 'Maintainer'):
-        pass # Nothing to do
-    else:
-        print("Unknown action: {} for {}{}".format(action, name,  '/' + ver if ver else ""))
+        pkg_add(session, src, op.name, op.serial)
+    elif op.action == 'remove_release':
+        rel_remove(session, op.name, op.version)
+    elif op.action == 'refresh':
+        rel_update(session, src, op.name, op.version, op.serial)
 
-    set_latest(session, serial)
+def process_change(src, session, change):
+    metrics.count('changes')
+    for op in plan_changes([change]):
+        apply_op(src, session, op)
+    set_latest(session, change[4])
+
+def apply_changes(src, session, changes, window=1000, interval=None):
+    """Apply changelog entries, coalesced a window at a time
+
+    Each window of entries is reduced with plan_changes and applied,
+    followed by the new latest serial. By default every window is committed
+    on its own; with interval set, windows are grouped into one commit
+    until interval seconds have passed. Either way the latest serial is
+    only ever committed together with the changes it covers. Returns the
+    number of operations applied.
+    """
+    applied = 0
+    last_commit = time.monotonic()
+    for i in range(0, len(changes), window):
+        chunk = changes[i:i+window]
+        metrics.count('changes', len(chunk))
+        ops = plan_changes(chunk)
+        for op in ops:
+            apply_op(src, session, op)
+        set_latest(session, max(c[4] for c in chunk))
+        applied += len(ops)
+        if interval is None or time.monotonic() - last_commit >= interval:
+            with metrics.timer('commit'):
+                session.commit()
+            last_commit = time.monotonic()
+    with metrics.timer('commit'):
+        session.commit()
+    return applied
 
 def get_latest(session):
     latest = session.query(LatestChange).first()
@@ -181,14 +367,18 @@ def set_latest(session, serial):
     if latest is None:
         latest = LatestChange()
         session.add(latest)
-    if latest.serial and latest.serial < serial:
+    if latest.serial is None or latest.serial < serial:
         latest.serial = serial
 
 def copy_all(src, session):
     batch = 1
     n = 0
-    for name in src.packages():
-        pkg_add(session, src, name)
+    if hasattr(src, 'iter_packages'):
+        fetched = src.iter_packages()
+    else:
+        fetched = (fetch_package(src, name) for name in src.packages())
+    for name, releases in fetched:
+        pkg_add_fetched(session, name, releases)
         n = n + 1
         if n == batch:
             print(".", end="", flush=True)
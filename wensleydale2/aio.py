@@ -0,0 +1,398 @@
+import asyncio
+import threading
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from xmlrpc.client import ProtocolError
+from .planner import plan_changes
+from .transport import AdaptiveLimiter, RETRY_CODES, THROTTLE_CODES, backoff_delay
+from . import metrics
+
+# Async sources
+# =============
+#
+# The async sources have the same methods as the sync ones, as coroutines:
+# packages, releases, urls, release_data, release_data_and_urls, latest
+# and changes. AsyncPYPISource speaks XML-RPC over a small pool of
+# keep-alive HTTP connections using asyncio streams, with the same retries
+# and AIMD limit as PYPISource. AsyncSource wraps any sync source (such as
+# JSONSource) by running its calls on a thread pool.
+#
+# The drivers, create and apply_changes, are ordinary blocking functions:
+# they run an event loop in a background thread, where any number of
+# packages can be in flight for the cost of a coroutine each, and hand the
+# fetched data back through a bounded queue to the calling thread, which
+# writes it with the usual sync code. So the database side is unchanged,
+# and a slow writer holds back the fetching rather than letting results
+# pile up in memory.
+#
+# An async source belongs to the event loop it is first used on; the
+# drivers close it when they finish, and it can then be used again.
+
+class AsyncServerProxy:
+    """A minimal XML-RPC client on asyncio streams, with a connection pool
+
+    At most connections requests are sent at once, each on its own HTTP/1.1
+    connection; connections are kept open and reused.
+    """
+    def __init__(self, url, connections=16):
+        parts = urlsplit(url)
+        self.url = url
+        self.ssl = parts.scheme == 'https'
+        self.hostname = parts.hostname
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.path = parts.path or '/RPC2'
+        self.connections = connections
+        self.opened = 0
+        self._idle = []
+        self._slots = None
+
+    async def _connect(self):
+        self.opened += 1
+        return await asyncio.open_connection(self.hostname, self.port, ssl=self.ssl or None)
+
+    async def _request(self, reader, writer, body):
+        writer.write(
+            "POST {} HTTP/1.1\r\nHost: {}\r\nContent-Type: text/xml\r\n"
+            "Content-Length: {}\r\nUser-Agent: wensleydale\r\n\r\n".format(
+                self.path, self.hostname, len(body)).encode('ascii') + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        parts = status_line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise ConnectionResetError("Bad status line {!r}".format(status_line))
+        status = int(parts[1])
+        reason = parts[2].strip() if len(parts) > 2 else ''
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b''.join(chunks)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read()
+            headers['connection'] = 'close'
+        keep = headers.get('connection', '').lower() != 'close' and parts[0] != 'HTTP/1.0'
+        return status, reason, headers, data, keep
+
+    async def call(self, method, *params):
+        body = xmlrpc.client.dumps(params, method, allow_none=True).encode('utf-8')
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.connections)
+        async with self._slots:
+            reader, writer = self._idle.pop() if self._idle else await self._connect()
+            try:
+                status, reason, headers, data, keep = await self._request(reader, writer, body)
+            except BaseException:
+                writer.close()
+                raise
+            if keep:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+        if status != 200:
+            raise ProtocolError(self.url, status, reason, headers)
+        with metrics.timer('decode'):
+            result, _ = xmlrpc.client.loads(data)
+        return result[0]
+
+    async def aclose(self):
+        idle, self._idle = self._idle, []
+        for reader, writer in idle:
+            writer.close()
+        self._slots = None
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """AdaptiveLimiter for coroutines"""
+    def _condition(self):
+        loop = asyncio.get_running_loop()
+        if getattr(self, '_loop', None) is not loop:
+            self._loop = loop
+            self._async_cond = asyncio.Condition()
+        return self._async_cond
+
+    async def acquire(self):
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+
+    async def release(self, throttled=False):
+        cond = self._condition()
+        async with cond:
+            self._update(throttled)
+            cond.notify_all()
+
+async def call_with_retry(fn, retries=5, base=0.5, cap=60, limiter=None, sleep=asyncio.sleep):
+    """Await fn(), retrying transient failures as transport.call_with_retry does"""
+    for attempt in range(retries + 1):
+        if limiter:
+            await limiter.acquire()
+        throttled = False
+        retry_after = 0
+        try:
+            return await fn()
+        except ProtocolError as e:
+            if e.errcode not in RETRY_CODES or attempt == retries:
+                raise
+            throttled = e.errcode in THROTTLE_CODES
+            try:
+                retry_after = float((e.headers or {}).get('retry-after', 0))
+            except ValueError:
+                pass
+        except (OSError, EOFError):
+            if attempt == retries:
+                raise
+        finally:
+            if limiter:
+                await limiter.release(throttled)
+        await sleep(max(retry_after, backoff_delay(attempt, base, cap)))
+
+class AsyncPYPISource:
+    PYPI_URL = 'https://pypi.org/pypi'
+    def __init__(self, url=None, connections=16, retries=5, backoff=0.5, limiter=None):
+        self.url = url or self.PYPI_URL
+        self.host = urlsplit(self.url).netloc
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter or AsyncAdaptiveLimiter(initial=4, maximum=connections)
+        self.proxy = AsyncServerProxy(self.url, connections)
+    async def _call(self, method, *args):
+        with metrics.timer('source.' + method):
+            return await call_with_retry(lambda: self.proxy.call(method, *args),
+                    retries=self.retries, base=self.backoff, limiter=self.limiter)
+    async def packages(self):
+        return await self._call('list_packages')
+    async def releases(self, package):
+        return await self._call('package_releases', package, True)
+    async def urls(self, package, version):
+        return await self._call('release_urls', package, version)
+    async def release_data(self, package, version):
+        return await self._call('release_data', package, version)
+    async def release_data_and_urls(self, package, version):
+        return list(await asyncio.gather(self.release_data(package, version),
+                                         self.urls(package, version)))
+    async def latest(self):
+        return await self._call('changelog_last_serial')
+    async def changes(self, serial):
+        return await self._call('changelog_since_serial', serial)
+    async def aclose(self):
+        await self.proxy.aclose()
+
+class AsyncSource:
+    """Any sync source, with its calls run on a pool of threads"""
+    def __init__(self, src, workers=8):
+        self.src = src
+        self.host = getattr(src, 'host', None)
+        self.workers = workers
+        self._executor = None
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+    async def packages(self):
+        # Sync sources may stream their package list
+        return await self._run(lambda: list(self.src.packages()))
+    async def releases(self, package):
+        return await self._run(lambda: list(self.src.releases(package)))
+    async def urls(self, package, version):
+        return await self._run(self.src.urls, package, version)
+    async def release_data(self, package, version):
+        return await self._run(self.src.release_data, package, version)
+    async def release_data_and_urls(self, package, version):
+        return await self._run(self.src.release_data_and_urls, package, version)
+    async def latest(self):
+        return await self._run(self.src.latest)
+    async def changes(self, serial):
+        return await self._run(self.src.changes, serial)
+    async def aclose(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+class AsyncJSONSource(AsyncSource):
+    """JSONSource as an async source
+
+    For a create, the sync JSONSource is quicker, as it reads the snapshot
+    in a single pass; this is for sharing one interface with AsyncPYPISource.
+    """
+    def __init__(self, url='sqlite:///pypi.db', workers=4, loads=None):
+        from . import JSONSource
+        super().__init__(JSONSource(url, loads), workers)
+
+async def fetch_package(src, name):
+    """pipeline.fetch_package for an async source, fetching the releases concurrently"""
+    versions = await src.releases(name)
+    data = await asyncio.gather(*(src.release_data_and_urls(name, ver) for ver in versions))
+    return name, [(ver,) + tuple(d) for ver, d in zip(versions, data)]
+
+# Running coroutines for sync callers
+# ===================================
+
+_DONE = object()
+
+class _Loop:
+    """An event loop running in a background thread"""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    def run(self, coro):
+        return self.submit(coro).result()
+    def close(self, src=None):
+        async def shutdown():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if src is not None:
+                await src.aclose()
+        self.run(shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+async def _new_queue(size):
+    return asyncio.Queue(size)
+
+def _drain(loop, queue, producer):
+    """Yield what producer puts on queue, in this thread, until it is done"""
+    while True:
+        item = loop.run(queue.get())
+        if item is _DONE:
+            break
+        yield item
+    # Raises anything the producer failed with
+    producer.result()
+
+async def _finish(coro, queue):
+    # Always tell the consumer when the producer stops, unless it was
+    # cancelled because the consumer has gone away.
+    try:
+        await coro
+    except asyncio.CancelledError:
+        raise
+    except BaseException:
+        await queue.put(_DONE)
+        raise
+    await queue.put(_DONE)
+
+async def _produce_packages(src, names, skip, concurrency, queue):
+    if names is None:
+        names = await src.packages()
+    names = (name for name in names if name not in skip)
+    async def worker():
+        # The workers share one iterator, so each name is fetched once
+        for name in names:
+            await queue.put(await fetch_package(src, name))
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+def _fetch_packages(loop, src, names, skip, concurrency, queue_size):
+    queue = loop.run(_new_queue(queue_size or concurrency))
+    producer = loop.submit(_finish(_produce_packages(src, names, skip, concurrency, queue), queue))
+    return _drain(loop, queue, producer)
+
+def fetch_packages(src, names=None, concurrency=256, queue_size=None):
+    """Fetch packages from an async source, yielding (name, releases) as they finish
+
+    Up to concurrency packages are fetched at once, and at most queue_size
+    (by default, concurrency) finished ones wait to be consumed. names
+    defaults to every package in src.
+    """
+    loop = _Loop()
+    try:
+        yield from _fetch_packages(loop, src, names, (), concurrency, queue_size)
+    finally:
+        loop.close(src)
+
+def create(db, src, concurrency=256, batch=100, progress=None):
+    """wensleydale2.create for an async source
+
+    Resumes an interrupted create in the same way, skipping the packages in
+    the journal. Returns the number of packages loaded.
+    """
+    from . import init, start_create
+    from .bulk import bulk_load
+    loop = _Loop()
+    try:
+        init(db)
+        with db.connect() as conn:
+            done = start_create(conn, lambda: loop.run(src.latest()))
+            fetched = _fetch_packages(loop, src, None, done, concurrency, None)
+            if progress:
+                fetched = progress(fetched)
+            return bulk_load(conn, fetched, batch=batch, journal=True)
+    finally:
+        loop.close(src)
+
+class Prefetched:
+    """A sync source answering from data fetched ahead of time"""
+    def __init__(self, packages, releases):
+        self.data = {}
+        for name, rels in packages:
+            self.data[name] = {ver: [data, urls] for ver, data, urls in rels}
+        self.extra = dict(releases)
+    def releases(self, name):
+        return list(self.data[name])
+    def release_data_and_urls(self, name, version):
+        if (name, version) in self.extra:
+            return self.extra[name, version]
+        return self.data[name][version]
+
+async def _produce_windows(src, changes, window, concurrency, queue):
+    limit = asyncio.Semaphore(concurrency)
+    async def package(name):
+        async with limit:
+            return await fetch_package(src, name)
+    async def release(name, version):
+        async with limit:
+            return (name, version), await src.release_data_and_urls(name, version)
+    for i in range(0, len(changes), window):
+        chunk = changes[i:i+window]
+        ops = plan_changes(chunk)
+        packages, releases = await asyncio.gather(
+            asyncio.gather(*(package(op.name) for op in ops if op.action == 'reload')),
+            asyncio.gather(*(release(op.name, op.version) for op in ops if op.action == 'refresh')))
+        await queue.put((chunk, ops, Prefetched(packages, releases)))
+
+def apply_changes(src, session, changes, window=1000, concurrency=256):
+    """wensleydale2.apply_changes for an async source
+
+    The data each window of changes needs is fetched concurrently, and the
+    next window is fetched while the current one is written. Every window
+    is committed with its latest serial. Returns the number of operations
+    applied.
+    """
+    from . import apply_op, set_latest
+    applied = 0
+    loop = _Loop()
+    try:
+        # One window waits while another is written
+        queue = loop.run(_new_queue(1))
+        producer = loop.submit(_finish(_produce_windows(src, changes, window, concurrency, queue), queue))
+        for chunk, ops, fetched in _drain(loop, queue, producer):
+            metrics.count('changes', len(chunk))
+            for op in ops:
+                apply_op(fetched, session, op)
+            set_latest(session, max(c[4] for c in chunk))
+            applied += len(ops)
+            with metrics.timer('commit'):
+                session.commit()
+    finally:
+        loop.close(src)
+    return applied
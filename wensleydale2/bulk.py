@@ -0,0 +1,138 @@
+from sqlalchemy import func
+from sqlalchemy.sql import select
+from .model import (CreateJournal, Package, Release, Dependency, DependencyEdge, Classifier,
+        ProjectURL, URL, Text, reldata_keys, url_keys, unique, release_values,
+        release_dependencies, release_edges, url_values, text_id, insert_missing, reset_sequences,
+        INTERNED)
+from .requirements import normalize_name
+from .summary import refresh_summaries
+from . import metrics
+
+# Bulk loading
+# ============
+#
+# Building an ORM object per row and letting the unit of work flush them one
+# at a time is the bulk of the CPU cost of a full load. The loader here
+# writes the same rows with executemany inserts on the Core tables instead.
+# Ids are assigned in Python, so the loader must be the only writer while
+# it is running. On PostgreSQL each batch moves the id sequences on past
+# the ids it used, so the ORM can add rows afterwards.
+
+TABLES = [t.__table__ for t in (Package, Release, Dependency, DependencyEdge,
+        Classifier, ProjectURL, URL)]
+
+# Release values that are stored in the texts table
+RELEASE_TEXTS = [name for cls, name in INTERNED if cls is Release]
+
+def normalise(name, releases):
+    """Reduce fetched package data to plain row values, without ids
+
+    releases is a list of (version, data, urls), as returned by
+    fetch_package. The result only contains tuples, lists and scalars, so it
+    is cheap to pickle.
+    """
+    return name, [
+        (
+            version,
+            tuple(release_values(data)),
+            release_dependencies(data),
+            release_edges(data),
+            list(data.get('classifiers') or []),
+            unique(data.get('project_urls') or []),
+            [tuple(url_values(u)) for u in urls],
+        )
+        for version, data, urls in releases
+    ]
+
+class BulkLoader:
+    """Accumulates rows and writes them batch packages at a time
+
+    With journal set, each package's name is also recorded in the
+    create_journal table, in the same transaction as its data.
+    """
+    def __init__(self, connection, batch=1000, journal=False):
+        self.conn = connection
+        self.batch = batch
+        self.tables = TABLES + ([CreateJournal.__table__] if journal else [])
+        self.journal = journal
+        self.rows = {t.name: [] for t in self.tables}
+        self.texts = {}
+        self.next_id = {}
+        for t in TABLES:
+            last = connection.execute(select([func.max(t.c.id)])).scalar()
+            self.next_id[t.name] = (last or 0) + 1
+        self.pending = 0
+
+    def _add(self, table, row):
+        row['id'] = self.next_id[table]
+        self.next_id[table] += 1
+        self.rows[table].append(row)
+        return row['id']
+
+    def _text(self, value):
+        tid = text_id(value)
+        if tid is not None:
+            self.texts[tid] = value
+        return tid
+
+    def add(self, item, serial=0):
+        """Add a package in the form returned by normalise"""
+        name, releases = item
+        pkg_id = self._add('packages', {'name': name,
+            'normalized_name': normalize_name(name), 'serial': serial})
+        if self.journal:
+            self.rows['create_journal'].append({'name': name})
+        for version, values, deps, edges, classifiers, project_urls, urls in releases:
+            row = dict(zip(reldata_keys, values))
+            row.update(package_id=pkg_id, version=version, serial=None)
+            for k in RELEASE_TEXTS:
+                row[k + '_id'] = self._text(row.pop(k))
+            rel_id = self._add('releases', row)
+            for dep_type, req in deps:
+                self._add('dependencies', {'release_id': rel_id, 'dep_type': dep_type,
+                    'req_id': self._text(req)})
+            for target, marker in edges:
+                self._add('dependency_edges', {'release_id': rel_id, 'target': target, 'marker': marker})
+            for c in classifiers:
+                self._add('classifiers', {'release_id': rel_id, 'classifier_id': self._text(c)})
+            for url in project_urls:
+                self._add('project_urls', {'release_id': rel_id, 'url': url})
+            for u in urls:
+                row = dict(zip(url_keys, u))
+                row['release_id'] = rel_id
+                self._add('urls', row)
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.flush()
+        return pkg_id
+
+    def flush(self):
+        """Write out all pending rows in a single transaction"""
+        with metrics.timer('bulk_write'), self.conn.begin():
+            if self.texts:
+                insert_missing(self.conn, Text.__table__,
+                        [{'id': k, 'value': v} for k, v in self.texts.items()])
+                self.texts = {}
+            package_ids = [row['id'] for row in self.rows['packages']]
+            for t in self.tables:
+                rows = self.rows[t.name]
+                if rows:
+                    self.conn.execute(t.insert(), rows)
+                    self.rows[t.name] = []
+            refresh_summaries(self.conn, package_ids)
+            reset_sequences(self.conn, TABLES)
+        self.pending = 0
+
+def bulk_load(connection, packages, serial=0, batch=1000, journal=False):
+    """Load (name, releases) pairs, as from fetch_packages, into the database
+
+    Rows are written every batch packages, each batch in its own
+    transaction.
+    """
+    loader = BulkLoader(connection, batch, journal)
+    n = 0
+    for name, releases in packages:
+        loader.add(normalise(name, releases), serial)
+        n += 1
+    loader.flush()
+    return n
@@ -0,0 +1,152 @@
+import json
+import pickle
+import sqlite3
+import threading
+
+# Response cache
+# ==============
+#
+# CachedSource wraps any source and keeps the results of the per-package
+# calls in a local SQLite file, so a re-run (or a restart after a crash)
+# does not have to go back to PyPI for data it already has.
+#
+# Each entry records the serial the cache knew about when it was fetched.
+# Changelog entries seen through changes() bump the serial for their
+# package, and any older entries for that package are dropped.
+
+SCHEMA = """
+create table if not exists entries (
+    key text primary key,
+    package text not null,
+    serial integer not null,
+    used integer not null,
+    value blob not null
+);
+create index if not exists entries_package on entries(package);
+create index if not exists entries_used on entries(used);
+create table if not exists package_serials (
+    package text primary key,
+    serial integer not null
+);
+create table if not exists meta (
+    name text primary key,
+    value integer
+);
+"""
+
+class CachedSource:
+    def __init__(self, src, path, max_entries=1000000):
+        self.src = src
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("select value from meta where name = 'serial'").fetchone()
+        self.serial = row[0] if row else 0
+        row = self.db.execute("select count(*), max(used) from entries").fetchone()
+        self.size = row[0]
+        self.clock = row[1] or 0
+
+    def __getattr__(self, name):
+        return getattr(self.src, name)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'size': self.size,
+        }
+
+    def close(self):
+        self.db.close()
+
+    def _get(self, method, package, *args):
+        key = json.dumps([method, package] + list(args))
+        with self._lock:
+            row = self.db.execute(
+                "select e.value from entries e left join package_serials p "
+                "on p.package = e.package where e.key = ? "
+                "and e.serial >= coalesce(p.serial, 0)", (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                self.clock += 1
+                self.db.execute("update entries set used = ? where key = ?", (self.clock, key))
+                self.db.commit()
+                return pickle.loads(row[0])
+            self.misses += 1
+            serial = self.serial
+        value = getattr(self.src, method)(package, *args)
+        with self._lock:
+            self.clock += 1
+            replaced = self.db.execute("delete from entries where key = ?", (key,)).rowcount
+            self.db.execute("insert into entries values (?, ?, ?, ?, ?)",
+                    (key, package, serial, self.clock, pickle.dumps(value)))
+            self.size += 1 - replaced
+            if self.size > self.max_entries:
+                self._evict(self.size - self.max_entries)
+            self.db.commit()
+        return value
+
+    def _evict(self, n):
+        self.db.execute("delete from entries where key in "
+                "(select key from entries order by used limit ?)", (n,))
+        self.evictions += n
+        self.size -= n
+
+    def _set_serial(self, serial):
+        if serial > self.serial:
+            self.serial = serial
+            self.db.execute("insert or replace into meta values ('serial', ?)", (serial,))
+
+    def invalidate(self, package, serial):
+        """Drop entries for package fetched before the given serial"""
+        with self._lock:
+            self._invalidate(package, serial)
+            self.db.commit()
+
+    def _invalidate(self, package, serial):
+        self.db.execute("insert or replace into package_serials values (?, "
+                "max(?, coalesce((select serial from package_serials where package = ?), 0)))",
+                (package, serial, package))
+        n = self.db.execute("delete from entries where package = ? and serial < ?",
+                (package, serial)).rowcount
+        self.invalidations += n
+        self.size -= n
+
+    def releases(self, package):
+        return self._get('releases', package)
+    def urls(self, package, version):
+        return self._get('urls', package, version)
+    def release_data(self, package, version):
+        return self._get('release_data', package, version)
+    def release_data_and_urls(self, package, version):
+        return self._get('release_data_and_urls', package, version)
+
+    def latest(self):
+        serial = self.src.latest()
+        with self._lock:
+            self._set_serial(serial)
+            self.db.commit()
+        return serial
+
+    def changes(self, serial):
+        changes = self.src.changes(serial)
+        with self._lock:
+            for name, ver, timestamp, action, change_serial in changes:
+                self._invalidate(name, change_serial)
+                # A rename also invalidates anything cached under the old name
+                act = action.split()
+                if len(act) == 3 and act[0] == 'rename' and act[1] == 'from':
+                    self._invalidate(act[2], change_serial)
+            if changes:
+                self._set_serial(max(c[4] for c in changes))
+            self.db.commit()
+        return changes
@@ -0,0 +1,109 @@
+import calendar
+import datetime
+import json
+from sqlalchemy import func, inspect
+from sqlalchemy.sql import select
+from .model import Change, insert_missing
+
+# Changelog archive
+# =================
+#
+# A local copy of PyPI's changelog, one row per entry in the changes table,
+# keyed by serial and indexed by package name and timestamp. Entries are
+# only ever appended, so bringing the archive up to date costs as much as
+# the new entries, however long the history is, and each append is a
+# single transaction - a crash leaves the archive as it was before.
+#
+# Entries go in and come out as PyPI's changelog returns them:
+#
+#   (name, version, timestamp, action, serial)
+#
+# with the timestamp in seconds since the epoch. The archive can live in
+# the mirror's database or in a JSON snapshot, where JSONSource.changes
+# answers from it.
+
+changes_t = Change.__table__
+
+def init_archive(db):
+    changes_t.create(db, checkfirst=True)
+    # Archives made before the name and timestamp indexes get them here
+    have = set(ix['name'] for ix in inspect(db).get_indexes(changes_t.name))
+    for index in changes_t.indexes:
+        if index.name not in have:
+            index.create(db)
+
+def _row(entry):
+    name, version, timestamp, action, serial = entry
+    return {
+        'name': name,
+        'version': version,
+        'timestamp': datetime.datetime.utcfromtimestamp(timestamp),
+        'action': action,
+        'serial': serial,
+    }
+
+def _entry(row):
+    return (row.name, row.version, calendar.timegm(row.timestamp.utctimetuple()),
+            row.action, row.serial)
+
+def archive_latest(db):
+    """The newest serial in the archive, or None if it is empty"""
+    return db.execute(select([func.max(changes_t.c.serial)])).scalar()
+
+def append_changes(db, entries, batch=1000):
+    """Add changelog entries to the archive, returning how many were new
+
+    Entries already archived are skipped, so overlapping ranges can be
+    appended safely.
+    """
+    entries = list(entries)
+    added = 0
+    with db.connect() as conn, conn.begin():
+        for i in range(0, len(entries), batch):
+            rows = {e[4]: _row(e) for e in entries[i:i+batch]}
+            have = set(r[0] for r in conn.execute(
+                select([changes_t.c.serial]).where(changes_t.c.serial.in_(list(rows)))))
+            new = [row for serial, row in rows.items() if serial not in have]
+            insert_missing(conn, changes_t, new)
+            added += len(new)
+    return added
+
+def update_archive(db, src, serial=None):
+    """Fetch the entries newer than the archive from src and append them
+
+    An empty archive starts from serial, or from src's latest serial if
+    that is not given.
+    """
+    init_archive(db)
+    latest = archive_latest(db)
+    if latest is None:
+        latest = src.latest() if serial is None else serial
+    return append_changes(db, src.changes(latest))
+
+def archived_changes(db, serial=None, stop=None, name=None, since=None, until=None):
+    """Archived entries in serial order
+
+    serial and stop limit the serials returned to serial < s <= stop (the
+    range changelog_since_serial would return), name to one package, and
+    since and until the timestamps to since <= t < until.
+    """
+    c = changes_t.c
+    sel = select([changes_t]).order_by(c.serial)
+    if serial is not None:
+        sel = sel.where(c.serial > serial)
+    if stop is not None:
+        sel = sel.where(c.serial <= stop)
+    if name is not None:
+        sel = sel.where(c.name == name)
+    if since is not None:
+        sel = sel.where(c.timestamp >= datetime.datetime.utcfromtimestamp(since))
+    if until is not None:
+        sel = sel.where(c.timestamp < datetime.datetime.utcfromtimestamp(until))
+    return [_entry(row) for row in db.execute(sel)]
+
+def import_changes_json(db, path):
+    """Load a changes.json written by scratch/get_all_changelogs.py"""
+    init_archive(db)
+    with open(path) as f:
+        last_serial, entries = json.load(f)
+    return append_changes(db, entries)
@@ -0,0 +1,83 @@
+from sqlalchemy.sql import select
+from .model import Package, Release, Dependency, DependencyEdge, Text, release_edges
+from .requirements import normalize_name
+
+# Dependency graph queries
+# ========================
+#
+# The dependency_edges table holds one row per (release, project depended
+# on), keyed by normalised project name and indexed in both directions, so
+# these lookups are index joins rather than scans over requirement strings.
+# A project depends on another if any of its releases does.
+
+packages_t = Package.__table__
+releases_t = Release.__table__
+deps_t = Dependency.__table__
+edges_t = DependencyEdge.__table__
+texts_t = Text.__table__
+
+# Names are looked up this many at a time when walking the graph
+CHUNK = 500
+
+def _forward(session, names):
+    sel = select([edges_t.c.target]).distinct().select_from(
+        packages_t.join(releases_t).join(edges_t)
+    ).where(packages_t.c.normalized_name.in_(names))
+    return set(r[0] for r in session.execute(sel))
+
+def _reverse(session, names):
+    sel = select([packages_t.c.normalized_name]).distinct().select_from(
+        edges_t.join(releases_t).join(packages_t)
+    ).where(edges_t.c.target.in_(names))
+    return set(r[0] for r in session.execute(sel))
+
+def dependencies(session, name):
+    """Normalised names of the projects that name depends on"""
+    return _forward(session, [normalize_name(name)])
+
+def reverse_dependencies(session, name):
+    """Normalised names of the projects that depend on name"""
+    return _reverse(session, [normalize_name(name)])
+
+def dependency_closure(session, name, reverse=False):
+    """All projects reachable from name, following dependencies (or
+    reverse dependencies) transitively. name itself is not included unless
+    it is part of a cycle.
+    """
+    step = _reverse if reverse else _forward
+    seen = set()
+    frontier = [normalize_name(name)]
+    while frontier:
+        found = set()
+        for i in range(0, len(frontier), CHUNK):
+            found |= step(session, frontier[i:i+CHUNK])
+        frontier = list(found - seen)
+        seen |= found
+    return seen
+
+def rebuild_dependency_index(session, batch=1000):
+    """Recreate dependency_edges from the stored requirement strings
+
+    For databases loaded before the index existed.
+    """
+    session.execute(edges_t.delete())
+    sel = select([deps_t.c.release_id, deps_t.c.dep_type, texts_t.c.value]).select_from(
+        deps_t.join(texts_t, texts_t.c.id == deps_t.c.req_id)
+    ).order_by(deps_t.c.release_id)
+    rows = []
+    release_id = None
+    data = {}
+    def add_edges():
+        for target, marker in release_edges(data):
+            rows.append({'release_id': release_id, 'target': target, 'marker': marker})
+    for rel, dep_type, req in session.execute(sel):
+        if rel != release_id:
+            add_edges()
+            release_id, data = rel, {}
+            if len(rows) >= batch:
+                session.execute(edges_t.insert(), rows)
+                rows = []
+        data.setdefault(dep_type, []).append(req)
+    add_edges()
+    if rows:
+        session.execute(edges_t.insert(), rows)
@@ -0,0 +1,38 @@
+from sqlalchemy import create_engine, event
+
+# SQLite tuning
+# =============
+#
+# Stock SQLite settings pay for a full fsync on every commit and block
+# readers while a write is committing. The profiles here switch to WAL
+# mode, where readers and a single writer do not block each other, and
+# give SQLite more memory to work with.
+
+WAL = [
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('cache_size', -65536),         # 64MB
+    ('mmap_size', 256 * 2**20),
+    ('temp_store', 'memory'),
+]
+
+PROFILES = {
+    'default': [],
+    'wal': WAL,
+    # For an initial create, which can be resumed if it is interrupted.
+    # An OS crash or power loss can corrupt the database.
+    'bulk': WAL + [('synchronous', 'off')],
+}
+
+def make_engine(url, profile='default', **kw):
+    """create_engine, applying the named PRAGMA profile to SQLite connections"""
+    engine = create_engine(url, **kw)
+    pragmas = PROFILES[profile]
+    if engine.dialect.name == 'sqlite' and pragmas:
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_conn, record):
+            cur = dbapi_conn.cursor()
+            for name, value in pragmas:
+                cur.execute("pragma {}={}".format(name, value))
+            cur.close()
+    return engine
@@ -0,0 +1,210 @@
+import json
+import os
+import shutil
+from sqlalchemy import Boolean, DateTime, Integer, case, func
+from sqlalchemy.sql import select
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+from .model import Package, Release, Dependency, Classifier, URL, LatestChange, Text, INTERNED
+
+# Columnar export
+# ===============
+#
+# Analytical queries over the whole of PyPI are slow as joins in SQLite,
+# and fast as scans over columnar files. export_columnar streams the
+# releases table and its main child tables out in chunks, so memory use
+# depends on the chunk size and not on the size of the mirror.
+#
+# Each export writes one partition, a directory named serial=N for the
+# mirror's latest serial N, holding one file per table:
+#
+#   releases      one row per release, with the package name and serial
+#   urls          the release files
+#   classifiers
+#   dependencies
+#   current       release_id and serial of every release in the mirror
+#
+# The first export contains every release. Later ones only contain the
+# releases whose serial has changed since the last export, which is
+# recorded in export_state.json. To read the mirror as of the newest
+# partition, take each release_id from the newest partition containing
+# it, and keep only the ids listed in that partition's current file -
+# releases missing from it have been removed since.
+
+packages_t = Package.__table__
+releases_t = Release.__table__
+texts_t = Text.__table__
+
+# Rows written per record batch
+CHUNK = 10000
+
+STATE_FILE = 'export_state.json'
+
+# Repetitive string columns, stored as dictionary indexes
+DICTIONARY = {'classifier', 'packagetype', 'python_version', 'dep_type'}
+
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# The serial a release last changed at. rel_add stamps the release, while
+# pkg_add and renames stamp the package; bulk loaded releases have none.
+release_serial = case(
+    [(func.coalesce(releases_t.c.serial, 0) > func.coalesce(packages_t.c.serial, 0),
+      releases_t.c.serial)],
+    else_=func.coalesce(packages_t.c.serial, 0)
+).label('serial')
+
+def arrow_type(name, sqltype):
+    if name in DICTIONARY:
+        return pa.dictionary(pa.int32(), pa.string())
+    if isinstance(sqltype, Boolean):
+        return pa.bool_()
+    if isinstance(sqltype, Integer):
+        return pa.int64()
+    if isinstance(sqltype, DateTime):
+        return pa.timestamp('us')
+    return pa.string()
+
+def with_texts(table, tables, skip=()):
+    """table's exported columns, and tables joined to what they need
+
+    Interned values are exported as text, in place of their ids.
+    """
+    interned = {name + '_id': name for cls, name in INTERNED if cls.__table__ is table}
+    columns = []
+    for c in table.c:
+        if c.name in skip:
+            continue
+        if c.name in interned:
+            name = interned[c.name]
+            if name in skip:
+                continue
+            t = texts_t.alias(name + '_text')
+            tables = tables.outerjoin(t, t.c.id == c)
+            columns.append(t.c.value.label(name))
+        else:
+            columns.append(c)
+    return columns, tables
+
+def child_table(model):
+    t = model.__table__
+    columns, tables = with_texts(t, t.join(releases_t).join(packages_t), skip=('id', 'release_id'))
+    return [t.c.release_id] + columns, tables, True
+
+def exported_tables(descriptions=False):
+    """{file name: (columns, from clause, incremental)} for each exported table"""
+    skip = ['id', 'package_id', 'serial']
+    if not descriptions:
+        skip.append('description')
+    both = releases_t.join(packages_t)
+    rel, rel_tables = with_texts(releases_t, both, skip)
+    return {
+        'releases': ([releases_t.c.id.label('release_id'), packages_t.c.name.label('package'),
+                      release_serial] + rel, rel_tables, True),
+        'urls': child_table(URL),
+        'classifiers': child_table(Classifier),
+        'dependencies': child_table(Dependency),
+        'current': ([releases_t.c.id.label('release_id'), release_serial], both, False),
+    }
+
+def schema(columns):
+    fields = []
+    for c in columns:
+        if c.name == 'serial':
+            fields.append(pa.field('serial', pa.int64()))
+        else:
+            fields.append(pa.field(c.name, arrow_type(c.name, c.type)))
+    return pa.schema(fields)
+
+def open_writer(path, sch, fmt):
+    if fmt == 'parquet':
+        return pq.ParquetWriter(path, sch, compression='zstd')
+    # The IPC stream format, unlike the file format, allows each batch to
+    # carry its own dictionaries.
+    return pa.ipc.new_stream(path, sch)
+
+def write_table(conn, sel, path, sch, fmt, chunk):
+    writer = open_writer(path, sch, fmt)
+    n = 0
+    try:
+        rs = conn.execution_options(stream_results=True).execute(sel)
+        while True:
+            rows = rs.fetchmany(chunk)
+            if not rows:
+                break
+            cols = list(zip(*rows))
+            writer.write_batch(pa.record_batch(
+                [pa.array(col, type=f.type) for col, f in zip(cols, sch)], schema=sch))
+            n += len(rows)
+    finally:
+        writer.close()
+    return n
+
+def read_state(path):
+    try:
+        with open(os.path.join(path, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_state(path, state):
+    tmp = os.path.join(path, STATE_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, os.path.join(path, STATE_FILE))
+
+def export_columnar(db, path, fmt='parquet', full=False, descriptions=False, chunk=CHUNK):
+    """Export the mirror to a new partition under path
+
+    Returns the partition's directory and {table: rows written}, or None if
+    nothing has changed since the last export. With full set, or on the
+    first export, every release is written and any partitions from earlier
+    exports are deleted.
+    """
+    if pa is None:
+        raise RuntimeError("Columnar export needs pyarrow")
+    if fmt not in EXTENSIONS:
+        raise ValueError("Unknown export format {}".format(fmt))
+    os.makedirs(path, exist_ok=True)
+    state = read_state(path)
+    if state and state['format'] != fmt:
+        raise ValueError("{} holds a {} export".format(path, state['format']))
+    if full or not state:
+        since = None
+    else:
+        since = state['serial']
+
+    with db.connect() as conn:
+        serial = conn.execute(select([func.max(LatestChange.serial)])).scalar() or 0
+        if since is not None and serial <= since:
+            return None
+
+        part = os.path.join(path, 'serial={}'.format(serial))
+        tmp = part + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        counts = {}
+        for name, (columns, tables, incremental) in exported_tables(descriptions).items():
+            sel = select(columns).select_from(tables)
+            if incremental and since is not None:
+                sel = sel.where(release_serial > since)
+            sel = sel.order_by(columns[0])
+            counts[name] = write_table(conn, sel, os.path.join(tmp, name + EXTENSIONS[fmt]),
+                    schema(columns), fmt, chunk)
+
+    # The partition only appears once it is complete, and only counts as
+    # exported once the state file says so.
+    shutil.rmtree(part, ignore_errors=True)
+    os.rename(tmp, part)
+    name = os.path.basename(part)
+    earlier = state['partitions'] if state else []
+    if since is None:
+        write_state(path, {'format': fmt, 'serial': serial, 'partitions': [name]})
+        for p in earlier:
+            if p != name:
+                shutil.rmtree(os.path.join(path, p), ignore_errors=True)
+    else:
+        write_state(path, {'format': fmt, 'serial': serial, 'partitions': earlier + [name]})
+    return part, counts
@@ -0,0 +1,399 @@
+from socketserver import ThreadingMixIn
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+import datetime
+import json
+import random
+import threading
+import time
+
+# Synthetic PyPI data
+# ===================
+#
+# Sources and servers that look like PyPI, for tests and benchmarks. All of
+# the data is generated from a seed, so runs are repeatable.
+
+CLASSIFIERS = [
+    'Development Status :: 3 - Alpha',
+    'Development Status :: 4 - Beta',
+    'Development Status :: 5 - Production/Stable',
+    'Intended Audience :: Developers',
+    'License :: OSI Approved :: MIT License',
+    'License :: OSI Approved :: BSD License',
+    'Operating System :: OS Independent',
+    'Programming Language :: Python',
+    'Programming Language :: Python :: 2',
+    'Programming Language :: Python :: 3',
+    'Topic :: Software Development :: Libraries',
+    'Topic :: Utilities',
+]
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+def package_name(i):
+    return 'pkg{:06d}'.format(i)
+
+def release_data(rnd, name, version, names=()):
+    data = {
+        'name': name,
+        'version': version,
+        'author': 'Author {}'.format(rnd.randrange(1000)),
+        'author_email': 'author{}@example.com'.format(rnd.randrange(1000)),
+        'home_page': 'https://example.com/{}'.format(name),
+        'license': rnd.choice(['MIT', 'BSD', 'GPL', 'Apache 2.0', 'UNKNOWN']),
+        'summary': ' '.join(rnd.choice(WORDS) for _ in range(8)),
+        'description': ' '.join(rnd.choice(WORDS) for _ in range(rnd.randrange(20, 400))),
+        'keywords': ' '.join(rnd.sample(WORDS, 3)),
+        'platform': 'UNKNOWN',
+        'package_url': 'https://pypi.python.org/pypi/{}'.format(name),
+        'release_url': 'https://pypi.python.org/pypi/{}/{}'.format(name, version),
+        '_pypi_hidden': False,
+        'classifiers': rnd.sample(CLASSIFIERS, rnd.randrange(0, 6)),
+        'project_urls': ['Source, https://git.example.com/{}'.format(name)],
+    }
+    if names:
+        deps = rnd.sample(names, min(len(names), rnd.randrange(0, 4)))
+        data['requires_dist'] = ['{} (>=1.0)'.format(d) for d in deps if d != name]
+    return data
+
+def url_data(rnd, name, version, upload_time):
+    urls = []
+    for ext, packagetype in [('.tar.gz', 'sdist'), ('-py3-none-any.whl', 'bdist_wheel')]:
+        if packagetype == 'bdist_wheel' and rnd.random() < 0.5:
+            continue
+        filename = '{}-{}{}'.format(name, version, ext)
+        urls.append({
+            'url': 'https://files.example.com/{}/{}'.format(name, filename),
+            'filename': filename,
+            'has_sig': rnd.random() < 0.2,
+            'md5_digest': '{:032x}'.format(rnd.getrandbits(128)),
+            'comment_text': '',
+            'packagetype': packagetype,
+            'python_version': 'source' if packagetype == 'sdist' else 'py3',
+            'downloads': rnd.randrange(100000),
+            'size': rnd.randrange(1000, 1000000),
+            'upload_time': upload_time.strftime('%Y-%m-%dT%H:%M:%S'),
+        })
+    return urls
+
+def iter_generate(n_packages, seed=0, max_releases=10):
+    """Generate (name, {version: (data, urls)}) pairs one package at a time"""
+    rnd = random.Random(seed)
+    names = [package_name(i) for i in range(n_packages)]
+    start = datetime.datetime(2010, 1, 1)
+    for name in names:
+        releases = {}
+        for j in range(rnd.randrange(1, max_releases + 1)):
+            version = '1.{}'.format(j)
+            when = start + datetime.timedelta(seconds=rnd.randrange(10**8))
+            data = release_data(rnd, name, version, names)
+            data['_pypi_ordering'] = j
+            releases[version] = (data, url_data(rnd, name, version, when))
+        yield name, releases
+
+def generate(n_packages, seed=0, max_releases=10):
+    """Generate {name: {version: (data, urls)}} for n_packages packages"""
+    return dict(iter_generate(n_packages, seed, max_releases))
+
+# PyPI-shaped data
+# ----------------
+#
+# iter_generate spreads everything evenly, which is fine for tests but not
+# for measuring: on PyPI most projects have a release or two and a few
+# have hundreds, most releases have one or two files but some carry dozens
+# of wheels, description lengths span four orders of magnitude and are
+# usually unchanged from the release before, and dependencies pile up on a
+# few popular projects. The distributions below have those shapes, with
+# parameters picked by eye rather than fitted.
+
+LICENCE_TEXT = ' '.join(['Permission is hereby granted, free of charge, to any person '
+                         'obtaining a copy of this software'] * 20)
+
+WHEEL_TAGS = ['cp{}-cp{}-{}'.format(v, v, plat)
+              for v in ('36', '37', '38', '39', '310', '311', '312')
+              for plat in ('manylinux1_x86_64', 'manylinux2014_aarch64', 'win32',
+                           'win_amd64', 'macosx_10_9_x86_64', 'musllinux_1_1_x86_64')]
+
+def pareto_int(rnd, alpha, cap):
+    """An integer >= 1 with a heavy tail, at most cap"""
+    return min(cap, int(rnd.paretovariate(alpha)))
+
+def pypi_url_data(rnd, name, version, upload_time):
+    urls = url_data(rnd, name, version, upload_time)[:1]
+    if rnd.random() < 0.4:
+        for tag in rnd.sample(WHEEL_TAGS, pareto_int(rnd, 0.8, len(WHEEL_TAGS))):
+            filename = '{}-{}-{}.whl'.format(name, version, tag)
+            urls.append(dict(urls[0], filename=filename, packagetype='bdist_wheel',
+                python_version=tag.split('-')[0], size=rnd.randrange(10000, 5000000),
+                md5_digest='{:032x}'.format(rnd.getrandbits(128)),
+                url='https://files.example.com/{}/{}'.format(name, filename)))
+    return urls
+
+def pypi_release_data(rnd, name, version, names, previous=None):
+    data = release_data(rnd, name, version)
+    if previous and rnd.random() < 0.7:
+        data['description'] = previous['description']
+        data['requires_dist'] = list(previous.get('requires_dist', []))
+    else:
+        words = min(20000, int(rnd.lognormvariate(5, 1.3)))
+        data['description'] = ' '.join(rnd.choice(WORDS) for _ in range(words))
+        # Low indexes are the popular projects everyone depends on
+        deps = set(names[int(len(names) * rnd.random() ** 3)]
+                   for _ in range(pareto_int(rnd, 1.2, 60) - 1))
+        data['requires_dist'] = ['{} (>=1.0)'.format(d) for d in sorted(deps) if d != name]
+    data['classifiers'] = rnd.sample(CLASSIFIERS, min(len(CLASSIFIERS), int(rnd.expovariate(0.3))))
+    return data
+
+def iter_generate_pypi(n_packages, seed=0, max_releases=300):
+    """Like iter_generate, but with PyPI's distributions (see above)"""
+    rnd = random.Random(seed)
+    names = [package_name(i) for i in range(n_packages)]
+    start = datetime.datetime(2010, 1, 1)
+    for name in names:
+        releases = {}
+        previous = None
+        licence = LICENCE_TEXT if rnd.random() < 0.05 else None
+        for j in range(pareto_int(rnd, 1.0, max_releases)):
+            version = '1.{}'.format(j)
+            when = start + datetime.timedelta(seconds=rnd.randrange(10**8))
+            data = pypi_release_data(rnd, name, version, names, previous)
+            data['_pypi_ordering'] = j
+            if licence:
+                data['license'] = licence
+            releases[version] = (data, pypi_url_data(rnd, name, version, when))
+            previous = data
+        yield name, releases
+
+def generate_pypi(n_packages, seed=0, max_releases=300):
+    return dict(iter_generate_pypi(n_packages, seed, max_releases))
+
+def make_snapshot(url, packages, serial=0, batch=1000):
+    """Write packages, as returned by generate, in the layout JSONSource reads
+
+    packages can also be an iterator of (name, releases) pairs, so snapshots
+    larger than memory can be built.
+    """
+    engine = create_engine(url)
+    meta = MetaData()
+    serial_t = Table('last_serial', meta, Column('latest', Integer))
+    packages_t = Table('packages', meta, Column('package', String, primary_key=True))
+    releases_t = Table('releases', meta,
+            Column('package', String, primary_key=True),
+            Column('version', String, primary_key=True),
+            Column('json', String))
+    meta.create_all(engine)
+    if isinstance(packages, dict):
+        packages = packages.items()
+    with engine.begin() as conn:
+        conn.execute(serial_t.insert(), latest=serial)
+        names, rels = [], []
+        for name, releases in packages:
+            names.append({'package': name})
+            for version, (data, urls) in releases.items():
+                rels.append({'package': name, 'version': version,
+                    'json': json.dumps({'info': data, 'urls': urls})})
+            if len(rels) >= batch:
+                conn.execute(packages_t.insert(), names)
+                conn.execute(releases_t.insert(), rels)
+                names, rels = [], []
+        if names:
+            conn.execute(packages_t.insert(), names)
+        if rels:
+            conn.execute(releases_t.insert(), rels)
+    return engine
+
+class FakeSource:
+    """An in-memory source with the same interface as PYPISource"""
+    host = 'fake'
+    def __init__(self, packages=None, latency=0, serial=0):
+        self.data = packages if packages is not None else {}
+        self.latency = latency
+        self.serial = serial
+        self.changelog = []
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+    def packages(self):
+        self._wait()
+        return list(self.data)
+    def releases(self, package):
+        self._wait()
+        return list(self.data.get(package, {}))
+    def urls(self, package, version):
+        return self.release_data_and_urls(package, version)[1]
+    def release_data(self, package, version):
+        return self.release_data_and_urls(package, version)[0]
+    def release_data_and_urls(self, package, version):
+        self._wait()
+        data, urls = self.data.get(package, {}).get(version, ({}, []))
+        return [data, urls]
+    def latest(self):
+        return self.serial
+    def changes(self, serial):
+        self._wait()
+        return [c for c in self.changelog if c[4] > serial]
+    def log(self, name, version, action, timestamp=None):
+        self.serial += 1
+        if timestamp is None:
+            timestamp = int(time.time())
+        self.changelog.append((name, version, timestamp, action, self.serial))
+
+class ChangelogGenerator:
+    """Makes a stream of changes to a FakeSource, as PyPI would
+
+    Each step publishes a new release of an existing package, adds a file
+    to an existing release, or creates a new package, and records the
+    change in the source's changelog.
+    """
+    def __init__(self, source, seed=0):
+        self.source = source
+        self.rnd = random.Random(seed)
+        self.names = list(source.data)
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def step(self):
+        rnd = self.rnd
+        src = self.source
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        with self.lock:
+            r = rnd.random()
+            if r < 0.1 or not self.names:
+                name = 'new{:06d}'.format(self.created)
+                self.created += 1
+                data = release_data(rnd, name, '1.0')
+                src.data[name] = {'1.0': (data, url_data(rnd, name, '1.0', now))}
+                self.names.append(name)
+                src.log(name, None, 'create')
+                src.log(name, '1.0', 'new release')
+            elif r < 0.5:
+                name = rnd.choice(self.names)
+                releases = src.data[name]
+                version = '2.{}'.format(len(releases))
+                data = release_data(rnd, name, version)
+                releases[version] = (data, url_data(rnd, name, version, now))
+                src.log(name, version, 'new release')
+            else:
+                name = rnd.choice(self.names)
+                version = rnd.choice(list(src.data[name]))
+                data, urls = src.data[name][version]
+                filename = '{}-{}-{}.zip'.format(name, version, len(urls))
+                urls = urls + [dict(urls[0] if urls else {}, filename=filename,
+                    url='https://files.example.com/{}/{}'.format(name, filename),
+                    upload_time=now.strftime('%Y-%m-%dT%H:%M:%S'))]
+                src.data[name][version] = (data, urls)
+                src.log(name, version, 'add source file {}'.format(filename))
+
+    def rename_storm(self, n):
+        """Rename n packages, as when a batch of projects is renamed at once"""
+        with self.lock:
+            for old in self.rnd.sample(self.names, min(n, len(self.names))):
+                new = old + '-renamed'
+                self.source.data[new] = self.source.data.pop(old)
+                self.names[self.names.index(old)] = new
+                self.source.log(new, None, 'rename from {}'.format(old))
+
+    def remove_storm(self, n, releases=False):
+        """Remove n packages, or with releases set, one release from each of n"""
+        with self.lock:
+            for name in self.rnd.sample(self.names, min(n, len(self.names))):
+                versions = self.source.data[name]
+                if releases and len(versions) > 1:
+                    version = self.rnd.choice(list(versions))
+                    del versions[version]
+                    self.source.log(name, version, 'remove')
+                elif not releases:
+                    del self.source.data[name]
+                    self.names.remove(name)
+                    self.source.log(name, None, 'remove')
+
+    def run(self, rate, stop):
+        """Make about rate changes a second until the stop event is set"""
+        while not stop.wait(1 / rate):
+            self.step()
+
+class _Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    def get_request(self):
+        self.fake.connections += 1
+        return super().get_request()
+
+class _Handler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/pypi', '/RPC2')
+    protocol_version = 'HTTP/1.1'
+    def do_POST(self):
+        status = self.server.fake.inject()
+        if status is None:
+            return super().do_POST()
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    def log_message(self, *args):
+        pass
+
+class FakePyPIServer:
+    """A local XML-RPC server serving a FakeSource, with injected faults
+
+    Use as a context manager; the server runs on a background thread and
+    its address is available as the url attribute. latency is added to
+    every call; error_rate and throttle_rate are the fractions of requests
+    answered with a 500 and a 429 respectively.
+    """
+    def __init__(self, source, latency=0, error_rate=0, throttle_rate=0, seed=0):
+        self.source = source
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', 0), requestHandler=_Handler,
+                logRequests=False, allow_none=True)
+        self.server.fake = self
+        self.server.register_instance(self)
+        self.url = 'http://127.0.0.1:{}/pypi'.format(self.server.server_address[1])
+    def inject(self):
+        with self._lock:
+            r = self.random.random()
+            if r < self.throttle_rate:
+                status = 429
+            elif r < self.throttle_rate + self.error_rate:
+                status = 500
+            else:
+                return None
+            self.errors += 1
+            return status
+    def _dispatch(self, method, params):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        src = self.source
+        if method == 'list_packages':
+            return src.packages()
+        elif method == 'package_releases':
+            return src.releases(params[0])
+        elif method == 'release_data':
+            return src.release_data(*params)
+        elif method == 'release_urls':
+            return src.urls(*params)
+        elif method == 'changelog_last_serial':
+            return src.latest()
+        elif method == 'changelog_since_serial':
+            return src.changes(*params)
+        raise ValueError('Unknown method {}'.format(method))
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    def __enter__(self):
+        return self.start()
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,75 @@
+import statistics
+import threading
+import time
+from xmlrpc.client import ProtocolError
+from sqlalchemy.exc import SQLAlchemyError
+
+# Following the changelog
+# =======================
+#
+# A Follower keeps one source and one session open and polls the
+# changelog, applying whatever it finds with apply_changes. The polling
+# interval halves whenever a poll finds changes and grows by half again
+# whenever one finds nothing, within [min_interval, max_interval], so a
+# busy changelog is polled often and a quiet one is left alone.
+#
+# run keeps going through errors from the source or the database: the
+# session is rolled back, the error kept in last_error, and the next poll
+# waits max_interval, as PyPI or the database may need time to recover.
+
+class Follower:
+    def __init__(self, src, session, min_interval=1, max_interval=60, window=100):
+        self.src = src
+        self.session = session
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.window = window
+        self.polls = 0
+        self.applied = 0
+        self.errors = 0
+        self.last_error = None
+        # Seconds from each change's timestamp to when it was committed
+        self.lags = []
+
+    def poll(self):
+        """Apply any new changes, returning how many there were"""
+        from . import apply_changes, get_latest
+        self.polls += 1
+        changes = self.src.changes(get_latest(self.session))
+        if changes:
+            apply_changes(self.src, self.session, changes, window=self.window)
+            now = time.time()
+            self.lags.extend(now - c[2] for c in changes)
+            del self.lags[:-10000]
+            self.applied += len(changes)
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        return len(changes)
+
+    def median_lag(self):
+        return statistics.median(self.lags) if self.lags else None
+
+    def run(self, stop=None, polls=None, report=None):
+        """Poll until the stop event is set, or polls polls have been made
+
+        report, if given, is called with the follower after each poll that
+        found changes.
+        """
+        stop = stop or threading.Event()
+        while True:
+            try:
+                found = self.poll()
+            except (ProtocolError, OSError, SQLAlchemyError) as e:
+                self.session.rollback()
+                self.errors += 1
+                self.last_error = e
+                self.interval = self.max_interval
+            else:
+                if found and report:
+                    report(self)
+            if polls is not None and self.polls >= polls:
+                break
+            if stop.wait(self.interval):
+                break
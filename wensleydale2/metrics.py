@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from sqlalchemy import event
+from .model import MirrorSession
+
+# Instrumentation
+# ===============
+#
+# Timers and counters for the phases of loading and updating: source calls
+# (source.<method>), decoding responses (decode), building release rows
+# (build), flush, commit and each planned operation (op.<action>). Timers
+# nest, so source time includes its decode time, and commit includes its
+# final flush.
+#
+# Nothing is recorded until enable() is called. Until then timer() hands
+# back a shared do-nothing context manager and count() returns at once, so
+# the instrumented code pays one function call per phase.
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ('registry', 'name', 'start')
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        self.registry.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class Registry:
+    """Accumulated timings and counts, safe to update from any thread"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # name: [calls, total seconds, longest]
+        self.timers = defaultdict(lambda: [0, 0.0, 0.0])
+        self.counters = defaultdict(int)
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            t = self.timers[name]
+            t[0] += 1
+            t[1] += seconds
+            if seconds > t[2]:
+                t[2] = seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'elapsed': time.time() - self.started,
+                'timers': {name: {'calls': c, 'seconds': s, 'max': m}
+                           for name, (c, s, m) in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def summary(self):
+        """One line, the phases that took longest first"""
+        d = self.to_dict()
+        phases = sorted(d['timers'].items(), key=lambda kv: -kv[1]['seconds'])
+        parts = ["{} {:.2f}s/{}".format(name, t['seconds'], t['calls']) for name, t in phases]
+        parts += ["{} {}".format(name, n) for name, n in d['counters'].items()]
+        return "[{:.0f}s] {}".format(d['elapsed'], ", ".join(parts))
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def prometheus(self):
+        """The Prometheus text exposition format"""
+        d = self.to_dict()
+        lines = [
+            '# TYPE wensleydale_phase_seconds_total counter',
+            '# TYPE wensleydale_phase_calls_total counter',
+        ]
+        for name, t in d['timers'].items():
+            lines.append('wensleydale_phase_seconds_total{{phase="{}"}} {}'.format(name, t['seconds']))
+            lines.append('wensleydale_phase_calls_total{{phase="{}"}} {}'.format(name, t['calls']))
+        lines.append('# TYPE wensleydale_events_total counter')
+        for name, n in d['counters'].items():
+            lines.append('wensleydale_events_total{{event="{}"}} {}'.format(name, n))
+        return '\n'.join(lines) + '\n'
+
+class NullRegistry:
+    def timer(self, name):
+        return NULL_TIMER
+    def count(self, name, n=1):
+        pass
+
+_registry = NullRegistry()
+
+def timer(name):
+    """A context manager timing the phase name"""
+    return _registry.timer(name)
+
+def count(name, n=1):
+    _registry.count(name, n)
+
+def current():
+    """The registry being recorded to, or None"""
+    return _registry if isinstance(_registry, Registry) else None
+
+def _flush_start(session, flush_context, instances):
+    session.info['flush_start'] = time.perf_counter()
+
+def _flush_end(session, flush_context):
+    start = session.info.pop('flush_start', None)
+    if start is not None:
+        _registry.record('flush', time.perf_counter() - start)
+
+def enable():
+    """Start recording, returning the new registry"""
+    global _registry
+    disable()
+    _registry = Registry()
+    event.listen(MirrorSession, 'before_flush', _flush_start)
+    event.listen(MirrorSession, 'after_flush_postexec', _flush_end)
+    return _registry
+
+def disable():
+    global _registry
+    if isinstance(_registry, Registry):
+        event.remove(MirrorSession, 'before_flush', _flush_start)
+        event.remove(MirrorSession, 'after_flush_postexec', _flush_end)
+    _registry = NullRegistry()
+
+def report_every(interval, callback, stop=None):
+    """Call callback with the registry every interval seconds, in a daemon thread"""
+    stop = stop or threading.Event()
+    def run():
+        while not stop.wait(interval):
+            reg = current()
+            if reg:
+                callback(reg)
+    threading.Thread(target=run, daemon=True).start()
+    return stop
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def serve(port, host='127.0.0.1'):
+    """Serve the current registry at /metrics in a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            reg = current()
+            if self.path != '/metrics' or reg is None:
+                self.send_error(404)
+                return
+            body = reg.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, format, *args):
+            pass
+    server = _Server((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
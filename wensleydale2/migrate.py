@@ -0,0 +1,175 @@
+from sqlalchemy import inspect, Column, MetaData, Table
+from sqlalchemy.sql import select, bindparam, and_
+from .model import Base, Package, Release, Text, insert_missing, text_id, INTERNED
+from .requirements import normalize_name
+from .versions import version_key
+
+# Schema upgrades
+# ===============
+#
+# create_all only creates missing tables, so databases built by older
+# versions need their columns and indexes brought up to date separately.
+# Every step checks what is already there, so upgrade can be run any
+# number of times.
+
+def add_column(conn, table, column):
+    conn.execute("alter table {} add column {} {}".format(
+        table.name, column.name, column.type.compile(conn.dialect)))
+
+def rebuild_table(conn, table, batch=1000):
+    """Recreate table to match the model, copying its rows across
+
+    Columns are copied by name, if the old table has them, and rows whose
+    primary key repeats one already copied are dropped. This follows
+    SQLite's procedure for changing a table's definition: the new table is
+    filled under a temporary name and renamed once the old one is dropped,
+    so foreign keys in other tables still refer to the right table.
+    """
+    old_columns = set(c['name'] for c in inspect(conn).get_columns(table.name))
+    meta = MetaData()
+    for t in Base.metadata.sorted_tables:
+        t.tometadata(meta)
+    new = table.tometadata(meta, name=table.name + '_new')
+    new.indexes.clear()
+    new.create(conn)
+    old = meta.tables[table.name]
+    names = [c.name for c in table.c if c.name in old_columns]
+    rs = conn.execute(select([old.c[n] for n in names]))
+    while True:
+        rows = rs.fetchmany(batch)
+        if not rows:
+            break
+        insert_missing(conn, new, [dict(zip(names, row)) for row in rows])
+    conn.execute("drop table {}".format(table.name))
+    conn.execute("alter table {} rename to {}".format(new.name, table.name))
+    for index in table.indexes:
+        index.create(conn)
+
+def intern_column(conn, table, key, name, batch=1000):
+    """Store the values of table's old column name in texts, setting name_id
+
+    key is the primary key of the old table, which can differ from the model's.
+    """
+    meta = MetaData()
+    old = Table(table.name, meta, *[Column(c) for c in key + [name, name + '_id']])
+    value = old.c[name]
+    # Texts are written as they are read, keeping only the ids to set after
+    rs = conn.execute(select([old.c[c] for c in key] + [value]).where(value.isnot(None)))
+    ids = []
+    while True:
+        rows = rs.fetchmany(batch)
+        if not rows:
+            break
+        texts = dict((text_id(row[-1]), row[-1]) for row in rows)
+        insert_missing(conn, Text.__table__, [{'id': k, 'value': v} for k, v in texts.items()])
+        ids.extend((row[:-1], text_id(row[-1])) for row in rows)
+    match = and_(*[old.c[c] == bindparam('old_' + c) for c in key])
+    for i in range(0, len(ids), batch):
+        conn.execute(old.update().where(match).values({name + '_id': bindparam('tid')}),
+                [dict({'old_' + c: k for c, k in zip(key, pk)}, tid=tid) for pk, tid in ids[i:i+batch]])
+
+def upgrade(db, batch=1000):
+    """Bring an existing database's schema up to date, returning what was done"""
+    from .search import has_search_index, drop_search_index, create_search_index
+    done = []
+    reindex = False
+    with db.begin() as conn:
+        insp = inspect(conn)
+        existing = set(insp.get_table_names())
+        new_tables = [t for t in Base.metadata.sorted_tables if t.name not in existing]
+
+        Base.metadata.create_all(conn, tables=new_tables)
+        done.extend("created {}".format(t.name) for t in new_tables)
+        # Checked now, as rebuilding releases below adds the column empty
+        need_keys = 'releases' in existing and 'version_key' not in [
+                c['name'] for c in insp.get_columns('releases')]
+
+        # Descriptions, licenses, classifiers and requirements used to be
+        # stored in place, rather than once each in the texts table. Each
+        # gets its _id column, filled in here, and the old column goes when
+        # the table is rebuilt, or is dropped where rebuilding cannot work.
+        for table in Base.metadata.sorted_tables:
+            if table in new_tables:
+                continue
+            columns = set(c['name'] for c in insp.get_columns(table.name))
+            inline = [name for cls, name in INTERNED
+                      if cls.__table__ is table and name in columns and name + '_id' not in columns]
+            # Dependency.dep_type used to be part of the primary key, which
+            # stopped ids being generated.
+            bad_key = (table.name == 'dependencies' and
+                       'dep_type' in insp.get_pk_constraint(table.name)['constrained_columns'])
+            if not (inline or bad_key):
+                continue
+            if table.name == 'releases' and has_search_index(conn):
+                drop_search_index(conn)
+                reindex = True
+            key = insp.get_pk_constraint(table.name)['constrained_columns']
+            for name in inline:
+                add_column(conn, table, table.c[name + '_id'])
+                intern_column(conn, table, key, name, batch)
+            # Other databases cannot drop a table that others refer to
+            if bad_key or conn.dialect.name == 'sqlite':
+                rebuild_table(conn, table, batch)
+                done.append("rebuilt {}".format(table.name))
+            else:
+                for name in inline:
+                    conn.execute("alter table {} drop column {}".format(table.name, name))
+                    done.append("moved {}.{} to texts".format(table.name, name))
+
+        packages_t = Package.__table__
+        if 'packages' in existing and 'normalized_name' not in [
+                c['name'] for c in insp.get_columns('packages')]:
+            add_column(conn, packages_t, packages_t.c.normalized_name)
+            rows = conn.execute(select([packages_t.c.id, packages_t.c.name])).fetchall()
+            for i in range(0, len(rows), batch):
+                conn.execute(
+                    packages_t.update().where(packages_t.c.id == bindparam('pkg_id')),
+                    [{'pkg_id': id, 'normalized_name': normalize_name(name)}
+                     for id, name in rows[i:i+batch]])
+            done.append("added packages.normalized_name")
+
+        releases_t = Release.__table__
+        if need_keys:
+            if 'version_key' not in [c['name'] for c in inspect(conn).get_columns('releases')]:
+                add_column(conn, releases_t, releases_t.c.version_key)
+            rows = conn.execute(select([releases_t.c.id, releases_t.c.version])).fetchall()
+            for i in range(0, len(rows), batch):
+                conn.execute(
+                    releases_t.update().where(releases_t.c.id == bindparam('rel_id')),
+                    [{'rel_id': id, 'version_key': version_key(version)}
+                     for id, version in rows[i:i+batch]])
+            done.append("added releases.version_key")
+
+        for table in Base.metadata.sorted_tables:
+            if table in new_tables:
+                continue
+            have = set(ix['name'] for ix in inspect(conn).get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in have:
+                    index.create(conn)
+                    done.append("created index {}".format(index.name))
+
+    if reindex:
+        create_search_index(db)
+        done.append("rebuilt search index")
+    if 'package_summaries' in [t.name for t in new_tables]:
+        from .summary import rebuild_summaries
+        rebuild_summaries(db)
+        done.append("built package_summaries")
+    if 'dependency_edges' in [t.name for t in new_tables]:
+        from .depgraph import rebuild_dependency_index
+        with db.begin() as conn:
+            rebuild_dependency_index(conn)
+        done.append("built dependency_edges")
+    return done
+
+def prune_texts(db):
+    """Delete texts that no row refers to any more, returning how many
+
+    Texts are shared, so removing or replacing a release leaves its texts
+    behind in case another row uses them.
+    """
+    used = " union ".join("select {0}_id from {1} where {0}_id is not null".format(
+        name, cls.__tablename__) for cls, name in INTERNED)
+    with db.connect() as conn, conn.begin():
+        return conn.execute("delete from texts where id not in ({})".format(used)).rowcount
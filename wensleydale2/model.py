@@ -1,23 +1,136 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref
-from sqlalchemy import ForeignKey, ForeignKeyConstraint, UniqueConstraint
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
-from sqlalchemy import func
+from sqlalchemy.orm import relationship, backref, column_property, Session
+from sqlalchemy import ForeignKey, ForeignKeyConstraint, UniqueConstraint, Index
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime
+from sqlalchemy import func, event
+from sqlalchemy.sql import select, text
 import datetime
+import hashlib
 import xmlrpc.client
+from .requirements import normalize_name, parse_requirement
+from .versions import version_key
 
 Base = declarative_base()
 
+# Texts ids are 64-bit hashes. SQLite integers are 64-bit already, and only
+# an INTEGER PRIMARY KEY is stored as the rowid.
+TextId = BigInteger().with_variant(Integer, 'sqlite')
+
+# Version keys are compared byte by byte, which PostgreSQL only does in the
+# C collation; SQLite's default collation already does.
+VersionKey = String().with_variant(String(collation='C'), 'postgresql')
+
 class LatestChange(Base):
     __tablename__ = 'latest'
     serial = Column(Integer, primary_key=True)
 
+class CreateJournal(Base):
+    # Packages written by create, so that an interrupted run can resume
+    __tablename__ = 'create_journal'
+    name = Column(String, primary_key=True)
+
+class Text(Base):
+    # Strings that many rows repeat - descriptions, licenses, classifiers
+    # and requirements - stored once each. The id is a hash of the value,
+    # so rows can refer to a string without looking it up first.
+    __tablename__ = 'texts'
+    id = Column(TextId, primary_key=True, autoincrement=False)
+    value = Column(String, nullable=False)
+
+def text_id(value):
+    """The texts id for value: a signed 64-bit hash, or None for None"""
+    if value is None:
+        return None
+    digest = hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def interned(id_column, **kw):
+    """A read/write attribute for the text that id_column refers to
+
+    Reading it loads the text with a correlated subquery. Setting it sets
+    id_column, and the text is written to the texts table when the session
+    flushes (see store_texts and store_object_texts).
+    """
+    texts = Text.__table__
+    return column_property(
+        select([texts.c.value]).where(texts.c.id == id_column).as_scalar(), **kw)
+
+def intern_on_set(attr, id_attr):
+    @event.listens_for(attr, 'set')
+    def set_text(target, value, oldvalue, initiator):
+        tid = text_id(value)
+        setattr(target, id_attr, tid)
+        if tid is not None:
+            target.__dict__.setdefault('_new_texts', {})[tid] = value
+
+def insert_missing(conn, table, rows):
+    """Insert rows, skipping any whose primary key is already in table"""
+    if not rows:
+        return
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        conn.execute(table.insert().prefix_with('OR IGNORE'), rows)
+    elif dialect == 'mysql':
+        conn.execute(table.insert().prefix_with('IGNORE'), rows)
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        conn.execute(insert(table).on_conflict_do_nothing(), rows)
+    else:
+        key, = table.primary_key.columns
+        have = set(r[0] for r in conn.execute(
+            select([key]).where(key.in_([row[key.name] for row in rows]))))
+        new = []
+        for row in rows:
+            if row[key.name] not in have:
+                have.add(row[key.name])
+                new.append(row)
+        if new:
+            conn.execute(table.insert(), new)
+
+def reset_sequences(conn, tables):
+    """Move each table's id sequence on to its largest id, on PostgreSQL
+
+    Rows inserted with their ids leave PostgreSQL's sequences where they
+    were, so the next insert would reuse an id. Other databases take the
+    next id from the rows themselves, and are left alone.
+    """
+    if conn.dialect.name != 'postgresql':
+        return
+    quote = conn.dialect.identifier_preparer
+    for t in tables:
+        column = t._autoincrement_column
+        if column is None:
+            continue
+        # No sequence or no rows gives null, and leaves the sequence alone
+        conn.execute(text(
+            "select setval(pg_get_serial_sequence(:table, :column), max({})) from {}".format(
+                quote.quote(column.name), quote.format_table(t))),
+            table=t.name, column=column.name)
+
+class MirrorSession(Session):
+    """A session on a mirror
+
+    Its flush hooks write each flush's interned texts in one statement and
+    keep package summaries up to date. Any session stores texts, one object
+    at a time, but summaries are only maintained by this one, so sessions
+    that write to a mirror should be. Sessions from wensleydale2.Session are.
+    """
+
+@event.listens_for(MirrorSession, 'before_flush')
+def store_texts(session, flush_context, instances):
+    new = {}
+    for obj in list(session.new) + list(session.dirty):
+        new.update(obj.__dict__.pop('_new_texts', {}))
+    insert_missing(session.connection(), Text.__table__,
+            [{'id': k, 'value': v} for k, v in new.items()])
+
 class Package(Base):
     __tablename__ = 'packages'
 
     id = Column(Integer, primary_key=True)
 
     name = Column(String, unique=True, nullable=False)
+    normalized_name = Column(String, index=True)
     releases = relationship("Release", backref="package",
             cascade="all, delete-orphan")
 
@@ -25,6 +138,7 @@ class Package(Base):
 
     def __init__(self, name):
         self.name = name
+        self.normalized_name = normalize_name(name)
 
     def __repr__(self):
         return "<Package(name={})>".format(self.name)
@@ -36,6 +150,9 @@ class Release(Base):
 
     package_id = Column(Integer, ForeignKey('packages.id'), nullable=False)
     version = Column(String, nullable=False)
+    # Sorts in PEP 440 order. Filled in from version on insert by the ORM
+    # and Core alike.
+    version_key = Column(VersionKey, default=lambda ctx: version_key(ctx.current_parameters['version']))
 
     stable_version = Column(String)
 
@@ -45,9 +162,13 @@ class Release(Base):
     maintainer_email = Column(String)
 
     home_page = Column(String)
-    license = Column(String)
+    license_id = Column(TextId, ForeignKey('texts.id'))
+    license = interned(license_id)
     summary = Column(String)
-    description = Column(String)
+    # Long descriptions are most of the data, and rarely needed, so they are
+    # only loaded when accessed.
+    description_id = Column(TextId, ForeignKey('texts.id'))
+    description = interned(description_id, deferred=True)
     keywords = Column(String)
 
     platform = Column(String)
@@ -77,11 +198,14 @@ class Release(Base):
             cascade="all, delete-orphan")
     download_stats = relationship("DownloadStats", backref="release",
             cascade="all, delete-orphan")
+    dependency_edges = relationship("DependencyEdge", backref="release",
+            cascade="all, delete-orphan")
 
     serial = Column(Integer)
 
     __table_args__ = (
         UniqueConstraint('package_id', 'version', name='release_version_uq'),
+        Index('release_version_key', 'package_id', 'version_key'),
     )
 
     def __init__(self, version):
@@ -90,6 +214,22 @@ class Release(Base):
     def __repr__(self):
         return "<Release(version={})>".format(self.version)
 
+class PackageSummary(Base):
+    # Each package's latest visible release, and totals over its files,
+    # maintained by summary.py. It is derived data, rewritten after the
+    # rows it summarises, so it has no foreign keys.
+    __tablename__ = 'package_summaries'
+    package_id = Column(Integer, primary_key=True)
+    release_id = Column(Integer, nullable=False)
+    version = Column(String, nullable=False)
+    release_count = Column(Integer, nullable=False)
+    file_count = Column(Integer, nullable=False)
+    total_size = Column(BigInteger, nullable=False)
+    upload_time = Column(DateTime)
+
+    def __repr__(self):
+        return "<PackageSummary(package_id={}, version={})>".format(self.package_id, self.version)
+
 class Dependency(Base):
     __tablename__ = 'dependencies'
 
@@ -98,24 +238,40 @@ class Dependency(Base):
 
     # Check: valid values are
     #   provides, provides_dist, requires, requires_dist, requires_external, obsoletes, obsoletes_dist
-    dep_type = Column(String, primary_key=True)
+    dep_type = Column(String, nullable=False)
 
-    req = Column(String, nullable=False)
+    req_id = Column(TextId, ForeignKey('texts.id'), nullable=False)
+    req = interned(req_id)
 
     __table_args__ = (
-        UniqueConstraint('release_id', 'dep_type', req, name='dependency_uq'),
+        UniqueConstraint('release_id', 'dep_type', req_id, name='dependency_uq'),
     )
 
     def __repr__(self):
         return "<Dependency(type={}, req={})>".format(self.dep_type, self.req)
 
+class DependencyEdge(Base):
+    # The parsed form of a release's requires_dist and requires entries,
+    # pointing at the normalised name of the project depended on.
+    __tablename__ = 'dependency_edges'
+
+    id = Column(Integer, primary_key=True)
+    release_id = Column(Integer, ForeignKey('releases.id'), nullable=False, index=True)
+
+    target = Column(String, nullable=False, index=True)
+    marker = Column(String)
+
+    def __repr__(self):
+        return "<DependencyEdge(target={}, marker={})>".format(self.target, self.marker)
+
 class Classifier(Base):
     __tablename__ = 'classifiers'
 
     id = Column(Integer, primary_key=True)
-    release_id = Column(Integer, ForeignKey('releases.id'), nullable=False)
+    release_id = Column(Integer, ForeignKey('releases.id'), nullable=False, index=True)
 
-    classifier = Column(String, nullable=False)
+    classifier_id = Column(TextId, ForeignKey('texts.id'), nullable=False)
+    classifier = interned(classifier_id)
 
     # Sadly, classifiers are *not* unique for a package/release - see "acl
     # 0.2" for an example...
@@ -174,7 +330,7 @@ class DownloadStats(Base):
     __tablename__ = 'downloads'
 
     id = Column(Integer, primary_key=True)
-    release_id = Column(Integer, ForeignKey('releases.id'), nullable=False)
+    release_id = Column(Integer, ForeignKey('releases.id'), nullable=False, index=True)
 
     filename = Column(String, nullable=False)
     timestamp = Column(DateTime, default=func.now())
@@ -187,14 +343,36 @@ class DownloadStats(Base):
 
 class Change(Base):
     __tablename__ = 'changes'
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
     version = Column(String)
-    timestamp = Column(DateTime, nullable=False)
+    timestamp = Column(DateTime, nullable=False, index=True)
     action = Column(String)
     serial = Column(Integer, primary_key=True)
     def __repr__(self):
         return "<Change(serial={}, name={}, version={})>".format(self.serial, self.name, self.version)
 
+# Attributes stored in the texts table, and the columns that refer to them
+INTERNED = [
+    (Release, 'license'),
+    (Release, 'description'),
+    (Dependency, 'req'),
+    (Classifier, 'classifier'),
+]
+
+for cls, name in INTERNED:
+    intern_on_set(getattr(cls, name), name + '_id')
+
+def store_object_texts(mapper, connection, target):
+    # Texts that no MirrorSession before_flush has written already
+    new = target.__dict__.pop('_new_texts', None)
+    if new:
+        insert_missing(connection, Text.__table__,
+                [{'id': k, 'value': v} for k, v in new.items()])
+
+for cls in (Release, Dependency, Classifier):
+    event.listen(cls, 'before_insert', store_object_texts)
+    event.listen(cls, 'before_update', store_object_texts)
+
 def new_package(package, versions=None):
     # package: string
     # version: [string]
@@ -238,52 +416,146 @@ reldata_deps = [
     'requires_external',
 ]
 
-def set_release_data(r, data, urls):
-    for k in reldata_keys:
-        if k in data:
-            setattr(r, k, data[k])
-    for k in reldata_deps:
-        if k in data:
-            l = []
-            for i, req in enumerate(data[k]):
-                d = Dependency()
-                d.dep_type = k
-                # d.id = i
-                d.req = req
-                l.append(d)
-            setattr(r, k, l)
-    l = []
-    for i, url in enumerate(data.get('project_urls', [])):
-        u = ProjectURL()
-        # u.id = i
-        u.url = url
-        l.append(c)
-    r.project_urls = l
-    l = []
-    for i, classifier in enumerate(data.get('classifiers', [])):
-        c = Classifier()
-        # c.id = i
-        c.classifier = classifier
-        l.append(c)
-    r.classifiers = l
-    r.urls = [new_url(url) for url in urls]
+url_keys = [
+    'url',
+    'filename',
+    'has_sig',
+    'md5_digest',
+    'comment_text',
+    'packagetype',
+    'python_version',
+    'downloads',
+    'size',
+    'upload_time',
+]
 
-def new_url(urldata):
-    u = URL()
-    u.url = urldata['url']
-    u.filename = urldata.get('filename', '')
-    u.has_sig = int(urldata.get('has_sig', 0))
-    u.md5_digest = urldata.get('md5_digest')
-    u.comment_text = urldata.get('comment_text', '')
-    u.packagetype = urldata.get('packagetype', '')
-    u.python_version = urldata.get('python_version', '')
-    u.downloads = int(urldata.get('downloads', 0))
-    u.size = int(urldata.get('size', 0))
-    if 'upload_time' in urldata:
-        upl = urldata['upload_time']
+def unique(items):
+    # PyPI data can repeat entries that our unique constraints forbid
+    seen = set()
+    return [i for i in items if not (i in seen or seen.add(i))]
+
+def release_values(data):
+    # One value per reldata_keys entry, None where the data has no value
+    return [data.get(k) for k in reldata_keys]
+
+def release_dependencies(data):
+    # [(dep_type, req)]
+    return unique([(k, req) for k in reldata_deps for req in data.get(k) or []])
+
+# Dependency types that name other projects we can link to
+reldata_edges = ['requires_dist', 'requires']
+
+def release_edges(data):
+    # [(target, marker)]
+    edges = []
+    for k in reldata_edges:
+        for req in data.get(k) or []:
+            parsed = parse_requirement(req)
+            if parsed:
+                edges.append(parsed)
+    return unique(edges)
+
+def url_values(urldata):
+    # One value per url_keys entry
+    upl = urldata.get('upload_time')
+    if upl is not None:
         if isinstance(upl, xmlrpc.client.DateTime):
             upl = datetime.datetime.strptime(upl.value, "%Y%m%dT%H:%M:%S")
         else:
             upl = datetime.datetime.strptime(upl, '%Y-%m-%dT%H:%M:%S')
-        u.upload_time = upl
-    return u
+    return [
+        urldata['url'],
+        urldata.get('filename', ''),
+        bool(int(urldata.get('has_sig', 0))),
+        urldata.get('md5_digest'),
+        urldata.get('comment_text', ''),
+        urldata.get('packagetype', ''),
+        urldata.get('python_version', ''),
+        int(urldata.get('downloads', 0)),
+        int(urldata.get('size', 0)),
+        upl,
+    ]
+
+def set_release_data(r, data, urls):
+    for k, v in zip(reldata_keys, release_values(data)):
+        setattr(r, k, v)
+    r.dependencies = [Dependency(dep_type=k, req=req)
+            for k, req in release_dependencies(data)]
+    r.dependency_edges = [DependencyEdge(target=target, marker=marker)
+            for target, marker in release_edges(data)]
+    r.project_urls = [ProjectURL(url=url)
+            for url in unique(data.get('project_urls') or [])]
+    r.classifiers = [Classifier(classifier=c)
+            for c in data.get('classifiers') or []]
+    r.urls = [new_url(url) for url in urls]
+
+def update_release_data(r, data, urls):
+    """Bring a stored release into line with data and urls, changing only what differs
+
+    Unchanged columns are left alone and unchanged child rows keep their
+    ids. Files are matched on filename. Returns the number of columns and
+    child rows written.
+    """
+    changed = 0
+    interned = set(name for cls, name in INTERNED if cls is Release)
+    for k, v in zip(reldata_keys, release_values(data)):
+        # Compare interned values by hash, to avoid loading them
+        if k in interned:
+            differs = getattr(r, k + '_id') != text_id(v)
+        else:
+            differs = getattr(r, k) != v
+        if differs:
+            setattr(r, k, v)
+            changed += 1
+
+    def sync(collection, key, want, make):
+        # want: [(key, value)], where keys may repeat. Rows whose key is
+        # wanted are kept, the rest removed, and make(value) adds the others.
+        have = {}
+        for row in collection:
+            have.setdefault(key(row), []).append(row)
+        n = 0
+        for k, value in want:
+            if have.get(k):
+                have[k].pop()
+            else:
+                collection.append(make(value))
+                n += 1
+        for rows in have.values():
+            for row in rows:
+                collection.remove(row)
+                n += 1
+        return n
+
+    changed += sync(r.dependencies, lambda d: (d.dep_type, d.req_id),
+        [((k, text_id(req)), (k, req)) for k, req in release_dependencies(data)],
+        lambda v: Dependency(dep_type=v[0], req=v[1]))
+    changed += sync(r.dependency_edges, lambda e: (e.target, e.marker),
+        [(edge, edge) for edge in release_edges(data)],
+        lambda v: DependencyEdge(target=v[0], marker=v[1]))
+    changed += sync(r.project_urls, lambda u: u.url,
+        [(url, url) for url in unique(data.get('project_urls') or [])],
+        lambda v: ProjectURL(url=v))
+    changed += sync(r.classifiers, lambda c: c.classifier_id,
+        [(text_id(c), c) for c in data.get('classifiers') or []],
+        lambda v: Classifier(classifier=v))
+
+    stored = dict((u.filename, u) for u in r.urls)
+    for urldata in urls:
+        values = dict(zip(url_keys, url_values(urldata)))
+        u = stored.pop(values['filename'], None)
+        if u is None:
+            r.urls.append(URL(**values))
+            changed += 1
+            continue
+        for k, v in values.items():
+            if getattr(u, k) != v:
+                setattr(u, k, v)
+                changed += 1
+    for u in stored.values():
+        r.urls.remove(u)
+        changed += 1
+    return changed
+
+def new_url(urldata):
+    return URL(**dict(zip(url_keys, url_values(urldata))))
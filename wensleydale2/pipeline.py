@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import threading
+
+# Concurrent fetching
+# ===================
+#
+# Fetching a package means one releases() call plus one
+# release_data_and_urls() call per release, all of which block on the
+# network for PYPISource. The functions here run those fetches on a pool of
+# threads and hand back finished (name, releases) pairs, so that a single
+# writer can own the SQLAlchemy session.
+
+class HostLimiter:
+    """Cap the number of concurrent source calls made to any one host"""
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._sems = {}
+    def _sem(self, host):
+        with self._lock:
+            sem = self._sems.get(host)
+            if sem is None:
+                sem = self._sems[host] = threading.BoundedSemaphore(self.limit)
+            return sem
+    def call(self, host, fn, *args):
+        with self._sem(host):
+            return fn(*args)
+
+def fetch_package(src, name, limiter=None):
+    """Fetch all release data for a package, without touching the database
+
+    Returns (name, releases), with releases a list of (version, data, urls).
+    """
+    if limiter is None:
+        return name, [
+            (ver,) + tuple(src.release_data_and_urls(name, ver))
+            for ver in src.releases(name)
+        ]
+    host = getattr(src, 'host', None)
+    versions = limiter.call(host, src.releases, name)
+    releases = []
+    for ver in versions:
+        data, urls = limiter.call(host, src.release_data_and_urls, name, ver)
+        releases.append((ver, data, urls))
+    return name, releases
+
+def fetch_packages(src, names, workers=8, queue_size=None, per_host=None):
+    """Fetch packages concurrently, yielding (name, releases) as they finish
+
+    At most workers + queue_size packages are in flight or waiting to be
+    consumed at any time, so a slow consumer stalls the fetchers rather than
+    letting results pile up in memory. Results are yielded in completion
+    order, not in the order of names.
+    """
+    if queue_size is None:
+        queue_size = workers
+    limiter = HostLimiter(per_host or workers)
+    names = iter(names)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = set(
+            pool.submit(fetch_package, src, name, limiter)
+            for name in islice(names, workers + queue_size)
+        )
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                pending.update(
+                    pool.submit(fetch_package, src, name, limiter)
+                    for name in islice(names, 1)
+                )
+                yield fut.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
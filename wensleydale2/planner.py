@@ -0,0 +1,110 @@
+from collections import namedtuple, OrderedDict
+
+# Changelog planning
+# ==================
+#
+# Changelog entries are replayed against the current state of the source,
+# not the state at the time of the change. So ten "add file" entries for a
+# release only need the release fetched once, and anything touching a
+# package that is later recreated or removed is covered by that. The
+# planner reduces a slice of the changelog to the net set of operations.
+
+# action is one of 'rename', 'remove_package', 'reload', 'remove_release'
+# or 'refresh'. old_name is only set for renames.
+Op = namedtuple('Op', 'action name version serial old_name')
+
+def classify(action, ver):
+    """What a changelog action means for the mirror
+
+    Returns one of the Op actions, None if the mirror is not affected, or
+    'unknown' for actions we do not recognise.
+    """
+    act = action.split()
+    if len(act) == 1 and act[0] == 'create':
+        return 'reload'
+    elif len(act) == 1 and act[0] == 'remove':
+        return 'remove_release' if ver else 'remove_package'
+    elif len(act) == 2 and act[0] == 'remove' and act[1] == 'release':
+        return 'remove_release'
+    elif len(act) == 2 and act[0] == 'new' and act[1] == 'release':
+        return 'refresh'
+    elif len(act) == 3 and act[0] == 'rename' and act[1] == 'from':
+        return 'rename'
+    elif len(act) > 2 and act[0] == 'add' and (act[1] == 'url' or act[2] == 'file'):
+        return 'refresh'
+    elif len(act) > 0 and act[0] == 'update' and ver:
+        return 'refresh'
+    elif len(act) > 0 and act[0] == 'docupdate':
+        return None # Possibly wrong...
+    elif len(act) > 1 and act[0] == 'update' and act[1] == 'hosting_mode':
+        return None
+    elif len(act) > 1 and act[0] == 'remove' and act[1] == 'file':
+        return 'refresh'
+    elif len(act) > 1 and (act[0] == 'remove' or act[0] == 'add') and (act[1] == 'Owner' or act[1] == 'Maintainer'):
+        return None # Nothing to do
+    return 'unknown'
+
+class PackagePlan:
+    def __init__(self, name):
+        self.name = name
+        self.rename_from = None
+        self.reload = False
+        self.drop = False
+        self.serial = 0
+        # version -> ('refresh' or 'remove_release', serial)
+        self.releases = OrderedDict()
+
+    def ops(self):
+        if self.rename_from:
+            yield Op('rename', self.name, None, self.serial, self.rename_from)
+        if self.drop:
+            yield Op('remove_package', self.name, None, self.serial, None)
+        elif self.reload:
+            yield Op('reload', self.name, None, self.serial, None)
+        for ver, (action, serial) in self.releases.items():
+            yield Op(action, self.name, ver, serial, None)
+
+def plan_changes(changes):
+    """Reduce changelog entries to a list of Ops with the same net effect"""
+    plans = OrderedDict()
+    ops = []
+    for name, ver, timestamp, action, serial in changes:
+        kind = classify(action, ver)
+        if kind == 'unknown':
+            print("Unknown action: {} for {}{}".format(action, name,  '/' + ver if ver else ""))
+            continue
+        elif kind is None:
+            continue
+        if kind == 'rename':
+            old = action.split()[2]
+            # Anything already planned for the new name happened before the
+            # rename, so it has to be done first.
+            if name in plans:
+                ops.extend(plans.pop(name).ops())
+            plan = plans.pop(old, None)
+            if plan is None or plan.drop:
+                if plan is not None:
+                    ops.extend(plan.ops())
+                plan = PackagePlan(old)
+            plan.rename_from = plan.rename_from or old
+            plan.name = name
+            plans[name] = plan
+        else:
+            plan = plans.get(name)
+            if plan is None:
+                plan = plans[name] = PackagePlan(name)
+            if kind == 'reload':
+                plan.reload = True
+                plan.drop = False
+                plan.releases.clear()
+            elif kind == 'remove_package':
+                plan.drop = True
+                plan.reload = False
+                plan.releases.clear()
+            elif not (plan.reload or plan.drop):
+                # A reload or removal already covers the release
+                plan.releases[ver] = (kind, serial)
+        plan.serial = max(plan.serial, serial)
+    for plan in plans.values():
+        ops.extend(plan.ops())
+    return ops
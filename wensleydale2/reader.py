@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+from sqlalchemy import func
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import select
+from .depgraph import dependencies, reverse_dependencies, dependency_closure
+from .engine import make_engine
+from .model import LatestChange, MirrorSession, Package, Release, URL
+from .search import search
+from .summary import package_summary, summaries_t
+
+# Read API
+# ========
+#
+# Reader is for programs that query a mirror from many threads while
+# something else keeps it up to date. Each thread gets its own session
+# from a scoped_session over a pooled engine, and query results are kept
+# in a shared LRU cache keyed on the query, its arguments and the mirror's
+# serial. When an update advances the serial the cache is emptied, so
+# results are never older than the last serial seen.
+#
+# The serial is read before each cached query, unless check_interval is
+# set, in which case it is read at most that often and results can be up
+# to that many seconds behind. If several threads ask for the same thing
+# at once, one runs the query and the rest wait for its result.
+#
+# Results are shared between threads, so they are plain tuples, frozensets
+# and dicts rather than ORM objects, and must not be modified.
+
+packages_t = Package.__table__
+releases_t = Release.__table__
+urls_t = URL.__table__
+latest_t = LatestChange.__table__
+
+URL_FIELDS = ['filename', 'url', 'packagetype', 'python_version', 'size', 'md5_digest',
+              'has_sig', 'upload_time']
+
+def reader_engine(url, pool_size=8, profile='wal'):
+    """An engine for Reader, with a connection pool even for SQLite files
+
+    SQLite files are otherwise opened afresh for every checkout. The wal
+    profile lets readers carry on while an update is committing.
+    """
+    kw = {}
+    if url.startswith('sqlite') and url not in ('sqlite://', 'sqlite:///:memory:'):
+        kw = dict(poolclass=QueuePool, pool_size=pool_size,
+                  connect_args={'check_same_thread': False})
+    return make_engine(url, profile, **kw)
+
+def cached(fn):
+    @wraps(fn)
+    def wrapper(self, *args, **kw):
+        key = (args, tuple(sorted(kw.items())))
+        return self._cached(fn.__name__, key, lambda session: fn(self, session, *args, **kw))
+    return wrapper
+
+class Reader:
+    def __init__(self, db, max_entries=1024, check_interval=0):
+        if isinstance(db, str):
+            db = reader_engine(db)
+        self.db = db
+        self.Session = scoped_session(sessionmaker(db, class_=MirrorSession))
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._serial = None
+        self._checked = 0
+
+    def close(self):
+        self.Session.remove()
+        self.db.dispose()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                    'serial': self._serial}
+
+    def _query(self, fn):
+        session = self.Session()
+        try:
+            return fn(session)
+        finally:
+            # Ending the transaction lets the next query see later updates
+            session.close()
+
+    def serial(self):
+        """The mirror's serial, emptying the cache if it has moved on"""
+        now = time.monotonic()
+        if self._serial is not None and now - self._checked < self.check_interval:
+            return self._serial
+        serial = self._query(lambda s: s.execute(select([func.max(latest_t.c.serial)])).scalar())
+        with self._lock:
+            self._checked = now
+            if serial != self._serial:
+                self._entries.clear()
+                self._serial = serial
+        return serial
+
+    def _cached(self, name, args, fn):
+        key = (name, args, self.serial())
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            pending = self._pending.get(key)
+            if pending is None:
+                self.misses += 1
+                future = self._pending[key] = Future()
+        if pending is not None:
+            return pending.result()
+        try:
+            result = self._query(fn)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+            # An update may have emptied the cache while the query ran
+            if key[2] == self._serial:
+                self._entries[key] = result
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    @cached
+    def packages(self, session):
+        """Every package name, sorted"""
+        sel = select([packages_t.c.name]).order_by(packages_t.c.name)
+        return tuple(r[0] for r in session.execute(sel))
+
+    @cached
+    def releases(self, session, name):
+        """The versions of package name, in PEP 440 order"""
+        sel = select([releases_t.c.version]).select_from(releases_t.join(packages_t)).where(
+            packages_t.c.name == name).order_by(releases_t.c.version_key)
+        return tuple(r[0] for r in session.execute(sel))
+
+    @cached
+    def latest_releases(self, session):
+        """{package name: version} of each package's latest visible release"""
+        sel = select([packages_t.c.name, summaries_t.c.version]).select_from(
+            summaries_t.join(packages_t, packages_t.c.id == summaries_t.c.package_id))
+        return dict(tuple(r) for r in session.execute(sel))
+
+    @cached
+    def package_summary(self, session, name):
+        return package_summary(session, name)
+
+    @cached
+    def release_files(self, session, name, version):
+        """A dict for each file of a release, with the URL_FIELDS keys"""
+        sel = select([urls_t.c[f] for f in URL_FIELDS]).select_from(
+            urls_t.join(releases_t).join(packages_t)).where(
+            (packages_t.c.name == name) & (releases_t.c.version == version)
+        ).order_by(urls_t.c.filename)
+        return tuple(dict(zip(URL_FIELDS, r)) for r in session.execute(sel))
+
+    @cached
+    def dependencies(self, session, name):
+        return frozenset(dependencies(session, name))
+
+    @cached
+    def reverse_dependencies(self, session, name):
+        return frozenset(reverse_dependencies(session, name))
+
+    @cached
+    def dependency_closure(self, session, name, reverse=False):
+        return frozenset(dependency_closure(session, name, reverse))
+
+    @cached
+    def search(self, session, query, limit=20):
+        return tuple(search(session, query, limit))
@@ -0,0 +1,37 @@
+from functools import lru_cache
+import re
+
+try:
+    from packaging.requirements import Requirement, InvalidRequirement
+except ImportError:
+    Requirement = None
+
+# Requirement parsing
+# ===================
+#
+# Dependency strings are parsed once, when a release is stored, into the
+# normalised project name they refer to plus any environment marker. The
+# packaging library is used if it is installed; otherwise a simple regex
+# pulls out the name and marker, which covers nearly everything on PyPI.
+
+NAME_RE = re.compile(r'\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+def normalize_name(name):
+    # PEP 503
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+@lru_cache(maxsize=65536)
+def parse_requirement(req):
+    """Return (normalised name, marker) for a requirement string, or None"""
+    if Requirement is not None:
+        try:
+            r = Requirement(req)
+        except InvalidRequirement:
+            pass
+        else:
+            return normalize_name(r.name), str(r.marker) if r.marker else None
+    m = NAME_RE.match(req)
+    if not m:
+        return None
+    marker = req.partition(';')[2].strip() or None
+    return normalize_name(m.group(1)), marker
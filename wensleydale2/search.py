@@ -0,0 +1,115 @@
+from sqlalchemy import inspect
+from sqlalchemy.sql import text
+
+# Full-text search
+# ================
+#
+# An optional SQLite FTS5 index over each release's summary, description
+# and keywords. It is an external content table over the release_text
+# view, so the text is not stored twice, and triggers on the releases
+# table keep it in step with every way of writing releases - the ORM
+# actions and the bulk loader alike. Results are joined back to packages
+# when searching, so renames need no index changes.
+#
+# The index is not part of the model, as not every SQLite build has FTS5.
+# Use create_search_index on a new or existing database; on an existing
+# one it indexes every release already there. rebuild_search_index
+# recreates the index contents from the releases table, if they are ever
+# out of step. Maintaining the index slows down loading, so for an
+# initial create it is quicker to create the index afterwards.
+
+FTS_TABLE = 'release_fts'
+
+# Descriptions are stored in the texts table, which is always written
+# before the releases that refer to it.
+DESCRIPTION = "(select value from texts where id = {}.description_id)"
+
+DDL = [
+    """create view release_text as
+        select r.id, r.summary, t.value as description, r.keywords
+        from releases r left join texts t on t.id = r.description_id""",
+    """create virtual table release_fts using fts5(
+        summary, description, keywords,
+        content='release_text', content_rowid='id'
+    )""",
+    """create trigger release_fts_insert after insert on releases begin
+        insert into release_fts(rowid, summary, description, keywords)
+        values (new.id, new.summary, {new}, new.keywords);
+    end""",
+    """create trigger release_fts_delete after delete on releases begin
+        insert into release_fts(release_fts, rowid, summary, description, keywords)
+        values ('delete', old.id, old.summary, {old}, old.keywords);
+    end""",
+    """create trigger release_fts_update after update of summary, description_id, keywords on releases begin
+        insert into release_fts(release_fts, rowid, summary, description, keywords)
+        values ('delete', old.id, old.summary, {old}, old.keywords);
+        insert into release_fts(rowid, summary, description, keywords)
+        values (new.id, new.summary, {new}, new.keywords);
+    end""",
+]
+
+# bm25 weights for summary, description and keywords. Descriptions are long
+# and wordy, so a match there counts for less.
+WEIGHTS = (10.0, 1.0, 5.0)
+
+def has_search_index(db):
+    return FTS_TABLE in inspect(db).get_table_names()
+
+def create_search_index(db):
+    """Create the search index and its triggers, indexing existing releases
+
+    Returns False if it already exists. Raises OperationalError if SQLite
+    was built without FTS5.
+    """
+    if has_search_index(db):
+        return False
+    with db.connect() as conn, conn.begin():
+        for stmt in DDL:
+            conn.execute(stmt.format(new=DESCRIPTION.format('new'), old=DESCRIPTION.format('old')))
+        conn.execute("insert into release_fts(release_fts) values ('rebuild')")
+    return True
+
+def rebuild_search_index(db):
+    """Recreate the index contents from the releases table"""
+    with db.connect() as conn, conn.begin():
+        conn.execute("insert into release_fts(release_fts) values ('rebuild')")
+
+def drop_search_index(db):
+    with db.connect() as conn, conn.begin():
+        for name in ('insert', 'delete', 'update'):
+            conn.execute("drop trigger if exists release_fts_{}".format(name))
+        conn.execute("drop table if exists release_fts")
+        conn.execute("drop view if exists release_text")
+
+def search(session, query, limit=20, per_package=True):
+    """Search releases, best matches first
+
+    query uses the FTS5 query syntax - words, "phrases", AND, OR, NOT and
+    prefix* searches. Returns a list of (package, version, summary, score)
+    where a lower score is a better match. With per_package set, only the
+    best matching release of each package is returned.
+    """
+    # bm25 can only be used in a query directly over the index, so the
+    # matches are scored first and then joined to their packages. SQLite
+    # does not flatten a subquery with a LIMIT into a join, which keeps
+    # the scoring query as it is without needing "as materialized", new
+    # in SQLite 3.35.
+    matches = """with m as (
+            select rowid, bm25(release_fts, {}, {}, {}) as score
+            from release_fts where release_fts match :query limit -1)
+        """.format(*WEIGHTS)
+    if per_package:
+        # SQLite takes the bare columns from the row that min() chose
+        sql = matches + """select p.name, r.version, r.summary, min(m.score) as best
+            from m
+            join releases r on r.id = m.rowid
+            join packages p on p.id = r.package_id
+            group by p.id order by best limit :limit"""
+    else:
+        sql = matches + """select p.name, r.version, r.summary, m.score
+            from m
+            join releases r on r.id = m.rowid
+            join packages p on p.id = r.package_id
+            order by m.score limit :limit"""
+    rows = session.execute(text(sql), {'query': query, 'limit': limit})
+    return [tuple(row) for row in rows]
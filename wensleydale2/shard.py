@@ -0,0 +1,98 @@
+from bisect import bisect_left
+from multiprocessing import Pool
+import os
+import pickle
+import tempfile
+from .bulk import BulkLoader, normalise
+
+# Sharded loading
+# ===============
+#
+# Loading from a JSONSource snapshot is bound by JSON decoding and row
+# building, not by the database. shard_load splits the package names into
+# ranges, has a pool of worker processes decode and normalise each range
+# into a temporary file, and merges the results into the target database
+# through a single BulkLoader, which assigns all the ids.
+
+# Normalised packages are pickled this many at a time
+CHUNK = 500
+
+def shard_bounds(src, shards):
+    """Split a JSONSource's package names into (start, stop) ranges
+
+    The first start and last stop are None, meaning unbounded.
+    """
+    total = src.package_count()
+    size = max(1, -(-total // shards))
+    bounds = [None]
+    for i, name in enumerate(src.packages()):
+        if i and i % size == 0:
+            bounds.append(name)
+    bounds.append(None)
+    return list(zip(bounds, bounds[1:]))
+
+def resume_point(done, start, stop):
+    # done is sorted. Shards are merged in name order, so the names already
+    # loaded from a shard are a prefix of it, ending at the returned name.
+    i = bisect_left(done, stop) if stop is not None else len(done)
+    if i and (start is None or done[i-1] >= start):
+        return done[i-1]
+    return None
+
+def load_shard(job):
+    url, start, stop, path, resume = job
+    from . import JSONSource
+    src = JSONSource(url)
+    n = 0
+    with open(path, 'wb') as f:
+        chunk = []
+        for name, releases in src.iter_packages(resume or start, stop):
+            if resume is not None and name <= resume:
+                continue
+            chunk.append(normalise(name, releases))
+            if len(chunk) == CHUNK:
+                pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+                chunk = []
+            n += 1
+        if chunk:
+            pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+    return path, n
+
+def read_shard(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            for item in chunk:
+                yield item
+
+def shard_load(url, connection, workers, serial=0, shards=None, batch=1000,
+        tmpdir=None, journal=False, skip=()):
+    """Load a JSONSource snapshot into connection's database using worker processes
+
+    url must name a database that every worker process can open, so an
+    in-memory SQLite database will not work. Packages named in skip are not
+    loaded. Returns the number of packages loaded.
+    """
+    from . import JSONSource
+    bounds = shard_bounds(JSONSource(url), shards or workers * 4)
+    skip = set(skip)
+    done = sorted(skip)
+    total = 0
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        jobs = [(url, start, stop, os.path.join(tmp, 'shard{}.pickle'.format(i)),
+                 resume_point(done, start, stop))
+                for i, (start, stop) in enumerate(bounds)]
+        loader = BulkLoader(connection, batch, journal)
+        with Pool(workers) as pool:
+            for path, n in pool.imap_unordered(load_shard, jobs):
+                for item in read_shard(path):
+                    if item[0] in skip:
+                        continue
+                    loader.add(item, serial)
+                    total += 1
+                os.remove(path)
+        loader.flush()
+    return total
@@ -0,0 +1,158 @@
+import datetime
+import json
+import os
+import struct
+import zlib
+from sqlalchemy import DateTime, func
+from sqlalchemy.sql import select
+from .model import Base, CreateJournal, LatestChange, reset_sequences
+
+# Snapshots
+# =========
+#
+# A snapshot is the whole mirror in one file, for setting up another copy
+# without fetching everything from PyPI again. The file is a sequence of
+# frames, each a 4-byte big-endian length followed by that many bytes of
+# zlib-compressed JSON:
+#
+#   ['header', {'format': 1, 'serial': N, 'tables': {name: [columns]}}]
+#   ['rows', table, [row, ...]]     at most CHUNK rows, tables in FK order
+#   ['end', {table: row count}]
+#
+# Rows are lists of values in the header's column order, with datetimes
+# as ISO 8601 strings. Being plain data, a snapshot from anywhere can be
+# restored safely.
+#
+# Rows keep their ids, so a restored mirror is the same as the original,
+# and as LatestChange is included, update carries on from the serial the
+# snapshot was taken at. Both ends work a frame at a time, so neither
+# holds more than a chunk of rows in memory.
+
+FORMAT = 1
+MAGIC = b'W2SNAP'
+CHUNK = 10000
+
+_length = struct.Struct('>I')
+
+# The create journal only matters to an interrupted create
+TABLES = [t for t in Base.metadata.sorted_tables if t is not CreateJournal.__table__]
+
+def snapshot_name(serial):
+    return 'mirror-{}.w2snap'.format(serial)
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError("Cannot write {!r} to a snapshot".format(value))
+
+def _write_frame(f, obj, level):
+    data = zlib.compress(json.dumps(obj, default=_json_default,
+                                    separators=(',', ':')).encode('utf-8'), level)
+    f.write(_length.pack(len(data)))
+    f.write(data)
+
+def _read_frames(f):
+    while True:
+        head = f.read(_length.size)
+        if not head:
+            return
+        if len(head) < _length.size:
+            raise ValueError("Snapshot is truncated")
+        n, = _length.unpack(head)
+        data = f.read(n)
+        if len(data) < n:
+            raise ValueError("Snapshot is truncated")
+        try:
+            yield json.loads(zlib.decompress(data).decode('utf-8'))
+        except (zlib.error, ValueError):
+            raise ValueError("Snapshot is damaged")
+
+def write_snapshot(db, path, chunk=CHUNK, level=3):
+    """Write the mirror to path, returning the serial it was taken at
+
+    If path is a directory, the file is named after the serial. Everything
+    is read in one transaction, so the snapshot is consistent even if the
+    mirror is being updated.
+    """
+    with db.connect() as conn, conn.begin():
+        serial = conn.execute(select([func.max(LatestChange.serial)])).scalar() or 0
+        if os.path.isdir(path):
+            path = os.path.join(path, snapshot_name(serial))
+        tmp = path + '.tmp'
+        counts = {}
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            _write_frame(f, ('header', {
+                'format': FORMAT,
+                'serial': serial,
+                'tables': {t.name: [c.name for c in t.c] for t in TABLES},
+            }), level)
+            for t in TABLES:
+                rs = conn.execution_options(stream_results=True).execute(
+                    select(list(t.c)).order_by(*t.primary_key.columns))
+                counts[t.name] = 0
+                while True:
+                    rows = rs.fetchmany(chunk)
+                    if not rows:
+                        break
+                    _write_frame(f, ('rows', t.name, [list(r) for r in rows]), level)
+                    counts[t.name] += len(rows)
+            _write_frame(f, ('end', counts), level)
+    os.replace(tmp, path)
+    return path, serial
+
+def read_snapshot(path):
+    """Yield the header, then (table, rows) for each chunk, checking counts"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a snapshot".format(path))
+        frames = _read_frames(f)
+        kind, header = next(frames)
+        if header['format'] > FORMAT:
+            raise ValueError("Snapshot format {} is newer than this version supports".format(
+                header['format']))
+        yield header
+        counts = {}
+        for frame in frames:
+            if frame[0] == 'end':
+                if {t: n for t, n in frame[1].items() if n} != counts:
+                    raise ValueError("Snapshot row counts do not match")
+                return
+            kind, table, rows = frame
+            counts[table] = counts.get(table, 0) + len(rows)
+            yield table, rows
+        raise ValueError("Snapshot is truncated")
+
+def restore_snapshot(db, path, progress=None):
+    """Load a snapshot into an empty database, returning its serial
+
+    Columns are matched by name, so a snapshot from an older schema can be
+    restored: columns it lacks are left to their defaults, and columns the
+    model no longer has are dropped. Each chunk is inserted in its own
+    transaction; progress, if given, is called with (table, rows) after
+    each. On PostgreSQL, id sequences are then moved past the restored ids.
+    """
+    Base.metadata.create_all(db)
+    tables = {t.name: t for t in TABLES}
+    with db.connect() as conn:
+        if conn.execute(select([func.count()]).select_from(tables['packages'])).scalar():
+            raise ValueError("Can only restore into an empty database")
+        frames = read_snapshot(path)
+        header = next(frames)
+        for table, rows in frames:
+            t = tables.get(table)
+            if t is None:
+                continue
+            keep = [(i, c, isinstance(t.c[c].type, DateTime))
+                    for i, c in enumerate(header['tables'][table]) if c in t.c]
+            with conn.begin():
+                conn.execute(t.insert(), [{c: _datetime(row[i]) if dt else row[i]
+                                           for i, c, dt in keep} for row in rows])
+            if progress:
+                progress(table, len(rows))
+        with conn.begin():
+            reset_sequences(conn, TABLES)
+    return header['serial']
+
+def _datetime(value):
+    return value if value is None else datetime.datetime.fromisoformat(value)
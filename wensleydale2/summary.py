@@ -0,0 +1,102 @@
+from itertools import chain
+from sqlalchemy import event, func
+from sqlalchemy.sql import select
+from .model import MirrorSession, Package, PackageSummary, Release, URL
+
+# Package summaries
+# =================
+#
+# The package_summaries table holds, for each package, its latest release
+# that is not hidden - the highest version in PEP 440 order, found with the
+# version_key index - along with its file count, total file size and
+# latest upload time, and the package's number of releases.
+# Finding these from releases and urls means a correlated subquery per
+# package; with the table they are a primary key lookup.
+#
+# Summaries are recomputed whole for every package touched by a write: the
+# ORM actions through an after_flush hook on MirrorSession, and the bulk
+# loader after each batch. Packages whose releases are all hidden have no
+# summary. Renames need no changes, as summaries are keyed by package id.
+# rebuild_summaries recomputes the whole table.
+
+packages_t = Package.__table__
+releases_t = Release.__table__
+urls_t = URL.__table__
+summaries_t = PackageSummary.__table__
+
+# Packages are refreshed this many at a time
+CHUNK = 500
+
+COLUMNS = ['package_id', 'release_id', 'version', 'release_count', 'file_count',
+           'total_size', 'upload_time']
+
+def summary_select(package_ids=None):
+    r = releases_t
+    other = releases_t.alias('other')
+    latest = select([other.c.id]).where(
+        (other.c.package_id == r.c.package_id) & other.c._pypi_hidden.isnot(True)
+    ).order_by(other.c.version_key.desc(), other.c.id.desc()).limit(1).as_scalar()
+    siblings = releases_t.alias('siblings')
+    release_count = select([func.count()]).where(
+        siblings.c.package_id == r.c.package_id).as_scalar()
+    sel = select([
+        r.c.package_id, r.c.id, r.c.version, release_count,
+        func.count(urls_t.c.id), func.coalesce(func.sum(urls_t.c.size), 0),
+        func.max(urls_t.c.upload_time),
+    ]).select_from(r.outerjoin(urls_t)).where(r.c.id == latest).group_by(
+        r.c.package_id, r.c.id, r.c.version)
+    if package_ids is not None:
+        sel = sel.where(r.c.package_id.in_(package_ids))
+    return sel
+
+def refresh_summaries(conn, package_ids):
+    """Recompute the summaries of the given packages, removing any that no longer exist"""
+    package_ids = sorted(set(package_ids))
+    for i in range(0, len(package_ids), CHUNK):
+        chunk = package_ids[i:i+CHUNK]
+        conn.execute(summaries_t.delete().where(summaries_t.c.package_id.in_(chunk)))
+        conn.execute(summaries_t.insert().from_select(COLUMNS, summary_select(chunk)))
+
+def rebuild_summaries(db):
+    """Recompute every package's summary, returning how many there are"""
+    with db.connect() as conn, conn.begin():
+        conn.execute(summaries_t.delete())
+        conn.execute(summaries_t.insert().from_select(COLUMNS, summary_select()))
+        return conn.execute(select([func.count()]).select_from(summaries_t)).scalar()
+
+def package_summary(session, name):
+    """The summary of package name as a dict, or None"""
+    sel = select([packages_t.c.name] + [summaries_t.c[c] for c in COLUMNS[1:]]).select_from(
+        summaries_t.join(packages_t, packages_t.c.id == summaries_t.c.package_id)
+    ).where(packages_t.c.name == name)
+    row = session.execute(sel).first()
+    return dict(row) if row else None
+
+def _package_id(obj, attr):
+    # Deleted rows keep the value they were loaded with
+    value = getattr(obj, attr)
+    if value is None:
+        history = getattr(type(obj), attr).impl.get_history(
+            obj._sa_instance_state, obj._sa_instance_state.dict)
+        value = next(iter(history.deleted or history.unchanged or ()), None)
+    return value
+
+@event.listens_for(MirrorSession, 'after_flush')
+def refresh_flushed(session, flush_context):
+    package_ids = set()
+    release_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Package):
+            package_ids.add(obj.id)
+        elif isinstance(obj, Release):
+            package_ids.add(_package_id(obj, 'package_id'))
+        elif isinstance(obj, URL):
+            release_ids.add(_package_id(obj, 'release_id'))
+    release_ids.discard(None)
+    if release_ids:
+        conn = session.connection()
+        package_ids.update(r[0] for r in conn.execute(
+            select([releases_t.c.package_id]).where(releases_t.c.id.in_(release_ids))))
+    package_ids.discard(None)
+    if package_ids:
+        refresh_summaries(session.connection(), package_ids)
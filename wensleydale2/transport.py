@@ -0,0 +1,96 @@
+from xmlrpc.client import ProtocolError, Transport, SafeTransport
+import http.client
+import random
+import threading
+import time
+from . import metrics
+
+# Retries and rate limiting
+# =========================
+#
+# PyPI answers overload with 429 or 503 responses, and a long run will
+# also see the odd dropped connection. Calls are retried with jittered
+# exponential backoff, and an AIMD limiter caps the number of calls in
+# flight: each success raises the cap a little, each throttling response
+# halves it.
+
+# HTTP status codes that are worth retrying, and those that mean slow down
+RETRY_CODES = (429, 500, 502, 503, 504)
+THROTTLE_CODES = (429, 503)
+
+class AdaptiveLimiter:
+    """Additive increase / multiplicative decrease concurrency limit"""
+    def __init__(self, initial=4, minimum=1, maximum=64, decrease=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.inflight = 0
+        self.throttled = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self._update(throttled)
+            self._cond.notify_all()
+
+    def _update(self, throttled):
+        self.inflight -= 1
+        if throttled:
+            self.throttled += 1
+            self.limit = max(self.minimum, self.limit * self.decrease)
+        else:
+            # Grows by about one per limit's worth of successes
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+def backoff_delay(attempt, base, cap):
+    # "Full jitter": uniform over the exponential window
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def call_with_retry(fn, retries=5, base=0.5, cap=60, limiter=None, sleep=time.sleep):
+    """Call fn(), retrying transient failures
+
+    Retries ProtocolErrors with a status in RETRY_CODES, and connection
+    errors. Any Retry-After header from the server is respected.
+    """
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire()
+        throttled = False
+        retry_after = 0
+        try:
+            return fn()
+        except ProtocolError as e:
+            if e.errcode not in RETRY_CODES or attempt == retries:
+                raise
+            throttled = e.errcode in THROTTLE_CODES
+            try:
+                retry_after = float((e.headers or {}).get('Retry-After', 0))
+            except ValueError:
+                pass
+        except (OSError, http.client.HTTPException):
+            if attempt == retries:
+                raise
+        finally:
+            if limiter:
+                limiter.release(throttled)
+        sleep(max(retry_after, backoff_delay(attempt, base, cap)))
+
+class _TimedParse:
+    # Reading a response body and decoding it happen together, as the XML
+    # is parsed as it arrives, so this times both.
+    def parse_response(self, response):
+        with metrics.timer('decode'):
+            return super().parse_response(response)
+
+class TimedTransport(_TimedParse, Transport):
+    pass
+
+class TimedSafeTransport(_TimedParse, SafeTransport):
+    pass
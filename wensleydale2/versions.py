@@ -0,0 +1,100 @@
+from functools import lru_cache
+import re
+from sqlalchemy.sql import select
+
+# Version keys
+# ============
+#
+# Each release stores a version_key alongside its version: a string whose
+# plain byte order is the PEP 440 order of the versions, so ordering,
+# "latest" and range queries can be done in SQL using an index rather
+# than by parsing every version in Python.
+#
+# A valid version's key is "1" followed by its parts in order of
+# significance:
+#
+#   epoch, release numbers   each number as a length character and its
+#                            digits, trailing zeros dropped, then "."
+#   pre-release phase        "0" for dev releases with no pre or post part,
+#                            "1", "2", "3" + number for a, b, rc, "4" for none
+#   post-release             "0" for none, "1" + number
+#   dev release              "0" + number, "1" for none
+#   local version            "+" then each segment, letters before numbers
+#
+# Versions that are not valid PEP 440 sort before all valid ones, keyed
+# by "0" and the version string itself, as pip treats them.
+#
+# The column is declared with the C collation on PostgreSQL, whose other
+# collations follow the locale rather than byte order.
+
+# From PEP 440, Appendix B
+VERSION_RE = re.compile(r"""
+    ^\s*v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?P<pre>[-_.]?(?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)[-_.]?(?P<pre_n>[0-9]+)?)?
+    (?P<post>(?:-(?P<post_n1>[0-9]+))|(?:[-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>[0-9]+)?))?
+    (?P<dev>[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>[0-9]+)?)?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+    \s*$
+""", re.VERBOSE | re.IGNORECASE)
+
+PHASES = {'a': '1', 'alpha': '1', 'b': '2', 'beta': '2',
+          'c': '3', 'rc': '3', 'pre': '3', 'preview': '3'}
+
+def _number(n):
+    # Longer numbers are bigger, so the length goes first
+    s = str(int(n or 0))
+    return chr(ord('A') + len(s)) + s
+
+@lru_cache(maxsize=65536)
+def version_key(version):
+    """The sortable key for a version string"""
+    m = VERSION_RE.match(version)
+    if not m:
+        return '0' + version
+    release = [int(n) for n in m.group('release').split('.')]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    key = ['1', _number(m.group('epoch'))]
+    key.extend(_number(n) for n in release)
+    key.append('.')
+    if m.group('pre'):
+        key.append(PHASES[m.group('pre_l').lower()] + _number(m.group('pre_n')))
+    elif m.group('dev') and not m.group('post'):
+        key.append('0')
+    else:
+        key.append('4')
+    if m.group('post'):
+        key.append('1' + _number(m.group('post_n1') or m.group('post_n2')))
+    else:
+        key.append('0')
+    key.append('0' + _number(m.group('dev_n')) if m.group('dev') else '1')
+    if m.group('local'):
+        key.append('+')
+        for part in re.split(r'[-_.]', m.group('local').lower()):
+            key.append('2' + _number(part) if part.isdigit() else '1' + part + '.')
+    return ''.join(key)
+
+def _versions(name):
+    # model uses version_key, so is imported here rather than at the top
+    from .model import Package, Release
+    releases_t = Release.__table__
+    packages_t = Package.__table__
+    sel = select([releases_t.c.version]).select_from(releases_t.join(packages_t)).where(
+        packages_t.c.name == name)
+    return sel, releases_t.c.version_key
+
+def version_range(session, name, low=None, high=None):
+    """Versions of package name with low <= version < high, in order"""
+    sel, key = _versions(name)
+    if low is not None:
+        sel = sel.where(key >= version_key(low))
+    if high is not None:
+        sel = sel.where(key < version_key(high))
+    return [r[0] for r in session.execute(sel.order_by(key))]
+
+def latest_version(session, name):
+    """The highest version of package name, or None"""
+    sel, key = _versions(name)
+    return session.execute(sel.order_by(key.desc()).limit(1)).scalar()